@@ -10,15 +10,43 @@ import threading
 # Too ManyStreams imports NOTE: must use relative import, else Dispatcharr fails to load the plugin
 from .src.TooManyStreams import TooManyStreams  # ensure correct import
 from .src.TooManyStreamsConfig import TooManyStreamsConfig, DEFAULT_CSS  # ensure correct import
+from .src.HotPathProfiler import HotPathProfiler
+from .src.SaturationStats import SaturationStats
 
 
 
 
+class _LazyClassAttribute:
+    """
+    Class attribute computed by `factory` on first access and then cached, so importing the plugin
+    does no disk or database work.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._computed = False
+        self._value = None
+
+    def __get__(self, obj, owner=None):
+        if not self._computed:
+            with self._lock:
+                if not self._computed:
+                    factory = self._factory.__func__ if isinstance(self._factory, staticmethod) else self._factory
+                    self._value = factory()
+                    self._computed = True
+        return self._value
+
+
 class Plugin:
     name = "too_many_streams"
     version = "1.1.0"
     description = "Handles scenarios where too many streams are open and what users see."
 
+    # Background services are started once per process, see __init__
+    _services_lock = threading.Lock()
+    _services_started = False
+
 
     def __init__(self):
         # Create a logger for this plugin
@@ -38,30 +66,63 @@ class Plugin:
         #         os.makedirs(_pkl_path, exist_ok=True)
         #     pickle.dump({}, open(TooManyStreams.TMS_MAXED_PKL, "wb"))
 
-        # Patch the Stream.get_stream method to return our custom stream when requested
+        # Patch the Stream.get_stream method to return our custom stream when requested.
+        # This only swaps a method, so the override works as soon as the plugin is loaded.
         TooManyStreams.install_get_stream_override()
+        # Like the override, the signal handler is needed in every process that may create channels
+        TooManyStreams.install_auto_attach()
+        # Stream managers run in whichever process serves the channel, so direct delivery is patched in every process too
+        TooManyStreams.install_proxy_feed(image_to_use)
 
         ### 
         # The below code should only have one instance. It may be called multiple times, but the server / threads should only start once.
         ###
         if not self._can_bind(HOST, PORT):
             return
+        with Plugin._services_lock:
+            if Plugin._services_started:
+                return
+            Plugin._services_started = True
 
-        # Check and install required packages
-        if not TooManyStreams.check_requirements_met():
-            TooManyStreams.install_requirements()
+        # Installs, binary checks and watchers can take a while (apt-get), so they run in the background
+        # and loading the plugin adds next to nothing to Dispatcharr's boot time
+        threading.Thread(
+            target=self._start_services,
+            args=(HOST, PORT, image_to_use),
+            daemon=True,
+        ).start()
 
+        self.logger.info("Too Many Streams plugin initialized.")
+
+    def _start_services(self, host: str, port: int, image_to_use: str|None) -> None:
+        """
+        Starts the slate server and background threads. Runs in its own thread, see __init__.
+        """
         TooManyStreams.start_maxed_channel_cleanup_thread()
-        # Start the HTTP server thread to serve the "Too Many Streams" image
+        # Start the HTTP server thread to serve the "Too Many Streams" image.
+        # Started first so it claims the port straight away; it only needs wkhtmltoimage once a slate is requested.
         threading.Thread(
             target=TooManyStreams.stream_still_mpegts_http_thread,
             args=(image_to_use,),
-            kwargs={"host": HOST, "port": PORT},
+            kwargs={"host": host, "port": port},
             daemon=True,  # dies when the main program exits
         ).start()
-            
 
-        self.logger.info("Too Many Streams plugin initialized.")
+        # Check and install required packages
+        if not TooManyStreams.check_requirements_met():
+            TooManyStreams.install_requirements()
+
+        # A static image is encoded once here and again only when the file changes
+        TooManyStreams.start_static_slate(image_to_use)
+        # Load the slates from before the restart (or render them), so the first saturation is served from cache
+        TooManyStreams.start_slate_warmup(image_to_use)
+        # Keep the slate current as channels start and stop, instead of rendering on first request
+        TooManyStreams.start_active_channel_watcher(image_to_use)
+        # Build the slate before profiles are saturated, so the first refused viewer doesn't wait for it
+        TooManyStreams.start_saturation_watcher(image_to_use)
+        # Time at max and peak usage for the saturation stats; refusals are counted in get_stream itself
+        TooManyStreams.start_saturation_stats_sampler()
+        self.logger.info("Too Many Streams background services started.")
 
     @staticmethod
     def _can_bind(host, port) -> bool:
@@ -74,45 +135,51 @@ class Plugin:
             s.close()
             return False
 
-    _persisted_config = TooManyStreamsConfig.get_plugin_persistent_config()
-    _title_default = _persisted_config.get("stream_title", "Sorry, this channel is unavailable.")
-    _description_default = _persisted_config.get("stream_description", "While this channel is not currently available, here are some other channels you can watch.")
-    _cols_default = _persisted_config.get("stream_channel_cols", 5)
-    _css_default = _persisted_config.get("stream_channel_css", DEFAULT_CSS)
-    # Settings rendered by UI
-    fields = [
-        {
-            "id": "stream_title",
-            "label": "Stream Title",
-            "type": "string",  # multiline
-            "default": _title_default,
-            "placeholder": "The title displayed on the 'Too Many Streams' image.",
-            "help_text": "The title displayed on the 'Too Many Streams' image.",
-        },
-        {
-            "id": "stream_description",
-            "label": "Stream Description",
-            "type": "string",  # multiline
-            "default": _description_default,
-            "placeholder": "The description displayed on the 'Too Many Streams' image.",
-            "help_text": "The description displayed on the 'Too Many Streams' image.",
-        },
-        {
-            "id": "stream_channel_cols",
-            "label": "number of channel columns",
-            "type": "number",
-            "default": _cols_default,
-            "placeholder": "The number of columns of channels to display on the 'Too Many Streams' image.",
-            "help_text": "The number of columns of channels to display on the 'Too Many Streams' image.",
-        },
-        {
-            "id": "stream_channel_css",
-            "label": "Custom CSS for channel layout",
-            "type": "text",
-            "default": _css_default,
-            "help_text": "You can customize the classes in the rendered HTML",
-        },
-    ]
+    @staticmethod
+    def _build_fields() -> list[dict]:
+        """
+        Settings rendered by UI. Defaults come from the persisted config, which is only read on first access.
+        """
+        _persisted_config = TooManyStreamsConfig.get_plugin_persistent_config()
+        _title_default = _persisted_config.get("stream_title", "Sorry, this channel is unavailable.")
+        _description_default = _persisted_config.get("stream_description", "While this channel is not currently available, here are some other channels you can watch.")
+        _cols_default = _persisted_config.get("stream_channel_cols", 5)
+        _css_default = _persisted_config.get("stream_channel_css", DEFAULT_CSS)
+        return [
+            {
+                "id": "stream_title",
+                "label": "Stream Title",
+                "type": "string",  # multiline
+                "default": _title_default,
+                "placeholder": "The title displayed on the 'Too Many Streams' image.",
+                "help_text": "The title displayed on the 'Too Many Streams' image.",
+            },
+            {
+                "id": "stream_description",
+                "label": "Stream Description",
+                "type": "string",  # multiline
+                "default": _description_default,
+                "placeholder": "The description displayed on the 'Too Many Streams' image.",
+                "help_text": "The description displayed on the 'Too Many Streams' image.",
+            },
+            {
+                "id": "stream_channel_cols",
+                "label": "number of channel columns",
+                "type": "number",
+                "default": _cols_default,
+                "placeholder": "The number of columns of channels to display on the 'Too Many Streams' image.",
+                "help_text": "The number of columns of channels to display on the 'Too Many Streams' image.",
+            },
+            {
+                "id": "stream_channel_css",
+                "label": "Custom CSS for channel layout",
+                "type": "text",
+                "default": _css_default,
+                "help_text": "You can customize the classes in the rendered HTML",
+            },
+        ]
+
+    fields = _LazyClassAttribute(_build_fields)
 
     actions = [
         {
@@ -135,6 +202,16 @@ class Plugin:
                 "message": "Removes the 'Too Many Streams' stream from all channels.",
             },
         },
+        {
+            "id": "dump_get_stream_profile",
+            "label": "Dump get_stream profile",
+            "description": "Logs p50/p90/p99 timings of the patched get_stream (DB, Redis, maxed checks, side effects). Requires TMS_PROFILE_SAMPLE_RATE > 0.",
+        },
+        {
+            "id": "dump_saturation_stats",
+            "label": "Dump saturation stats",
+            "description": "Logs refusals, time at max and peak connections per M3U profile and channel over the TMS_STATS_WINDOWS windows (default 1h, 24h, 7d). Also available at /stats/saturation.",
+        },
         {
             "id": "save_plugin_config",
             "label": "Save Plugin Config",
@@ -160,10 +237,19 @@ class Plugin:
             TooManyStreams.remove_from_all_channels()
         elif action == "save_plugin_config":
             TooManyStreamsConfig.save_plugin_persistent_config(TooManyStreamsConfig.get_plugin_config())
+        elif action == "dump_get_stream_profile":
+            return {"status": "ok", "message": HotPathProfiler.dump()}
+        elif action == "dump_saturation_stats":
+            return {"status": "ok", "message": SaturationStats.dump()}
 
         pass
 
     
-# Expose schema for UIs that look at module-level
-fields = Plugin.fields
-actions = Plugin.actions
\ No newline at end of file
+# Expose schema for UIs that look at module-level. `fields` is resolved on first access, see _LazyClassAttribute.
+actions = Plugin.actions
+
+
+def __getattr__(name):
+    if name == "fields":
+        return Plugin.fields
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Offline benchmark of the patched Channel.get_stream (TooManyStreams.install_get_stream_override).
+
+Runs the wrapped get_stream against an in-memory Redis and stub Channel/Stream/M3UAccount/profile
+models (see benchmarks/stubs.py), so no Dispatcharr install is needed. Every size option accepts a
+comma separated list; all combinations are run.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_get_stream
+    python -m benchmarks.bench_get_stream --channels 50,500 --saturation 0,0.5,1 --json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks import stubs
+
+REDIS = stubs.install()
+
+from src.TooManyStreams import TooManyStreams  # noqa: E402  (needs the stubs installed first)
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def _float_list(value: str) -> list[float]:
+    return [float(v) for v in value.split(",")]
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_case(channels: int, streams: int, accounts: int, profiles: int, max_streams: int,
+             saturation: float, calls: int, warmup: int, seed: int) -> dict:
+    """
+    Runs one benchmark case and returns its results.
+    `saturation` is the fraction of profiles whose connection counter is at max_streams.
+    """
+    rng = random.Random(seed)
+    REDIS._data.clear()
+    REDIS._expires.clear()
+    if os.path.exists(TooManyStreams.TMS_MAXED_PKL):
+        os.remove(TooManyStreams.TMS_MAXED_PKL)
+
+    channel_objs = stubs.build_fixture(channels, streams, accounts, profiles, max_streams)
+    profile_objs = stubs.profiles()
+    saturated = rng.sample(profile_objs, round(len(profile_objs) * saturation))
+    baseline = {f"profile_connections:{p.id}": str(p.max_streams).encode() for p in saturated}
+
+    def _reset_state():
+        # Undo what a successful get_stream assigned, so every call sees the same saturation
+        for key in [k for k in REDIS._data if k.startswith(("channel_stream:", "stream_profile:", "profile_connections:"))]:
+            REDIS._data.pop(key, None)
+        REDIS._data.update(baseline)
+
+    _reset_state()
+    latencies = []
+    redis_ops = db_queries = db_writes = 0
+    outcomes = {"assigned": 0, "slate": 0, "refused": 0}
+    for i in range(warmup + calls):
+        channel = rng.choice(channel_objs)
+        ops_before = REDIS.ops
+        stats_before = dict(stubs.STATS)
+        start = time.perf_counter()
+        stream_id, profile_id, error = channel.get_stream()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            latencies.append(elapsed)
+            redis_ops += REDIS.ops - ops_before
+            db_queries += stubs.STATS["db_queries"] - stats_before["db_queries"]
+            db_writes += stubs.STATS["db_writes"] - stats_before["db_writes"]
+            if error:
+                outcomes["refused"] += 1
+            elif f"profile_connections:{profile_id}" in baseline:
+                outcomes["slate"] += 1
+            else:
+                outcomes["assigned"] += 1
+        _reset_state()
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "channels": channels,
+        "streams_per_channel": streams,
+        "accounts": accounts,
+        "profiles_per_account": profiles,
+        "saturation": saturation,
+        "calls": calls,
+        "calls_per_sec": round(calls / total, 1) if total else 0.0,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 4),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 4),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4),
+        "redis_ops_per_call": round(redis_ops / calls, 2),
+        "db_queries_per_call": round(db_queries / calls, 2),
+        "db_writes_per_call": round(db_writes / calls, 2),
+        "outcomes": outcomes,
+    }
+
+
+def main(argv: list[str]|None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=_int_list, default=[100], help="Number of channels (default 100)")
+    parser.add_argument("--streams", type=_int_list, default=[3], help="Streams per channel (default 3)")
+    parser.add_argument("--accounts", type=_int_list, default=[2], help="M3U accounts (default 2)")
+    parser.add_argument("--profiles", type=_int_list, default=[2], help="Profiles per M3U account (default 2)")
+    parser.add_argument("--max-streams", type=int, default=2, help="max_streams of every profile (default 2)")
+    parser.add_argument("--saturation", type=_float_list, default=[0.0, 0.5, 1.0],
+                        help="Fraction of profiles at their limit (default 0,0.5,1)")
+    parser.add_argument("--calls", type=int, default=2000, help="Measured calls per case (default 2000)")
+    parser.add_argument("--warmup", type=int, default=200, help="Unmeasured calls per case (default 200)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as td:
+        TooManyStreams.TMS_MAXED_PKL = os.path.join(td, "mark_maxed.pkl")
+        TooManyStreams.install_get_stream_override()
+        results = [
+            run_case(c, s, a, p, args.max_streams, sat, args.calls, args.warmup, args.seed)
+            for c, s, a, p, sat in itertools.product(
+                args.channels, args.streams, args.accounts, args.profiles, args.saturation
+            )
+        ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        header = f"{'chan':>6} {'str':>4} {'acc':>4} {'prof':>4} {'sat':>5} {'calls/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'redis/c':>8} {'dbq/c':>6} {'dbw/c':>6}"
+        print(header)
+        for r in results:
+            print(f"{r['channels']:>6} {r['streams_per_channel']:>4} {r['accounts']:>4} {r['profiles_per_account']:>4} "
+                  f"{r['saturation']:>5.2f} {r['calls_per_sec']:>10.1f} {r['p50_ms']:>8.4f} {r['p99_ms']:>8.4f} "
+                  f"{r['redis_ops_per_call']:>8.2f} {r['db_queries_per_call']:>6.2f} {r['db_writes_per_call']:>6.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
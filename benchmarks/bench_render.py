@@ -0,0 +1,214 @@
+"""
+Benchmark of the slate render pipeline (ActiveStreamImgGen.html_doc + rasterize).
+
+Feeds synthetic channel lists into ActiveStreamImgGen and times the three stages separately:
+    html_ms   - building the HTML document, excluding logo embedding
+    embed_ms  - reading local logos and embedding them as data URIs
+    raster_ms - wkhtmltoimage turning the HTML into a JPG
+Each case runs cold (embedded logo cache cleared before every build) and warm (cache filled by an
+unmeasured build first). Logo types:
+    local   - a PNG file per channel, embedded as a data URI
+    remote  - an http:// URL per channel, served from a local HTTP server and fetched by wkhtmltoimage
+    missing - a path that does not exist, replaced by the 1x1 fallback
+Rasterization is skipped (raster_ms is null) when wkhtmltoimage is not installed, or with --no-raster.
+
+Results are printed as JSON, one object per case, for tracking over time.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_render
+    python -m benchmarks.bench_render --channels 0,12,100 --cols 4 --logos local,remote --repeat 5 > render.json
+"""
+import argparse
+import functools
+import http.server
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from benchmarks import stubs
+
+stubs.install()
+
+from src.ActiveStreamImgGen import ActiveStreamImgGen  # noqa: E402  (needs the stubs installed first)
+
+LOGO_TYPES = ("local", "remote", "missing")
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def _png(width: int, height: int, rng: random.Random) -> bytes:
+    """
+    Returns a valid RGBA PNG of noise, so logos have a realistic size and decode cost.
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    rows = b"".join(b"\x00" + rng.randbytes(width * 4) for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _write_logos(logo_dir: str, count: int, size: int, seed: int) -> None:
+    rng = random.Random(seed)
+    for i in range(count):
+        with open(os.path.join(logo_dir, f"logo_{i}.png"), "wb") as f:
+            f.write(_png(size, size, rng))
+
+
+def _serve_logos(logo_dir: str) -> str:
+    """
+    Serves `logo_dir` over HTTP on a free local port and returns its base URL.
+    """
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=logo_dir)
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _channels(count: int, logo_type: str, logo_dir: str, base_url: str) -> list[tuple[str, str, str]]:
+    channels = []
+    for i in range(count):
+        if logo_type == "local":
+            icon = os.path.join(logo_dir, f"logo_{i}.png")
+        elif logo_type == "remote":
+            icon = f"{base_url}/logo_{i}.png"
+        else:
+            icon = os.path.join(logo_dir, "missing", f"logo_{i}.png")
+        channels.append((f"#{i + 1}", icon, f"Synthetic Channel {i + 1}"))
+    return channels
+
+
+def _build_html(gen: ActiveStreamImgGen) -> tuple[str, float, float]:
+    """
+    Builds the HTML once and returns it with (html seconds excluding embedding, embedding seconds).
+    """
+    embed = 0.0
+    file_to_data_uri = gen.file_to_data_uri
+
+    def timed_file_to_data_uri(path: str) -> str:
+        nonlocal embed
+        start = time.perf_counter()
+        try:
+            return file_to_data_uri(path)
+        finally:
+            embed += time.perf_counter() - start
+
+    gen.file_to_data_uri = timed_file_to_data_uri
+    try:
+        start = time.perf_counter()
+        html = gen.html_doc()
+        total = time.perf_counter() - start
+    finally:
+        del gen.file_to_data_uri
+    return html, total - embed, embed
+
+
+def _stats(values: list[float]) -> dict|None:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "mean_ms": round(statistics.mean(values) * 1000, 3),
+        "min_ms": round(values[0] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+def run_case(channels: int, cols: int, logo_type: str, cache: str, repeat: int, raster: bool,
+             logo_dir: str, base_url: str) -> dict:
+    gen = ActiveStreamImgGen(
+        title="Sorry, this channel is unavailable.",
+        description="While this channel is not currently available, here are some other channels you can watch.",
+        html_cols=cols,
+    )
+    gen.active_streams = _channels(channels, logo_type, logo_dir, base_url)
+
+    ActiveStreamImgGen.clear_asset_cache()
+    if cache == "warm":
+        gen.html_doc()
+
+    html_times, embed_times, raster_times = [], [], []
+    html_bytes = 0
+    jpg_bytes = None
+    for _ in range(repeat):
+        if cache == "cold":
+            ActiveStreamImgGen.clear_asset_cache()
+        html, html_s, embed_s = _build_html(gen)
+        html_times.append(html_s)
+        embed_times.append(embed_s)
+        html_bytes = len(html.encode("utf-8"))
+        if raster:
+            start = time.perf_counter()
+            jpg_bytes = len(gen.rasterize(html))
+            raster_times.append(time.perf_counter() - start)
+
+    return {
+        "channels": channels,
+        "html_cols": cols,
+        "logos": logo_type,
+        "cache": cache,
+        "repeat": repeat,
+        "html_bytes": html_bytes,
+        "html_ms": _stats(html_times),
+        "embed_ms": _stats(embed_times),
+        "raster_ms": _stats(raster_times),
+        "jpg_bytes": jpg_bytes,
+    }
+
+
+def main(argv: list[str]|None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=_int_list, default=[0, 12, 50, 100], help="Channel counts (default 0,12,50,100)")
+    parser.add_argument("--cols", type=_int_list, default=[3, 4, 6], help="html_cols values (default 3,4,6)")
+    parser.add_argument("--logos", default=",".join(LOGO_TYPES), help=f"Comma separated, from {', '.join(LOGO_TYPES)}")
+    parser.add_argument("--cache", default="cold,warm", help="Comma separated, from cold, warm (default both)")
+    parser.add_argument("--logo-size", type=int, default=256, help="Logo width/height in pixels (default 256)")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured builds per case (default 3)")
+    parser.add_argument("--no-raster", action="store_true", help="Skip wkhtmltoimage, time HTML build and embedding only")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    raster = not args.no_raster and shutil.which("wkhtmltoimage") is not None
+    if not args.no_raster and not raster:
+        print("wkhtmltoimage not found, skipping rasterization", file=sys.stderr)
+
+    logos = [name.strip() for name in args.logos.split(",") if name.strip()]
+    caches = [name.strip() for name in args.cache.split(",") if name.strip()]
+    with tempfile.TemporaryDirectory() as td:
+        logo_dir = os.path.join(td, "logos")
+        os.makedirs(logo_dir)
+        _write_logos(logo_dir, max(args.channels), args.logo_size, args.seed)
+        base_url = _serve_logos(logo_dir)
+        results = [
+            run_case(c, cols, logo, cache, args.repeat, raster, logo_dir, base_url)
+            for c, cols, logo, cache in itertools.product(args.channels, args.cols, logos, caches)
+        ]
+
+    print(json.dumps({
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "wkhtmltoimage": shutil.which("wkhtmltoimage") if raster else None,
+        "logo_size": args.logo_size,
+        "results": results,
+    }, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
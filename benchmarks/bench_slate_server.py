@@ -0,0 +1,400 @@
+"""
+Load test for the slate HTTP server (TooManyStreams.stream_still_mpegts_http_thread).
+
+The server runs in-process against the stubs in benchmarks/stubs.py, with a fake set of active
+channels in the in-memory Redis. ffmpeg and wkhtmltoimage are replaced by tiny stand-in executables
+on PATH that sleep for a configurable time and write fake output of realistic size, so the server,
+cache and subprocess handling are exercised without real encodes.
+
+N concurrent clients open /stream.ts, read for a random time, disconnect and reconnect after a short
+pause, until --duration is up. Every scenario (server mode + cache option) runs with the same settings.
+The proxy-* scenarios replace the clients with a stand-in for ts_proxy's stream manager, which fills a
+stand-in stream buffer either over HTTP or, with direct delivery, without the server (see ProxyFeed).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_slate_server
+    python -m benchmarks.bench_slate_server --clients 50 --duration 20 --scenarios dynamic-warm,static --json
+"""
+import argparse
+import functools
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import stat
+import statistics
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+
+from benchmarks import stubs
+
+REDIS = stubs.install()
+
+from src.TooManyStreams import TooManyStreams  # noqa: E402  (needs the stubs installed first)
+from src.Metrics import Metrics  # noqa: E402
+
+
+# Server mode + cache option combinations. `cold` flushes the slate cache before every connection.
+SCENARIOS = {
+    "dynamic-warm": {"static": False, "cold": False, "path": "/stream.ts"},
+    # Every connection waits for a render; with `stale`, it gets the last good slate while the render runs
+    "dynamic-cold": {"static": False, "cold": True, "path": "/stream.ts", "stale": False},
+    "dynamic-cold-stale": {"static": False, "cold": True, "path": "/stream.ts"},
+    "static": {"static": True, "cold": False, "path": "/stream.ts"},
+    # As started by the plugin: the image is encoded once and served from memory, see StaticSlate
+    "static-precompiled": {"static": True, "cold": False, "path": "/stream.ts", "precompile": True},
+    # Clients are stand-ins for ts_proxy's stream manager filling a channel's stream buffer, pulling
+    # /stream.ts over HTTP or fed in process (TMS_DELIVERY=direct, see ProxyFeed)
+    "proxy-http": {"static": False, "cold": False, "path": "/stream.ts", "delivery": "http"},
+    "proxy-direct": {"static": False, "cold": False, "path": "/stream.ts", "delivery": "direct"},
+    # Halfway through, the channel is switched to an upstream that isn't the slate URL (the same server under
+    # another host name), which the stream manager then fetches over HTTP
+    "proxy-direct-switch": {"static": False, "cold": False, "path": "/stream.ts", "delivery": "direct", "switch": True},
+}
+
+_FAKE_FFMPEG = """\
+#!{python}
+# Stand-in for ffmpeg: answers -encoders, otherwise sleeps and writes a fake MPEG-TS of realistic size.
+import os, sys, time
+args = sys.argv[1:]
+if "-encoders" in args:
+    print("ffmpeg version 6.0-bench Copyright (c) 2000-2023 the FFmpeg developers", file=sys.stderr)
+    print("Encoders:")
+    print(" V..... = Video")
+    print(" A..... = Audio")
+    print(" ------")
+    print(" V....D libx264              libx264 H.264")
+    print(" A....D aac                  AAC (Advanced Audio Coding)")
+    print(" A....D mp2                  MP2 (MPEG audio layer 2)")
+    sys.exit(0)
+if "pipe:0" in args:
+    sys.stdin.buffer.read()
+time.sleep(int(os.environ.get("TMS_BENCH_ENCODE_MS", "300")) / 1000)
+seconds = float(args[args.index("-t") + 1]) if "-t" in args else 60
+muxrate = args[args.index("-muxrate") + 1] if "-muxrate" in args else "900k"
+bits = float(muxrate.rstrip("kK")) * 1000
+packets = int(seconds * bits / 8 / 188)
+packet = b"\\x47" + bytes(187)
+with open(args[-1], "wb") as f:
+    f.write(packet * packets)
+"""
+
+_FAKE_WKHTML = """\
+#!{python}
+# Stand-in for wkhtmltoimage: sleeps and writes a fake JPEG or BMP.
+import os, struct, sys, time
+if "--version" in sys.argv:
+    print("wkhtmltoimage 0.12.6-bench")
+    sys.exit(0)
+args = sys.argv[1:]
+time.sleep(int(os.environ.get("TMS_BENCH_RENDER_MS", "500")) / 1000)
+if args[args.index("--format") + 1] == "bmp":
+    # 24 bit bottom-up BMP of the requested size
+    width, height = int(args[args.index("--width") + 1]), int(args[args.index("--height") + 1])
+    stride = (width * 3 + 3) & ~3
+    image = (b"BM" + struct.pack("<IHHI", 54 + stride * height, 0, 0, 54)
+             + struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, stride * height, 2835, 2835, 0, 0)
+             + bytes(stride * height))
+else:
+    image = b"\\xff\\xd8\\xff\\xe0" + bytes(150_000) + b"\\xff\\xd9"
+if args[-1] == "-":
+    sys.stdin.buffer.read()
+    sys.stdout.buffer.write(image)
+else:
+    with open(args[-1], "wb") as f:
+        f.write(image)
+"""
+
+
+def _install_fake_binaries(bin_dir: str) -> None:
+    for name, source in (("ffmpeg", _FAKE_FFMPEG), ("wkhtmltoimage", _FAKE_WKHTML)):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(source.replace("{python}", sys.executable))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+
+def _setup_active_channels(count: int) -> None:
+    """
+    Creates `count` channels and marks them active in the fake ts_proxy metadata.
+    """
+    for channel in stubs.build_fixture(count, 1, 1, 1):
+        REDIS.hset(f"ts_proxy:channel:{channel.uuid}:metadata", mapping={"state": "active"})
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(image_path: str|None) -> int:
+    port = _free_port()
+    threading.Thread(
+        target=TooManyStreams.stream_still_mpegts_http_thread,
+        args=(image_path,),
+        kwargs={"host": "127.0.0.1", "port": port},
+        daemon=True,
+    ).start()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Slate server did not start")
+
+
+def _flush_slate_cache() -> None:
+    for key in [k for k in REDIS._data if k.startswith("tms:slate:")]:
+        REDIS._data.pop(key, None)
+        REDIS._expires.pop(key, None)
+    # The on-disk artifact cache too, or cold runs would be served from disk
+    shutil.rmtree(os.environ["TMS_ARTIFACT_DIR"], ignore_errors=True)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Monitor(threading.Thread):
+    """
+    Samples RSS, thread count and running helper processes while a scenario runs.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop = threading.Event()
+        self.peak_rss = self.peak_threads = self.peak_processes = 0
+
+    def run(self):
+        while not self.stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            running = sum(v for _, v in Metrics.PROCESSES._values.items())
+            self.peak_processes = max(self.peak_processes, int(running))
+            time.sleep(0.05)
+
+
+def _client(port: int, path: str, until: float, cold: bool, mean_watch: float, rng: random.Random, results: dict,
+            lock: threading.Lock) -> None:
+    while time.time() < until:
+        if cold:
+            _flush_slate_cache()
+        watch_for = rng.expovariate(1 / mean_watch)
+        start = time.perf_counter()
+        received = 0
+        ttfb = None
+        # A connection fails if no slate byte arrives; dropping out mid-stream is normal viewer behaviour
+        ok = False
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        try:
+            conn.request("GET", path)
+            sock = conn.sock  # the connection lets go of it once the response says "Connection: close"
+            resp = conn.getresponse()
+            if resp.status == 200:
+                first = resp.read(1)
+                if first:
+                    ttfb = time.perf_counter() - start
+                    received += len(first)
+                    ok = True
+                while (left := watch_for - (time.perf_counter() - start)) > 0:
+                    # Live streams are paced, so don't wait for data past the watch time
+                    sock.settimeout(max(0.05, left))
+                    buf = resp.read1(64 * 1024)
+                    if not buf:
+                        break
+                    received += len(buf)
+        except TimeoutError:
+            pass
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        with lock:
+            results["connections"] += 1
+            results["failures"] += 0 if ok else 1
+            results["bytes"] += received
+            if ttfb is not None:
+                results["ttfb"].append(ttfb)
+        # Players retry quickly, with some jitter
+        time.sleep(rng.uniform(0.05, 0.5))
+
+
+class _TimedStreamManager(stubs.StreamManager):
+    """
+    Stream manager stand-in that stops itself `watch_for` seconds after its first chunk, like a viewer
+    watching the slate for that long. Like the HTTP clients, it waits up to 60 seconds for the first chunk.
+    With `switch_to`, the channel is switched to that upstream halfway through.
+    """
+
+    def __init__(self, channel_id, url, buffer, watch_for: float, switch_to: str|None = None):
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.deadline = self.start + 60
+        self.watch_for = watch_for
+        self.switch_to = switch_to
+        self.switch_at = None
+        # Watching time left when the channel was switched
+        self.switched_left = 0.0
+        # Bytes received from the upstream switched to
+        self.switched_bytes = 0
+        buffer.on_chunk = self._on_chunk
+        super().__init__(channel_id, url, buffer)
+
+    def _on_chunk(self, chunk: bytes) -> None:
+        now = time.perf_counter()
+        if self.ttfb is None:
+            self.ttfb = now - self.start
+            self.deadline = min(self.deadline, now + self.watch_for)
+            self.switch_at = now + self.watch_for / 2
+        if self.switch_to is not None and self.url == self.switch_to:
+            self.switched_bytes += len(chunk)
+
+    @property
+    def running(self) -> bool:
+        now = time.perf_counter()
+        # Checked often by whatever fills the buffer, so this is where the switch happens
+        if self.switch_to is not None and self.switch_at is not None and now >= self.switch_at and self.url != self.switch_to:
+            self.update_url(self.switch_to)
+            self.switched_left = self.deadline - now
+        return now < self.deadline
+
+    @running.setter
+    def running(self, value: bool) -> None:
+        if not value:
+            self.deadline = 0
+
+
+def _proxy_client(port: int, path: str, until: float, cold: bool, mean_watch: float, rng: random.Random,
+                  results: dict, lock: threading.Lock, switch: bool = False) -> None:
+    while time.time() < until:
+        if cold:
+            _flush_slate_cache()
+        buffer = stubs.StreamBuffer()
+        manager = _TimedStreamManager(0, f"http://127.0.0.1:{port}{path}", buffer, rng.expovariate(1 / mean_watch),
+                                      f"http://localhost:{port}{path}" if switch else None)
+        manager.run()
+        # The channel must have been marked as connected, and a switched channel must have kept streaming
+        # (the slate feed notices the switch within a poll interval, so a switch just before the end doesn't count)
+        ok = manager.ttfb is not None and manager.state == "waiting_for_clients"
+        if switch and manager.url == manager.switch_to and manager.switched_left > 2:
+            ok = ok and manager.switched_bytes > 0
+        with lock:
+            results["connections"] += 1
+            results["failures"] += 0 if ok else 1
+            results["bytes"] += buffer.bytes
+            if manager.ttfb is not None:
+                results["ttfb"].append(manager.ttfb)
+        time.sleep(rng.uniform(0.05, 0.5))
+
+
+def run_scenario(name: str, clients: int, duration: float, mean_watch: float, image_path: str, seed: int) -> dict:
+    scenario = SCENARIOS[name]
+    _flush_slate_cache()
+    os.environ["TMS_MAX_STALE_SEC"] = "600" if scenario.get("stale", True) else "0"
+    if scenario.get("precompile"):
+        TooManyStreams.start_static_slate(image_path)
+    port = _start_server(image_path if scenario["static"] else None)
+    client = _client
+    if delivery := scenario.get("delivery"):
+        client = functools.partial(_proxy_client, switch=scenario.get("switch", False))
+        os.environ.update({"TMS_HOST": "127.0.0.1", "TMS_PORT": str(port), "TMS_DELIVERY": delivery})
+        TooManyStreams.install_proxy_feed(image_path if scenario["static"] else None)
+    results = {"connections": 0, "failures": 0, "bytes": 0, "ttfb": []}
+    lock = threading.Lock()
+    monitor = _Monitor()
+    monitor.start()
+    until = time.time() + duration
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(port, scenario["path"], until, scenario["cold"], mean_watch, random.Random(seed + i), results, lock),
+            daemon=True,
+        )
+        for i in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    monitor.stop.set()
+    monitor.join()
+
+    ttfb = sorted(results["ttfb"])
+    pct = lambda p: round(ttfb[min(len(ttfb) - 1, max(0, int(round(p / 100 * len(ttfb))) - 1))] * 1000, 1) if ttfb else None
+    return {
+        "scenario": name,
+        "clients": clients,
+        "duration_s": round(elapsed, 1),
+        "connections": results["connections"],
+        "failure_rate": round(results["failures"] / results["connections"], 4) if results["connections"] else 0.0,
+        "ttfb_p50_ms": pct(50),
+        "ttfb_p99_ms": pct(99),
+        "ttfb_mean_ms": round(statistics.mean(ttfb) * 1000, 1) if ttfb else None,
+        "throughput_mbit_s": round(results["bytes"] * 8 / elapsed / 1e6, 1),
+        "peak_rss_mb": round(monitor.peak_rss / 1e6, 1),
+        "peak_threads": monitor.peak_threads,
+        "peak_helper_processes": monitor.peak_processes,
+    }
+
+
+def main(argv: list[str]|None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent clients (default 20)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario (default 10)")
+    parser.add_argument("--watch", type=float, default=2.0, help="Mean seconds a client reads before reconnecting (default 2)")
+    parser.add_argument("--active-channels", type=int, default=12, help="Fake active channels (default 12)")
+    parser.add_argument("--render-ms", type=int, default=500, help="Stub wkhtmltoimage time per page (default 500)")
+    parser.add_argument("--encode-ms", type=int, default=300, help="Stub ffmpeg time per encode (default 300)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    os.environ["TMS_BENCH_RENDER_MS"] = str(args.render_ms)
+    os.environ["TMS_BENCH_ENCODE_MS"] = str(args.encode_ms)
+    # Measure the request path only; the background watchers are not started here
+    with tempfile.TemporaryDirectory() as td:
+        _install_fake_binaries(td)
+        os.environ["TMS_CAPABILITY_CACHE"] = os.path.join(td, "capabilities.json")
+        os.environ["TMS_ARTIFACT_DIR"] = os.path.join(td, "artifacts")
+        TooManyStreams.TMS_MAXED_PKL = os.path.join(td, "mark_maxed.pkl")
+        image_path = os.path.join(td, "static.jpg")
+        with open(image_path, "wb") as f:
+            f.write(b"\xff\xd8\xff\xe0" + bytes(100_000) + b"\xff\xd9")
+        _setup_active_channels(args.active_channels)
+
+        results = [
+            run_scenario(name.strip(), args.clients, args.duration, args.watch, image_path, args.seed)
+            for name in args.scenarios.split(",") if name.strip()
+        ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(textwrap.dedent(f"""\
+            {'scenario':<18} {'conns':>6} {'fail%':>6} {'ttfb p50':>9} {'ttfb p99':>9} {'Mbit/s':>8} {'rss MB':>7} {'threads':>7} {'procs':>5}"""))
+        for r in results:
+            print(f"{r['scenario']:<18} {r['connections']:>6} {r['failure_rate'] * 100:>6.2f} {r['ttfb_p50_ms'] or 0:>9.1f} "
+                  f"{r['ttfb_p99_ms'] or 0:>9.1f} {r['throughput_mbit_s']:>8.1f} {r['peak_rss_mb']:>7.1f} "
+                  f"{r['peak_threads']:>7} {r['peak_helper_processes']:>5}")
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,268 @@
+"""
+Saturation storm simulator for the maxed-state logic (TMS_MAXED_TTL_SEC / TMS_MAXED_COUNTER).
+
+Every M3U profile is at its connection limit. Virtual viewers repeatedly tune channels through the
+patched Channel.get_stream, and the maxed-channel cleanup pass runs every TMS_MAXED_TTL_SEC, all on a
+virtual clock, so an hour of storm runs in seconds. Viewers behave like players:
+    - refused (error) or handed a real stream that cannot connect: retry after --retry-delay seconds
+    - handed the TooManyStreams slate: watch it to the end, then reconnect (or switch channel with
+      probability --switch)
+    - watching the slate when its channel is stopped: reconnect after --retry-delay seconds
+time.sleep() inside the plugin is virtual too: it delays only the viewer (or cleanup pass) that slept,
+and is reported as blocked time.
+
+Reported per case: DB writes, Redis ops, maxed-state file writes, channel stop requests and reconnect
+cycles, in total and per viewer, plus DB writes per slate actually delivered (write amplification).
+TTL and counter accept comma separated lists; all combinations are run with the same seed.
+
+Usage (from the repository root):
+    python -m benchmarks.sim_saturation
+    python -m benchmarks.sim_saturation --viewers 50 --minutes 30 --ttl 15,30,60 --counter 1,2 --json
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import types
+
+from benchmarks import stubs
+
+
+class VirtualClock:
+    """
+    Simulation time. `sleep` does not block: it is added to `stalled`, the extra time the current
+    actor has spent sleeping since the simulator last reset it.
+    """
+
+    def __init__(self, start: float = 1_700_000_000.0):
+        self.now = start
+        self.stalled = 0.0
+
+    def time(self) -> float:
+        return self.now + self.stalled
+
+    def sleep(self, seconds: float) -> None:
+        self.stalled += max(0.0, seconds)
+
+
+CLOCK = VirtualClock()
+REDIS = stubs.install(stubs.FakeRedis(clock=CLOCK.time))
+
+import src.TooManyStreams as tms_module  # noqa: E402  (needs the stubs installed first)
+from src.TooManyStreams import TooManyStreams  # noqa: E402
+
+# Counters of maxed-state file access
+STATE = {"reads": 0, "writes": 0}
+
+
+def _counting_load(f):
+    STATE["reads"] += 1
+    return pickle.load(f)
+
+
+def _counting_dump(obj, f):
+    STATE["writes"] += 1
+    return pickle.dump(obj, f)
+
+
+# The plugin module sees the virtual clock and counted pickle access; nothing else is patched
+tms_module.time = types.SimpleNamespace(time=CLOCK.time, sleep=CLOCK.sleep, monotonic=CLOCK.time,
+                                        perf_counter=time.perf_counter)
+tms_module.pickle = types.SimpleNamespace(load=_counting_load, dump=_counting_dump)
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def _snapshot() -> dict:
+    return {
+        "db_writes": stubs.STATS["db_writes"],
+        "db_queries": stubs.STATS["db_queries"],
+        "redis_ops": REDIS.ops,
+        "state_writes": STATE["writes"],
+        "state_reads": STATE["reads"],
+        "channel_stops": stubs.ChannelService.stopped,
+    }
+
+
+def _delta(before: dict) -> dict:
+    after = _snapshot()
+    return {k: after[k] - before[k] for k in before}
+
+
+def run_case(ttl: int, counter: int, viewers: int, channels: int, minutes: float, retry_delay: float,
+             switch: float, seed: int, state_dir: str) -> dict:
+    rng = random.Random(seed)
+    TooManyStreams.TMS_MAXED_TTL_SEC = ttl
+    TooManyStreams.TMS_MAXED_COUNTER = counter
+    TooManyStreams.TMS_MAXED_PKL = os.path.join(state_dir, f"mark_maxed_{ttl}_{counter}.pkl")
+    REDIS._data.clear()
+    REDIS._expires.clear()
+    STATE.update(reads=0, writes=0)
+    stubs.ChannelService.stopped = 0
+    stubs.ChannelService.stops.clear()
+    CLOCK.now, CLOCK.stalled = 1_700_000_000.0, 0.0
+
+    channel_objs = stubs.build_fixture(channels, 2, 2, 2, max_streams=2)
+    for profile in stubs.profiles():
+        REDIS.set(f"profile_connections:{profile.id}", profile.max_streams)
+    TooManyStreams._stream_id = None
+    tms_stream_id = TooManyStreams.get_or_create_stream().id
+    slate_secs = TooManyStreams.get_stream_length_secs()
+    end = CLOCK.now + minutes * 60
+    stubs.STATS["db_writes"] = stubs.STATS["db_queries"] = 0
+    REDIS.ops = 0
+
+    totals = {"tunes": 0, "refused": 0, "slates": 0, "unplayable": 0, "kicked": 0, "blocked_s": 0.0}
+    per_viewer = [dict(tunes=0, db_writes=0, redis_ops=0, channel_stops=0) for _ in range(viewers)]
+    cleanup = {"passes": 0, "db_writes": 0, "redis_ops": 0, "channel_stops": 0, "blocked_s": 0.0}
+    # viewer -> (channel uuid, generation) while watching the slate
+    watching = {}
+    generation = [0] * viewers
+    channel_of = [rng.choice(channel_objs) for _ in range(viewers)]
+
+    seq = itertools.count()
+    events = []
+    for v in range(viewers):
+        heapq.heappush(events, (CLOCK.now + rng.uniform(0, retry_delay), next(seq), "tune", v, 0))
+    heapq.heappush(events, (CLOCK.now + ttl, next(seq), "cleanup", None, 0))
+
+    def schedule(at: float, kind: str, viewer: int|None):
+        heapq.heappush(events, (at, next(seq), kind, viewer, generation[viewer] if viewer is not None else 0))
+
+    def kick_stopped(stops_before: dict, now: float):
+        # Viewers watching the slate on a stopped channel lose their stream and reconnect
+        stopped = {uuid for uuid, n in stubs.ChannelService.stops.items() if n > stops_before.get(uuid, 0)}
+        for v, (uuid, _) in list(watching.items()):
+            if uuid in stopped:
+                watching.pop(v)
+                generation[v] += 1
+                totals["kicked"] += 1
+                schedule(now + retry_delay, "tune", v)
+
+    while events and events[0][0] <= end:
+        at, _, kind, v, gen = heapq.heappop(events)
+        if v is not None and gen != generation[v]:
+            continue  # superseded (viewer was kicked)
+        CLOCK.now, CLOCK.stalled = at, 0.0
+        before = _snapshot()
+        stops_before = dict(stubs.ChannelService.stops)
+
+        if kind == "cleanup":
+            TooManyStreams.cleanup_maxed_channels()
+            d = _delta(before)
+            cleanup["passes"] += 1
+            for k in ("db_writes", "redis_ops", "channel_stops"):
+                cleanup[k] += d[k]
+            cleanup["blocked_s"] += CLOCK.stalled
+            kick_stopped(stops_before, at + CLOCK.stalled)
+            schedule(at + CLOCK.stalled + ttl, "cleanup", None)
+            continue
+
+        if kind == "slate_end":
+            watching.pop(v, None)
+            if rng.random() < switch:
+                channel_of[v] = rng.choice(channel_objs)
+            schedule(at + rng.uniform(0.2, 1.0), "tune", v)
+            continue
+
+        # tune
+        channel = channel_of[v]
+        stream_id, _, error = channel.get_stream()
+        d = _delta(before)
+        stats = per_viewer[v]
+        stats["tunes"] += 1
+        for k in ("db_writes", "redis_ops", "channel_stops"):
+            stats[k] += d[k]
+        totals["tunes"] += 1
+        totals["blocked_s"] += CLOCK.stalled
+        done = at + CLOCK.stalled
+        kick_stopped(stops_before, done)
+        if error:
+            totals["refused"] += 1
+            schedule(done + retry_delay, "tune", v)
+        elif stream_id == tms_stream_id:
+            totals["slates"] += 1
+            generation[v] += 1
+            watching[v] = (str(channel.uuid), generation[v])
+            schedule(done + slate_secs, "slate_end", v)
+        else:
+            # A real stream on a saturated profile: the provider refuses it and the player retries
+            totals["unplayable"] += 1
+            schedule(done + retry_delay, "tune", v)
+
+    overall = _delta({k: 0 for k in _snapshot()})
+    reconnects = totals["tunes"] - viewers
+    return {
+        "ttl_s": ttl,
+        "counter": counter,
+        "viewers": viewers,
+        "channels": channels,
+        "minutes": minutes,
+        "tunes": totals["tunes"],
+        "reconnect_cycles_per_viewer": round(reconnects / viewers, 2),
+        "refused": totals["refused"],
+        "slates_delivered": totals["slates"],
+        "unplayable": totals["unplayable"],
+        "kicked_off_slate": totals["kicked"],
+        "db_writes": overall["db_writes"],
+        "db_queries": overall["db_queries"],
+        "redis_ops": overall["redis_ops"],
+        "state_writes": overall["state_writes"],
+        "state_reads": overall["state_reads"],
+        "channel_stops": overall["channel_stops"],
+        "db_writes_per_viewer": round(sum(s["db_writes"] for s in per_viewer) / viewers, 2),
+        "redis_ops_per_viewer": round(sum(s["redis_ops"] for s in per_viewer) / viewers, 2),
+        "channel_stops_per_viewer": round(sum(s["channel_stops"] for s in per_viewer) / viewers, 2),
+        "db_writes_per_slate": round(overall["db_writes"] / totals["slates"], 2) if totals["slates"] else None,
+        "blocked_s_per_tune": round(totals["blocked_s"] / totals["tunes"], 3) if totals["tunes"] else 0.0,
+        "cleanup": {k: round(v, 3) if isinstance(v, float) else v for k, v in cleanup.items()},
+    }
+
+
+def main(argv: list[str]|None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=20, help="Virtual viewers (default 20)")
+    parser.add_argument("--channels", type=int, default=10, help="Channels, all on saturated profiles (default 10)")
+    parser.add_argument("--minutes", type=float, default=30, help="Virtual minutes to simulate (default 30)")
+    parser.add_argument("--ttl", type=_int_list, default=[TooManyStreams.TMS_MAXED_TTL_SEC],
+                        help=f"TMS_MAXED_TTL_SEC values (default {TooManyStreams.TMS_MAXED_TTL_SEC})")
+    parser.add_argument("--counter", type=_int_list, default=[TooManyStreams.TMS_MAXED_COUNTER],
+                        help=f"TMS_MAXED_COUNTER values (default {TooManyStreams.TMS_MAXED_COUNTER})")
+    parser.add_argument("--retry-delay", type=float, default=2.0, help="Seconds before a player retries (default 2)")
+    parser.add_argument("--switch", type=float, default=0.2,
+                        help="Chance a viewer switches channel after the slate ends (default 0.2)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as td:
+        TooManyStreams.install_get_stream_override()
+        results = [
+            run_case(ttl, counter, args.viewers, args.channels, args.minutes, args.retry_delay, args.switch, args.seed, td)
+            for ttl, counter in itertools.product(args.ttl, args.counter)
+        ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'ttl':>4} {'cnt':>4} {'tunes':>7} {'recon/v':>8} {'refused':>8} {'unpl':>5} {'slates':>7} {'kicked':>7} "
+              f"{'dbw':>7} {'redis':>8} {'state w':>8} {'stops':>7} {'dbw/slate':>10} {'blocked/tune':>13}")
+        for r in results:
+            print(f"{r['ttl_s']:>4} {r['counter']:>4} {r['tunes']:>7} {r['reconnect_cycles_per_viewer']:>8.2f} "
+                  f"{r['refused']:>8} {r['unplayable']:>5} {r['slates_delivered']:>7} {r['kicked_off_slate']:>7} {r['db_writes']:>7} "
+                  f"{r['redis_ops']:>8} {r['state_writes']:>8} {r['channel_stops']:>7} "
+                  f"{r['db_writes_per_slate'] if r['db_writes_per_slate'] is not None else '-':>10} "
+                  f"{r['blocked_s_per_tune']:>13.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
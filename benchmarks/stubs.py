@@ -0,0 +1,612 @@
+# In-memory stand-ins for the Dispatcharr modules the plugin imports, so the plugin code can run
+# without Django, a database or a Redis server. Call install() before importing anything from src.
+import collections
+import fnmatch
+import itertools
+import select
+import socket
+import sys
+import threading
+import time
+import types
+import urllib.parse
+
+
+# Counters of simulated database work, reset by reset_models()
+STATS = {"db_queries": 0, "db_writes": 0}
+
+
+def _b(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class FakeRedis:
+    """
+    Minimal thread-safe Redis stand-in: strings, lists, hashes, TTLs, SCAN, pipelines and pub/sub stubs.
+    Counts every command in `ops` so callers can measure Redis round trips.
+    """
+
+    def __init__(self, clock=time.time):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+        self._clock = clock
+        self.ops = 0
+        self.connection_pool = types.SimpleNamespace(connection_kwargs={"db": 0})
+
+    def _count(self):
+        self.ops += 1
+
+    def _alive(self, key) -> bool:
+        exp = self._expires.get(key)
+        if exp is not None and exp <= self._clock():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            self._count()
+            value = self._data.get(key) if self._alive(key) else None
+            return value if isinstance(value, bytes) or value is None else None
+
+    def mget(self, keys):
+        with self._lock:
+            self._count()
+            return [self._data.get(k) if self._alive(k) else None for k in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            self._count()
+            if nx and self._alive(key):
+                return None
+            self._data[key] = _b(value)
+            if ex is not None:
+                self._expires[key] = self._clock() + ex
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._count()
+            value = int(self._data.get(key, b"0") if self._alive(key) else 0) + amount
+            self._data[key] = _b(value)
+            return value
+
+    def decr(self, key, amount=1):
+        return self.incr(key, -amount)
+
+    def exists(self, *keys):
+        with self._lock:
+            self._count()
+            return sum(1 for k in keys if self._alive(k))
+
+    def delete(self, *keys):
+        with self._lock:
+            self._count()
+            removed = 0
+            for k in keys:
+                if self._alive(k):
+                    removed += 1
+                self._data.pop(k, None)
+                self._expires.pop(k, None)
+            return removed
+
+    def expire(self, key, seconds):
+        with self._lock:
+            self._count()
+            if not self._alive(key):
+                return False
+            self._expires[key] = self._clock() + seconds
+            return True
+
+    def scan(self, cursor=0, match="*", count=None):
+        with self._lock:
+            self._count()
+            keys = [_b(k) for k in list(self._data) if self._alive(k) and fnmatch.fnmatchcase(k, match)]
+            return 0, keys
+
+    def keys(self, pattern="*"):
+        return self.scan(0, match=pattern)[1]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            self._count()
+            h = self._data.setdefault(key, {})
+            if field is not None:
+                h[field] = _b(value)
+            for f, v in (mapping or {}).items():
+                h[f] = _b(v)
+            return 1
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            self._count()
+            self._alive(key)  # drops the hash if it expired
+            h = self._data.setdefault(key, {})
+            h[field] = _b(int(h.get(field, 0)) + amount)
+            return int(h[field])
+
+    def expireat(self, key, when):
+        with self._lock:
+            self._count()
+            if not self._alive(key):
+                return False
+            self._expires[key] = when
+            return True
+
+    def hgetall(self, key):
+        with self._lock:
+            self._count()
+            h = self._data.get(key) if self._alive(key) else None
+            return {_b(k): v for k, v in h.items()} if isinstance(h, dict) else {}
+
+    def lpush(self, key, *values):
+        with self._lock:
+            self._count()
+            lst = self._data.setdefault(key, [])
+            for v in values:
+                lst.insert(0, _b(v))
+            return len(lst)
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            self._count()
+            lst = self._data.get(key, [])
+            self._data[key] = lst[start:end + 1 if end != -1 else None]
+            return True
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            self._count()
+            lst = self._data.get(key, []) if self._alive(key) else []
+            return lst[start:end + 1 if end != -1 else None]
+
+    def eval(self, script, numkeys, *keys_and_args):
+        # The plugin uses two scripts: raising hash fields to a peak value, and the compare-and-delete lock release
+        with self._lock:
+            self._count()
+            if "hset" in script:
+                h = self._data.setdefault(keys_and_args[0], {})
+                args = keys_and_args[1:]
+                for field, value in zip(args[::2], args[1::2]):
+                    if int(value) > int(h.get(field, 0)):
+                        h[field] = _b(value)
+                return 0
+            key, token = keys_and_args[0], keys_and_args[1]
+            if self.get(key) == _b(token):
+                return self.delete(key)
+            return 0
+
+    def config_get(self, name):
+        return {name: "KEA"}
+
+    def config_set(self, name, value):
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def pubsub(self, **kwargs):
+        return FakePubSub()
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+        self._calls = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return _queue
+
+    def execute(self):
+        results = [getattr(self._redis, name)(*args, **kwargs) for name, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+
+class FakePubSub:
+    """
+    Pub/sub that never delivers messages; the watchers then rely on their initial SCAN.
+    """
+
+    def psubscribe(self, *patterns):
+        pass
+
+    def listen(self):
+        while True:
+            time.sleep(3600)
+            yield {}
+
+    def close(self):
+        pass
+
+
+class DoesNotExist(Exception):
+    pass
+
+
+class _QuerySet(list):
+    def all(self):
+        return _QuerySet(self)
+
+    def order_by(self, *fields):
+        return _QuerySet(sorted(self, key=lambda obj: getattr(obj, "_order", 0)))
+
+    def exists(self):
+        return len(self) > 0
+
+    def first(self):
+        return self[0] if self else None
+
+    def filter(self, **kwargs):
+        def _match(obj):
+            for k, v in kwargs.items():
+                if k.endswith("__gt"):
+                    if not getattr(obj, k[:-4]) > v:
+                        return False
+                # Like the ORM, accept "5" for an integer field
+                elif getattr(obj, k, None) != v and str(getattr(obj, k, None)) != str(v):
+                    return False
+            return True
+        return _QuerySet(obj for obj in self if _match(obj))
+
+    def values(self, *fields):
+        return _ValuesQuerySet(self, fields)
+
+    def values_list(self, *fields):
+        return [tuple(getattr(obj, f) for f in fields) for obj in self]
+
+
+class _ValuesQuerySet(_QuerySet):
+    def __init__(self, objs, fields):
+        super().__init__({f: getattr(obj, f) for f in fields} for obj in objs)
+        self._objs = objs
+        self._fields = fields
+
+    def filter(self, **kwargs):
+        return _ValuesQuerySet(_QuerySet(self._objs).filter(**kwargs), self._fields)
+
+
+class _Manager:
+    """
+    Class-level `objects` manager over an in-memory registry.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.rows = {}
+
+    def _qs(self):
+        STATS["db_queries"] += 1
+        return _QuerySet(self.rows.values())
+
+    def all(self):
+        return self._qs()
+
+    def filter(self, **kwargs):
+        return self._qs().filter(**kwargs)
+
+    def values(self, *fields):
+        return self._qs().values(*fields)
+
+    def get(self, **kwargs):
+        found = self._qs().filter(**kwargs)
+        if not found:
+            raise self.model.DoesNotExist()
+        return found[0]
+
+    def create(self, **kwargs):
+        STATS["db_writes"] += 1
+        obj = self.model(**kwargs)
+        self.rows[obj.id] = obj
+        return obj
+
+
+class _Model:
+    DoesNotExist = DoesNotExist
+    _ids = itertools.count(1)
+
+    def __init__(self, **kwargs):
+        self.id = kwargs.pop("id", None) or next(_Model._ids)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def save(self, *args, **kwargs):
+        STATS["db_writes"] += 1
+
+    def delete(self):
+        STATS["db_writes"] += 1
+        type(self).objects.rows.pop(self.id, None)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.id == other.id
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.id))
+
+
+class M3UAccountProfile(_Model):
+    pass
+
+
+class M3UAccount(_Model):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._profiles = _QuerySet()
+
+    @property
+    def profiles(self):
+        STATS["db_queries"] += 1
+        return self._profiles
+
+
+class Stream(_Model):
+    m3u_account = None
+
+
+class _ChannelStreams:
+    """
+    Stand-in for Channel.streams (a many-to-many through ChannelStream).
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+
+    def _streams(self):
+        STATS["db_queries"] += 1
+        links = [cs for cs in ChannelStream.objects.rows.values() if cs.channel is self._channel]
+        out = _QuerySet()
+        for cs in links:
+            stream = Stream.objects.rows.get(cs.stream_id)
+            if stream is not None:
+                stream._order = cs.order
+                out.append(stream)
+        return out
+
+    def all(self):
+        return self._streams()
+
+    def exists(self):
+        return bool(self._streams())
+
+    def remove(self, stream_id):
+        STATS["db_writes"] += 1
+        for key, cs in list(ChannelStream.objects.rows.items()):
+            if cs.channel is self._channel and cs.stream_id == stream_id:
+                ChannelStream.objects.rows.pop(key)
+
+
+class Channel(_Model):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not getattr(self, "uuid", None):
+            self.uuid = f"uuid-{self.id}"
+        self.streams = _ChannelStreams(self)
+
+    def get_stream(self):
+        # Unpatched result; TooManyStreams.install_get_stream_override() replaces it
+        return None, None, "No streams assigned to channel"
+
+
+class ChannelStream(_Model):
+    pass
+
+
+class PluginConfig(_Model):
+    pass
+
+
+for _model in (M3UAccountProfile, M3UAccount, Stream, Channel, ChannelStream, PluginConfig):
+    _model.objects = _Manager(_model)
+
+
+class ProxyServer:
+    _instance = None
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.stream_buffers = {}
+        self.stopped = 0
+
+    @classmethod
+    def get_instance(cls):
+        return cls._instance
+
+    def stop_channel(self, channel_id):
+        self.stopped += 1
+
+
+class StreamBuffer:
+    """
+    Stand-in for ts_proxy's per-channel stream buffer: counts what add_chunk() receives.
+    `on_chunk(data)`, if set, is called for every chunk.
+    """
+
+    def __init__(self, channel_id=None, redis_client=None):
+        self.channel_id = channel_id
+        self.index = 0
+        self.bytes = 0
+        self.on_chunk = None
+
+    def add_chunk(self, chunk) -> bool:
+        self.index += 1
+        self.bytes += len(chunk)
+        if self.on_chunk:
+            self.on_chunk(chunk)
+        return True
+
+
+class StreamManager:
+    """
+    Stand-in for ts_proxy's stream manager: run() pulls `url` over HTTP into the buffer until stop().
+    Like ts_proxy, the channel goes from "initializing" to "waiting_for_clients" once the upstream is connected,
+    through _set_waiting_for_clients(), and update_url() switches the channel to another upstream.
+    """
+
+    CHUNK = 188 * 64
+
+    def __init__(self, channel_id, url, buffer, **kwargs):
+        self.channel_id = channel_id
+        self.url = url
+        self.buffer = buffer
+        self.running = True
+        self.connected = False
+        self.state = "initializing"
+        # Upstream URLs in the order they were fetched
+        self.fetched = []
+
+    def _set_waiting_for_clients(self):
+        self.connected = True
+        self.state = "waiting_for_clients"
+
+    def update_url(self, new_url):
+        self.url = new_url
+
+    def run(self):
+        # Fetch the upstream again whenever update_url() switches it; stop when it ends or fails
+        while self.running and self._fetch(self.url):
+            pass
+
+    def _fetch(self, upstream: str) -> bool:
+        """
+        Streams `upstream` into the buffer. Returns True if it stopped because the URL was switched.
+        """
+        self.fetched.append(upstream)
+        url = urllib.parse.urlparse(upstream)
+        path = url.path + (f"?{url.query}" if url.query else "")
+        try:
+            with socket.create_connection((url.hostname, url.port), timeout=10) as sock:
+                sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: close\r\n\r\n".encode())
+                head, in_body = b"", False
+                while self.running:
+                    if self.url != upstream:
+                        return True
+                    # Wait in short steps, so stop() takes effect while the upstream sends nothing
+                    if not select.select([sock], [], [], 0.25)[0]:
+                        continue
+                    chunk = sock.recv(self.CHUNK)
+                    if not chunk:
+                        break
+                    if not in_body:
+                        head += chunk
+                        if b"\r\n\r\n" not in head:
+                            continue
+                        status, _, chunk = head.partition(b"\r\n\r\n")
+                        if status.split(b" ", 2)[1] != b"200":
+                            break
+                        in_body = True
+                        if not self.connected:
+                            self._set_waiting_for_clients()
+                        if not chunk:
+                            continue
+                    self.buffer.add_chunk(chunk)
+        except OSError:
+            pass
+        return False
+
+    def stop(self):
+        self.running = False
+
+
+class ChannelService:
+    stopped = 0
+    # Stop requests per channel uuid
+    stops = collections.Counter()
+
+    @staticmethod
+    def stop_channel(channel_id):
+        ChannelService.stopped += 1
+        ChannelService.stops[str(channel_id)] += 1
+        return {"status": "success"}
+
+
+class ChannelStatus:
+    @staticmethod
+    def get_basic_channel_info(channel_id):
+        return {"url": ""}
+
+
+class RedisClient:
+    _client = None
+
+    @classmethod
+    def get_client(cls):
+        return cls._client
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+
+def install(redis: FakeRedis|None = None) -> FakeRedis:
+    """
+    Registers the stand-in modules in sys.modules and returns the shared FakeRedis.
+    """
+    redis = redis or FakeRedis()
+    RedisClient._client = redis
+    ProxyServer._instance = ProxyServer(redis)
+    for name in ("apps", "apps.channels", "apps.proxy", "apps.proxy.ts_proxy", "apps.proxy.ts_proxy.services",
+                 "apps.m3u", "apps.plugins", "core"):
+        _module(name)
+    _module("apps.channels.models", Channel=Channel, ChannelStream=ChannelStream, Stream=Stream)
+    _module("apps.m3u.models", M3UAccount=M3UAccount, M3UAccountProfile=M3UAccountProfile)
+    _module("apps.plugins.models", PluginConfig=PluginConfig)
+    _module("apps.proxy.ts_proxy.server", ProxyServer=ProxyServer)
+    _module("apps.proxy.ts_proxy.stream_buffer", StreamBuffer=StreamBuffer)
+    _module("apps.proxy.ts_proxy.stream_manager", StreamManager=StreamManager)
+    _module("apps.proxy.ts_proxy.services.channel_service", ChannelService=ChannelService)
+    _module("apps.proxy.ts_proxy.channel_status", ChannelStatus=ChannelStatus)
+    _module("core.utils", RedisClient=RedisClient)
+    return redis
+
+
+def reset_models() -> None:
+    for model in (M3UAccountProfile, M3UAccount, Stream, Channel, ChannelStream, PluginConfig):
+        model.objects.rows.clear()
+    STATS["db_queries"] = 0
+    STATS["db_writes"] = 0
+
+
+def build_fixture(channels: int, streams_per_channel: int, accounts: int, profiles_per_account: int,
+                  max_streams: int = 2) -> list[Channel]:
+    """
+    Creates `accounts` M3U accounts with `profiles_per_account` limited profiles each, and `channels`
+    channels with `streams_per_channel` streams spread over the accounts. Returns the channels.
+    """
+    reset_models()
+    account_objs = []
+    for a in range(accounts):
+        account = M3UAccount.objects.create(name=f"account-{a}")
+        for p in range(profiles_per_account):
+            profile = M3UAccountProfile.objects.create(
+                m3u_account=account, is_default=(p == 0), is_active=True, max_streams=max_streams
+            )
+            account._profiles.append(profile)
+        account_objs.append(account)
+    channel_objs = []
+    for c in range(channels):
+        channel = Channel.objects.create(name=f"Channel {c}", logo=types.SimpleNamespace(url=f"/logos/{c}.png"))
+        for s in range(streams_per_channel):
+            stream = Stream.objects.create(
+                name=f"stream-{c}-{s}", url=f"http://provider/{c}/{s}",
+                m3u_account=account_objs[(c * streams_per_channel + s) % accounts],
+            )
+            ChannelStream.objects.create(channel=channel, stream_id=stream.id, order=s)
+        channel_objs.append(channel)
+    STATS["db_queries"] = 0
+    STATS["db_writes"] = 0
+    return channel_objs
+
+
+def profiles() -> list[M3UAccountProfile]:
+    return list(M3UAccountProfile.objects.rows.values())
@@ -0,0 +1,205 @@
+# Keeps an in-memory set of active ts_proxy channels, driven by Redis keyspace notifications.
+# Replaces the per-request SCAN of ts_proxy:channel:*:metadata, and triggers a slate re-render
+# whenever the set of active channels actually changes.
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable
+
+from core.utils import RedisClient
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.ActiveChannelWatcher')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class ActiveChannelWatcher:
+
+    CHANNEL_PATTERN = "ts_proxy:channel:*:metadata"
+    CHANNEL_RE = re.compile(r"ts_proxy:channel:(.*):metadata")
+    # Keyspace flags we need: K = keyspace events, g = del/expire-generic, h = hash, x = expired, e = evicted
+    REQUIRED_FLAGS = "Kghxe"
+    # Events that create or remove the metadata hash
+    ADD_EVENTS = {"hset", "hmset", "hsetnx", "hincrby", "restore", "rename_to"}
+    # Redis sends "del" once the last field of a hash is removed, so "hdel" itself isn't a removal
+    REMOVE_EVENTS = {"del", "expired", "evicted", "rename_from"}
+    # Wait this long after a change before re-rendering, so a burst of channel starts renders once (seconds)
+    DEBOUNCE_SEC = 1.0
+    # Back-off before re-subscribing after a Redis error (seconds)
+    RECONNECT_SEC = 5
+
+    _active: set = set()
+    _lock = threading.Lock()
+    _running = False
+    _changed = threading.Event()
+    # Incremented whenever the active set changes
+    _generation = 0
+
+    @staticmethod
+    def scan_active_channel_ids(redis_client=None) -> set[str]:
+        """
+        Returns the ids of all channels that currently have ts_proxy metadata, via SCAN.
+        """
+        redis_client = redis_client or RedisClient.get_client()
+        channel_ids = set()
+        cursor = 0
+        while True:
+            cursor, keys = redis_client.scan(cursor, match=ActiveChannelWatcher.CHANNEL_PATTERN)
+            for key in keys:
+                key = key.decode("utf-8") if isinstance(key, bytes) else key
+                if m := ActiveChannelWatcher.CHANNEL_RE.search(key):
+                    channel_ids.add(m.group(1))
+            if cursor == 0:
+                break
+        return channel_ids
+
+    @staticmethod
+    def is_running() -> bool:
+        """
+        Returns True while the watcher is subscribed to keyspace events, i.e. the in-memory set is current.
+        """
+        return ActiveChannelWatcher._running
+
+    @staticmethod
+    def generation() -> int:
+        """
+        Returns a counter that changes whenever the set of active channels does (while the watcher is running).
+        """
+        return ActiveChannelWatcher._generation
+
+    @staticmethod
+    def get_active_channel_ids() -> set[str]:
+        """
+        Returns the current set of active channel ids.
+        Uses the in-memory set while the watcher is running, otherwise falls back to a SCAN.
+        """
+        if ActiveChannelWatcher.is_running():
+            with ActiveChannelWatcher._lock:
+                return set(ActiveChannelWatcher._active)
+        return ActiveChannelWatcher.scan_active_channel_ids()
+
+    @staticmethod
+    def _check_keyspace_notifications(redis_client) -> bool:
+        """
+        Checks that Redis publishes the keyspace events we need (REQUIRED_FLAGS in notify-keyspace-events).
+        The setting is server-wide, so missing flags are only added (keeping the ones already configured) if
+        TMS_CHANNEL_EVENTS_CONFIGURE is on. Returns False if they are not enabled, or the setting can't be read.
+        """
+        try:
+            current = redis_client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Could not read Redis notify-keyspace-events: {e}")
+            return False
+        current = current.decode("utf-8") if isinstance(current, bytes) else current
+        # "A" is an alias for all event classes
+        missing = "".join(
+            flag for flag in ActiveChannelWatcher.REQUIRED_FLAGS
+            if flag not in current and not (flag != "K" and "A" in current)
+        )
+        if not missing:
+            return True
+        if not TooManyStreamsConfig.get_channel_events_configure():
+            logger.warning(
+                f"TooManyStreams: Redis notify-keyspace-events is '{current}', missing '{missing}'. "
+                f"Set it to '{current + missing}' in the Redis config, or TMS_CHANNEL_EVENTS_CONFIGURE=true to let the plugin set it."
+            )
+            return False
+        try:
+            redis_client.config_set("notify-keyspace-events", current + missing)
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Could not enable Redis keyspace notifications: {e}")
+            return False
+        logger.info(f"TooManyStreams: Enabled Redis keyspace events '{current + missing}'.")
+        return True
+
+    @staticmethod
+    def _apply_event(channel_id: str, event: str) -> bool:
+        """
+        Updates the active set for a keyspace event. Returns True if the set changed.
+        """
+        with ActiveChannelWatcher._lock:
+            if event in ActiveChannelWatcher.ADD_EVENTS and channel_id not in ActiveChannelWatcher._active:
+                ActiveChannelWatcher._active.add(channel_id)
+                ActiveChannelWatcher._generation += 1
+                return True
+            if event in ActiveChannelWatcher.REMOVE_EVENTS and channel_id in ActiveChannelWatcher._active:
+                ActiveChannelWatcher._active.discard(channel_id)
+                ActiveChannelWatcher._generation += 1
+                return True
+        return False
+
+    @staticmethod
+    def _seed(redis_client) -> None:
+        """
+        Replaces the in-memory set with a fresh SCAN. Used at start and after reconnecting.
+        """
+        channel_ids = ActiveChannelWatcher.scan_active_channel_ids(redis_client)
+        with ActiveChannelWatcher._lock:
+            changed = channel_ids != ActiveChannelWatcher._active
+            ActiveChannelWatcher._active = channel_ids
+            if changed:
+                ActiveChannelWatcher._generation += 1
+        if changed:
+            ActiveChannelWatcher._changed.set()
+        logger.debug(f"TooManyStreams: Seeded {len(channel_ids)} active channels.")
+
+    @staticmethod
+    def _listen_thread() -> None:
+        while True:
+            pubsub = None
+            try:
+                redis_client = RedisClient.get_client()
+                db = redis_client.connection_pool.connection_kwargs.get("db", 0)
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"__keyspace@{db}__:{ActiveChannelWatcher.CHANNEL_PATTERN}")
+                # Seed after subscribing, so no event between the two is lost
+                ActiveChannelWatcher._seed(redis_client)
+                ActiveChannelWatcher._running = True
+                for message in pubsub.listen():
+                    channel = message.get("channel", b"")
+                    channel = channel.decode("utf-8") if isinstance(channel, bytes) else channel
+                    event = message.get("data", b"")
+                    event = event.decode("utf-8") if isinstance(event, bytes) else str(event)
+                    if m := ActiveChannelWatcher.CHANNEL_RE.search(channel):
+                        if ActiveChannelWatcher._apply_event(m.group(1), event):
+                            logger.debug(f"TooManyStreams: Channel {m.group(1)} {event}; active set changed.")
+                            ActiveChannelWatcher._changed.set()
+            except Exception as e:
+                logger.warning(f"TooManyStreams: Channel watcher lost Redis connection, falling back to SCAN: {e}")
+            finally:
+                # Until we are subscribed again, the in-memory set can't be trusted
+                ActiveChannelWatcher._running = False
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(ActiveChannelWatcher.RECONNECT_SEC)
+
+    @staticmethod
+    def _render_thread(on_change: Callable[[], None]) -> None:
+        while True:
+            ActiveChannelWatcher._changed.wait()
+            time.sleep(ActiveChannelWatcher.DEBOUNCE_SEC)
+            ActiveChannelWatcher._changed.clear()
+            try:
+                on_change()
+            except Exception as e:
+                logger.error(f"TooManyStreams: Failed to re-render slate after channel change: {e}")
+
+    @staticmethod
+    def start(on_change: Callable[[], None]) -> bool:
+        """
+        Starts the watcher threads. `on_change` is called (debounced) whenever the set of active channels changes.
+        Returns False if keyspace notifications are not enabled; callers then keep using SCAN.
+        """
+        if not ActiveChannelWatcher._check_keyspace_notifications(RedisClient.get_client()):
+            return False
+        threading.Thread(target=ActiveChannelWatcher._listen_thread, daemon=True).start()
+        threading.Thread(target=ActiveChannelWatcher._render_thread, args=(on_change,), daemon=True).start()
+        logger.info("TooManyStreams: Started active channel watcher.")
+        return True
@@ -1,19 +1,22 @@
 import logging
-import io, base64, mimetypes, os, math, re, tempfile, subprocess, shutil
+import io, base64, contextlib, copy, hashlib, json, mimetypes, os, math, re, struct, tempfile, subprocess, shutil
 from pathlib import Path
 from typing import List, Tuple
 
 from apps.channels.models import Channel
-from apps.proxy.ts_proxy.server import ProxyServer
 from apps.proxy.ts_proxy.channel_status import ChannelStatus
 
 from .TooManyStreamsConfig import DEFAULT_CSS, TooManyStreamsConfig
+from .ActiveChannelWatcher import ActiveChannelWatcher
+from .ProcessSupervisor import ProcessSupervisor
 
 
 DEFAULT_TITLE = "Sorry, this channel is unavailable."
 DEFAULT_DESCRIPTION = "While this channel is not currently available, here are some other channels you can watch."
 DEFAULT_HTML_COLS = 4
 DEFAULT_OUT_FILE = "too_many_streams.jpg"
+# The HTML layout is designed for this size; other output sizes are zoomed from it
+LAYOUT_WIDTH = 1920
 
 class ActiveStreamImgGen:
     """
@@ -21,17 +24,35 @@ class ActiveStreamImgGen:
     No Playwright/Chromium required.
     """
 
+    # Embedded local logos as data URIs, keyed by (path, mtime, size) so an edited file is read again
+    _data_uri_cache: dict = {}
+    DATA_URI_CACHE_MAX = 512
+
     def __init__(
         self,
-        title: str = TooManyStreamsConfig.get_plugin_config("stream_title") or DEFAULT_TITLE,
-        description: str = TooManyStreamsConfig.get_plugin_config("stream_description") or DEFAULT_DESCRIPTION,
+        title: str|None = None,
+        description: str|None = None,
         out_path: str = DEFAULT_OUT_FILE,
-        html_cols: int = TooManyStreamsConfig.get_plugin_config("stream_channel_cols") or DEFAULT_HTML_COLS,
+        html_cols: int|None = None,
+        width: int = 1920,
+        height: int = 1080,
+        quality: int = 92,
     ):
+        # Settings left as None are read from the plugin config here rather than at import time
+        if title is None:
+            title = TooManyStreamsConfig.get_plugin_config("stream_title") or DEFAULT_TITLE
+        if description is None:
+            description = TooManyStreamsConfig.get_plugin_config("stream_description") or DEFAULT_DESCRIPTION
+        if html_cols is None:
+            html_cols = TooManyStreamsConfig.get_plugin_config("stream_channel_cols") or DEFAULT_HTML_COLS
         self.title = title
         self.description = description
         self.out_path = out_path
         self.html_cols = int(html_cols)
+        self.width = int(width)
+        self.height = int(height)
+        self.quality = int(quality)
+        self.style_css = TooManyStreamsConfig.get_plugin_config("stream_channel_css") or DEFAULT_CSS
         self.active_streams: List[Tuple[str, str, str]] = []
 
         self.logger = logging.getLogger("plugins.too_many_streams.ActiveStreamImgGen")
@@ -44,33 +65,24 @@ class ActiveStreamImgGen:
         """
 
         self.active_streams = []
-        # Below code is from Dispatcharr\apps\proxy\ts_proxy\views.py channel_status()
-        proxy_server = ProxyServer.get_instance()
-        channel_pattern = "ts_proxy:channel:*:metadata"
+        # Active channel ids come from the keyspace-driven watcher when running, else a SCAN of
+        # ts_proxy:channel:*:metadata (see Dispatcharr\apps\proxy\ts_proxy\views.py channel_status())
         active_channels = []
-        cursor = 0
-        while True:
-            cursor, keys = proxy_server.redis_client.scan(cursor, match=channel_pattern)
-            for key in keys:
-                m = re.search(r"ts_proxy:channel:(.*):metadata", key.decode("utf-8"))
-                if m:
-                    ch_id = m.group(1)
-                    channel_info = ChannelStatus.get_basic_channel_info(ch_id)
-
-                    # Skip our own TMS stream
-                    if channel_info.get("url", "") == TooManyStreamsConfig.get_stream_url():  
-                        continue
-                    
-                    self.logger.debug(f"Channel ID DATA: {ch_id}, Info: {channel_info}")
-                    channel_data = Channel.objects.get(uuid=ch_id)
-                    channel_num = channel_data.id
-                    channel_img = channel_data.logo.url
-                    channel_name = channel_data.name
-                    self.logger.debug(f"Channel DATA: {channel_data}")
-                    self.logger.debug(f"Channel NUM: {channel_num}, IMG: {channel_img}, NAME: {channel_name}")
-                    active_channels.append((f"#{channel_num}", channel_img, channel_name))
-            if cursor == 0:
-                break
+        for ch_id in ActiveChannelWatcher.get_active_channel_ids():
+            channel_info = ChannelStatus.get_basic_channel_info(ch_id)
+
+            # Skip our own TMS stream
+            if channel_info.get("url", "") == TooManyStreamsConfig.get_stream_url():  
+                continue
+            
+            self.logger.debug(f"Channel ID DATA: {ch_id}, Info: {channel_info}")
+            channel_data = Channel.objects.get(uuid=ch_id)
+            channel_num = channel_data.id
+            channel_img = channel_data.logo.url
+            channel_name = channel_data.name
+            self.logger.debug(f"Channel DATA: {channel_data}")
+            self.logger.debug(f"Channel NUM: {channel_num}, IMG: {channel_img}, NAME: {channel_name}")
+            active_channels.append((f"#{channel_num}", channel_img, channel_name))
         
         self.logger.info(f"Found {len(active_channels)} active channels in Redis.")
         self.active_streams = active_channels
@@ -83,11 +95,34 @@ class ActiveStreamImgGen:
             except ValueError:
                 return float('inf')  # Non-numeric channels go to the end
         self.active_streams.sort(key=channel_sort_key)
-        # limit to first 12 active channels
-        self.active_streams = self.active_streams[:12]
 
         return self.active_streams
 
+    def paginate(self, page_size: int) -> List["ActiveStreamImgGen"]:
+        """
+        Splits the active streams into pages of `page_size` channels.
+        Returns one generator per page (at least one, so an empty list still renders), sharing this one's settings.
+        """
+        pages = []
+        for start in range(0, max(len(self.active_streams), 1), page_size):
+            page = copy.copy(self)
+            page.active_streams = self.active_streams[start:start + page_size]
+            pages.append(page)
+        return pages
+
+    def fingerprint(self) -> str:
+        """
+        Returns a stable hash of everything that affects the rendered image.
+        Two generators with the same fingerprint render identical slates, so it is used as the cache key.
+        """
+        payload = json.dumps(
+            [self.title, self.description, self.html_cols, self.style_css, self.active_streams,
+             self.width, self.height, self.quality],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
     def file_to_data_uri(self, path: str) -> str:
         """
         Convert a local file to data URI for embedding in HTML.
@@ -102,11 +137,27 @@ class ActiveStreamImgGen:
             )
             b64 = base64.b64encode(png).decode()
             return f"data:image/png;base64,{b64}"
+        st = p.stat()
+        key = (p.as_posix(), st.st_mtime_ns, st.st_size)
+        cached = ActiveStreamImgGen._data_uri_cache.get(key)
+        if cached is not None:
+            return cached
         mime, _ = mimetypes.guess_type(p.as_posix())
         mime = mime or "image/png"
         with open(p, "rb") as f:
             b64 = base64.b64encode(f.read()).decode()
-        return f"data:{mime};base64,{b64}"
+        data_uri = f"data:{mime};base64,{b64}"
+        if len(ActiveStreamImgGen._data_uri_cache) >= ActiveStreamImgGen.DATA_URI_CACHE_MAX:
+            ActiveStreamImgGen._data_uri_cache.clear()
+        ActiveStreamImgGen._data_uri_cache[key] = data_uri
+        return data_uri
+
+    @staticmethod
+    def clear_asset_cache() -> None:
+        """
+        Drops the embedded logo cache, so the next render reads every local logo again.
+        """
+        ActiveStreamImgGen._data_uri_cache.clear()
 
     def html_doc(self) -> str:
         """
@@ -227,13 +278,12 @@ class ActiveStreamImgGen:
         #   }}
         # </style>
         # """
-        style_css = TooManyStreamsConfig.get_plugin_config("stream_channel_css") or DEFAULT_CSS
         style = f"""<style>
-        {style_css}
+        {self.style_css}
         </style>"""
         style = style.replace("REPLACE_WITH_PERCENT", str(REPLACE_WITH_PERCENT))
         self.logger.debug(f"Using {self.html_cols} columns, each card width: {REPLACE_WITH_PERCENT}%")
-        self.logger.debug(f"Using CSS:\n{style}")
+        self.logger.debug("Using CSS:\n%s", style)
         # Build cards (embed local files as data: URIs to avoid path issues)
         cards = []
         for index, channel_data in enumerate(self.active_streams):
@@ -250,7 +300,7 @@ class ActiveStreamImgGen:
                     </div>"""
             )
         self.logger.debug(f"Generated {len(cards)} channel cards for HTML.")
-        self.logger.debug(f"Active streams: {cards}")
+        self.logger.debug("Active streams: %s", cards)
         return f"""<!doctype html><html><head><meta charset="utf-8">{style}</head>
         <body>
           <div class="wrap">
@@ -276,41 +326,92 @@ class ActiveStreamImgGen:
 
     def generate(self) -> None:
         """
-        Render the HTML to a 1920x1080 JPG using wkhtmltoimage.
+        Render the HTML to a JPG (1920x1080 by default) using wkhtmltoimage, and publish it to self.out_path.
+        """
+        self.publish(self.rasterize(self.html_doc()), self.out_path)
+        self.logger.info(f"Wrote {self.out_path}")
+
+    def rasterize(self, html: str, image_format: str = "jpg") -> bytes:
+        """
+        Render an already built HTML document to image bytes (JPG by default) using wkhtmltoimage.
+        The HTML is fed on stdin and the image read from stdout, so nothing touches the disk.
         """
         wkhtml = self._find_wkhtmltoimage()
 
-        html = self.html_doc()
-        os.makedirs(os.path.dirname(os.path.abspath(self.out_path)) or ".", exist_ok=True)
-
-        with tempfile.TemporaryDirectory() as td:
-            html_file = Path(td, "in.html")
-            tmp_out = Path(td, "out.jpg")
-
-            html_file.write_text(html, encoding="utf-8")
-
-            # Arguments tuned for fixed 1920x1080 and robust remote image loading.
-            cmd = [
-                wkhtml,
-                "--quiet",
-                "--format", "jpg",
-                "--quality", "92",
-                "--width", "1920",
-                "--height", "1080",
-                "--disable-smart-width",            # respect width
-                "--enable-local-file-access",       # allow local data/file refs if any
-                "--load-error-handling", "ignore",  # don't fail on missing assets
-                "--javascript-delay", "1200",       # small wait for images/CDNs
-                str(html_file),
-                str(tmp_out),
-            ]
-
-            subprocess.run(cmd, check=True)
-
-            # Move result into place
-            Path(self.out_path).write_bytes(tmp_out.read_bytes())
-            self.logger.info("Wrote %s", self.out_path)
-            self.logger.info(f"Wrote {self.out_path}")
+        # Arguments tuned for a fixed size and robust remote image loading.
+        cmd = [
+            wkhtml,
+            "--quiet",
+            "--format", image_format,
+            "--quality", str(self.quality),
+            "--width", str(self.width),
+            "--height", str(self.height),
+            "--zoom", f"{self.width / LAYOUT_WIDTH:.4f}",  # scale the 1920px layout to the output width
+            "--disable-smart-width",            # respect width
+            "--enable-local-file-access",       # allow local data/file refs if any
+            "--load-error-handling", "ignore",  # don't fail on missing assets
+            "--javascript-delay", "1200",       # small wait for images/CDNs
+            "-",                                # HTML from stdin
+            "-",                                # JPG to stdout
+        ]
+
+        # Supervised: killed if it hangs (TMS_RENDER_TIMEOUT_SEC) or the viewer it renders for goes away
+        result = ProcessSupervisor.run(cmd, TooManyStreamsConfig.get_render_timeout(), input=html.encode("utf-8"))
+        if result.returncode != 0 or not result.stdout:
+            raise subprocess.CalledProcessError(result.returncode, cmd, output=result.stdout, stderr=result.stderr)
+        return result.stdout
+
+    def render_frame(self, html: str) -> tuple[int, int, bytes]:
+        """
+        Render an already built HTML document to one raw bgr24 video frame, skipping the lossy JPEG step.
+        Returns: (width, height, frame bytes), rows top to bottom without padding.
+        """
+        return self.bmp_to_bgr24(self.rasterize(html, image_format="bmp"))
+
+    @staticmethod
+    def bmp_to_bgr24(bmp: bytes) -> tuple[int, int, bytes]:
+        """
+        Converts an uncompressed 24 or 32 bit BMP (what wkhtmltoimage writes) to raw bgr24 pixels.
+        Returns: (width, height, frame bytes)
+        """
+        if bmp[:2] != b"BM":
+            raise ValueError("Not a BMP image")
+        pixel_offset, = struct.unpack_from("<I", bmp, 10)
+        width, height, _, bpp, compression = struct.unpack_from("<iiHHI", bmp, 18)
+        # BI_BITFIELDS (3) is only a channel mask declaration for 32 bit images; the layout is still BGRA
+        if bpp not in (24, 32) or compression not in (0, 3):
+            raise ValueError(f"Unsupported BMP: {bpp} bpp, compression {compression}")
+        bottom_up = height > 0
+        height = abs(height)
+        stride = (width * bpp // 8 + 3) & ~3
+        rows = range(height - 1, -1, -1) if bottom_up else range(height)
+        if bpp == 24:
+            row_len = width * 3
+            frame = b"".join(bmp[pixel_offset + y * stride:pixel_offset + y * stride + row_len] for y in rows)
+        else:
+            bgra = b"".join(bmp[pixel_offset + y * stride:pixel_offset + y * stride + width * 4] for y in rows)
+            # Drop the alpha byte of every pixel
+            frame = bytearray(width * height * 3)
+            frame[0::3], frame[1::3], frame[2::3] = bgra[0::4], bgra[1::4], bgra[2::4]
+            frame = bytes(frame)
+        return width, height, frame
+
+    @staticmethod
+    def publish(data: bytes, out_path: str) -> None:
+        """
+        Writes `data` to `out_path` atomically: readers see either the previous file or the complete new one.
+        """
+        out_dir = os.path.dirname(os.path.abspath(out_path)) or "."
+        os.makedirs(out_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=".tms-", suffix=Path(out_path).suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+# On-disk slate artifact cache that survives restarts and plugin reinstalls.
+# Redis keeps slates for TMS_SLATE_CACHE_TTL_SEC and is usually not persisted, so after a restart every slate
+# had to be rendered and encoded again. Encoded slates and rendered pages are also written to TMS_ARTIFACT_DIR,
+# which lives outside the plugin folder (next to the persistent config), with an index keyed by fingerprint.
+# Least recently used artifacts are removed once the cache grows past TMS_ARTIFACT_CACHE_MB.
+# SlateStore reads it when Redis misses.
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.ArtifactCache')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class ArtifactCache:
+
+    # Artifact kinds kept on disk: encoded slates and rendered pages. HLS segments are cut from the slate quickly.
+    KINDS = ("ts", "jpg", "bgr24")
+    INDEX_FILE = "index.json"
+    # A hit only records the artifact's last use if the recorded one is older than this (seconds),
+    # so serving from disk doesn't rewrite the index every time
+    TOUCH_SEC = 60
+
+    # Serialises index updates between threads; flock on the index lock file does between workers
+    _lock = threading.Lock()
+    # Directory that could not be created, so the warning is only logged once
+    _unusable: str|None = None
+    # Directory already swept of temp files left by interrupted writes
+    _swept: str|None = None
+
+    @staticmethod
+    def _dir() -> str|None:
+        """
+        Returns the cache directory, or None if the cache is disabled or the directory can't be created.
+        """
+        if TooManyStreamsConfig.get_artifact_cache_mb() <= 0:
+            return None
+        path = TooManyStreamsConfig.get_artifact_dir()
+        if path == ArtifactCache._unusable:
+            return None
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"TooManyStreams: Artifact cache {path} is not usable; slates are only cached in Redis: {e}")
+            ArtifactCache._unusable = path
+            return None
+        if path != ArtifactCache._swept:
+            ArtifactCache._swept = path
+            ArtifactCache._sweep(path)
+        return path
+
+    @staticmethod
+    def _sweep(directory: str) -> None:
+        """
+        Removes temp files of writes that never finished (e.g. a crash mid-write). They are in no index, so
+        eviction would never reclaim them. Only files older than TOUCH_SEC, so other workers' writes in progress stay.
+        """
+        now = time.time()
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith((".artifact.", ".index.")) or name == ".index.lock":
+                continue
+            path = os.path.join(directory, name)
+            with contextlib.suppress(OSError):
+                if now - os.stat(path).st_mtime > ArtifactCache.TOUCH_SEC:
+                    os.remove(path)
+                    logger.debug(f"TooManyStreams: Removed stale temp file {path}")
+
+    @staticmethod
+    def _write_atomic(directory: str, prefix: str, path: str, data: bytes) -> None:
+        """
+        Writes `data` to `path` through a temp file, so readers never see a partial file.
+        The temp file is removed if the write fails (e.g. the disk is full).
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=prefix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _path(directory: str, fingerprint: str, kind: str) -> str:
+        return os.path.join(directory, f"{fingerprint}.{kind}")
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _locked(directory: str):
+        with ArtifactCache._lock, open(os.path.join(directory, ".index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _load_index(directory: str) -> dict:
+        """
+        Returns the index: {fingerprint: {kind: {"size": bytes, "used": unix time}}}.
+        """
+        try:
+            with open(os.path.join(directory, ArtifactCache.INDEX_FILE), "r") as f:
+                index = json.load(f)
+            return index if isinstance(index, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_index(directory: str, index: dict) -> None:
+        """
+        Writes the index atomically, so other workers never read a partial file.
+        """
+        ArtifactCache._write_atomic(directory, ".index.", os.path.join(directory, ArtifactCache.INDEX_FILE),
+                                    json.dumps(index).encode("utf-8"))
+
+    @staticmethod
+    def get(fingerprint: str, kind: str) -> bytes|None:
+        """
+        Returns the artifact bytes, or None if it isn't cached on disk.
+        """
+        if kind not in ArtifactCache.KINDS or (directory := ArtifactCache._dir()) is None:
+            return None
+        try:
+            with open(ArtifactCache._path(directory, fingerprint, kind), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"TooManyStreams: Failed to read slate {kind} {fingerprint[:12]} from {directory}: {e}")
+            return None
+        try:
+            with ArtifactCache._locked(directory):
+                index = ArtifactCache._load_index(directory)
+                entry = index.setdefault(fingerprint, {}).setdefault(kind, {"size": len(data), "used": 0})
+                if time.time() - entry["used"] > ArtifactCache.TOUCH_SEC:
+                    entry["used"] = time.time()
+                    ArtifactCache._save_index(directory, index)
+        except OSError as e:
+            logger.debug(f"TooManyStreams: Failed to update artifact index in {directory}: {e}")
+        logger.debug(f"TooManyStreams: Slate {kind} {fingerprint[:12]} served from {directory} ({len(data)} bytes)")
+        return data
+
+    @staticmethod
+    def exists(fingerprint: str, kind: str) -> bool:
+        if kind not in ArtifactCache.KINDS or (directory := ArtifactCache._dir()) is None:
+            return False
+        return os.path.exists(ArtifactCache._path(directory, fingerprint, kind))
+
+    @staticmethod
+    def put(fingerprint: str, kind: str, data: bytes) -> None:
+        """
+        Writes the artifact and records it in the index, then removes the least recently used artifacts
+        until the cache fits in TMS_ARTIFACT_CACHE_MB.
+        """
+        if kind not in ArtifactCache.KINDS or (directory := ArtifactCache._dir()) is None:
+            return
+        path = ArtifactCache._path(directory, fingerprint, kind)
+        try:
+            ArtifactCache._write_atomic(directory, ".artifact.", path, data)
+            with ArtifactCache._locked(directory):
+                index = ArtifactCache._load_index(directory)
+                index.setdefault(fingerprint, {})[kind] = {"size": len(data), "used": time.time()}
+                ArtifactCache._evict(directory, index)
+                ArtifactCache._save_index(directory, index)
+        except OSError as e:
+            logger.warning(f"TooManyStreams: Failed to write slate {kind} {fingerprint[:12]} to {directory}: {e}")
+            return
+        logger.debug(f"TooManyStreams: Stored slate {kind} {fingerprint[:12]} in {directory} ({len(data)} bytes)")
+
+    @staticmethod
+    def _evict(directory: str, index: dict) -> None:
+        """
+        Removes the least recently used artifacts from disk and `index` while the total is over the cap.
+        """
+        cap = TooManyStreamsConfig.get_artifact_cache_mb() * 1024 * 1024
+        entries = sorted(
+            ((entry["used"], fingerprint, kind, entry["size"])
+             for fingerprint, kinds in index.items() for kind, entry in kinds.items()),
+        )
+        total = sum(size for *_, size in entries)
+        # The most recently used artifact is always kept, even if it is bigger than the cap on its own
+        for _, fingerprint, kind, size in entries[:-1]:
+            if total <= cap:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(ArtifactCache._path(directory, fingerprint, kind))
+            del index[fingerprint][kind]
+            if not index[fingerprint]:
+                del index[fingerprint]
+            total -= size
+            logger.debug(f"TooManyStreams: Evicted slate {kind} {fingerprint[:12]} from {directory} ({size} bytes)")
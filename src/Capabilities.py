@@ -0,0 +1,181 @@
+# Capability registry for the external binaries TooManyStreams uses (ffmpeg, wkhtmltoimage).
+# Probing ffmpeg means spawning it and parsing its encoder list, so results are cached on disk keyed by
+# the binary's real path, mtime and size. The cache is shared by restarts and Dispatcharr workers, and a
+# binary is probed again as soon as it is replaced or upgraded.
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.Capabilities')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class Capabilities:
+
+    BINARIES = ("ffmpeg", "wkhtmltoimage")
+    # Preferred encoders, best first; the first one the installed ffmpeg provides is used
+    VIDEO_ENCODERS = ("libx264", "libopenh264", "mpeg2video")
+    AUDIO_ENCODERS = ("aac", "libfdk_aac", "mp2", "ac3")
+    PROBE_TIMEOUT_SEC = 15
+    # How long (seconds) a failed probe is reported before the binary is probed again
+    PROBE_RETRY_SEC = 30
+
+    _lock = threading.Lock()
+    # binary name -> probe result, for this process
+    _memo: dict = {}
+    # binary name -> failed probe result (with "failed_at"), kept apart so the binary is probed again
+    _failed: dict = {}
+
+    @staticmethod
+    def _binary_key(path: str) -> str|None:
+        """
+        Returns the cache key for a binary: its real path, mtime and size. None if it can't be read.
+        """
+        try:
+            real = os.path.realpath(path)
+            st = os.stat(real)
+        except OSError:
+            return None
+        return f"{real}:{st.st_mtime_ns}:{st.st_size}"
+
+    @staticmethod
+    def _load_cache() -> dict:
+        try:
+            with open(TooManyStreamsConfig.get_capability_cache_path(), "r") as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_cache(cache: dict) -> None:
+        """
+        Writes the cache atomically, so other workers never read a partial file.
+        """
+        path = TooManyStreamsConfig.get_capability_cache_path()
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".capabilities.")
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"TooManyStreams: Failed to write capability cache {path}: {e}")
+
+    @staticmethod
+    def _parse_encoders(text: str) -> list[str]:
+        """
+        Parses the encoder names out of `ffmpeg -encoders` output (" V....D libx264  description").
+        """
+        encoders = []
+        in_list = False
+        for line in text.splitlines():
+            if line.strip().startswith("------"):
+                in_list = True
+                continue
+            parts = line.split()
+            if in_list and len(parts) >= 2 and re.fullmatch(r"[VAS][A-Z.]{5}", parts[0]):
+                encoders.append(parts[1])
+        return encoders
+
+    @staticmethod
+    def _probe(binary: str, path: str) -> dict:
+        """
+        Runs the binary once and returns {"binary", "path", "version", "encoders", "probed_at"}.
+        """
+        entry = {"binary": binary, "path": path, "version": None, "encoders": [], "probed_at": time.time()}
+        if binary == "ffmpeg":
+            # One process: the version banner goes to stderr, the encoder list to stdout
+            result = subprocess.run([path, "-encoders"], capture_output=True, text=True,
+                                    timeout=Capabilities.PROBE_TIMEOUT_SEC)
+            entry["encoders"] = Capabilities._parse_encoders(result.stdout)
+            banner = result.stderr or result.stdout
+        else:
+            result = subprocess.run([path, "--version"], capture_output=True, text=True,
+                                    timeout=Capabilities.PROBE_TIMEOUT_SEC)
+            banner = result.stdout or result.stderr
+        if match := re.search(rf"{re.escape(binary)}\s+(?:version\s+)?(\S+)", banner or ""):
+            entry["version"] = match.group(1)
+        return entry
+
+    @staticmethod
+    def get(binary: str) -> dict|None:
+        """
+        Returns what is known about `binary` (path, version, encoders), or None if it is not installed.
+        Probes it only if this exact file (path, mtime, size) hasn't been probed before by any worker.
+        A failed probe is reported (with an "error") for PROBE_RETRY_SEC, then tried again.
+        """
+        path = shutil.which(binary)
+        if not path:
+            return None
+        key = Capabilities._binary_key(path)
+        memo = Capabilities._memo.get(binary)
+        if memo is not None and memo.get("key") == key:
+            return memo
+        failed = Capabilities._failed.get(binary)
+        if failed is not None and failed.get("key") == key and time.time() - failed["failed_at"] < Capabilities.PROBE_RETRY_SEC:
+            return failed
+
+        with Capabilities._lock:
+            cache = Capabilities._load_cache()
+            entry = cache.get(key) if key else None
+            if entry is None:
+                try:
+                    entry = Capabilities._probe(binary, path)
+                except (OSError, subprocess.SubprocessError) as e:
+                    # Neither written to disk nor memoised, so it is probed again after PROBE_RETRY_SEC
+                    logger.warning(f"TooManyStreams: Failed to probe {binary} at {path}: {e}")
+                    entry = {"binary": binary, "path": path, "version": None, "encoders": [], "error": str(e),
+                             "key": key, "failed_at": time.time()}
+                    Capabilities._failed[binary] = entry
+                    return entry
+                else:
+                    entry["key"] = key
+                    # Drop entries for older versions of the same file
+                    real_path = key.rsplit(":", 2)[0]
+                    cache = {k: v for k, v in cache.items() if k.rsplit(":", 2)[0] != real_path}
+                    cache[key] = entry
+                    Capabilities._save_cache(cache)
+                    logger.info(f"TooManyStreams: Detected {binary} {entry['version']} at {path} "
+                                f"({len(entry['encoders'])} encoders)")
+            Capabilities._memo[binary] = entry
+            Capabilities._failed.pop(binary, None)
+        return entry
+
+    @staticmethod
+    def has_encoder(name: str) -> bool:
+        entry = Capabilities.get("ffmpeg")
+        return entry is not None and name in entry["encoders"]
+
+    @staticmethod
+    def pick_encoder(candidates: tuple, default: str) -> str:
+        """
+        Returns the first of `candidates` the installed ffmpeg provides, or `default` if none (or unknown).
+        """
+        entry = Capabilities.get("ffmpeg")
+        encoders = set(entry["encoders"]) if entry else set()
+        return next((name for name in candidates if name in encoders), default)
+
+    @staticmethod
+    def video_encoder() -> str:
+        return Capabilities.pick_encoder(Capabilities.VIDEO_ENCODERS, "libx264")
+
+    @staticmethod
+    def audio_encoder() -> str:
+        return Capabilities.pick_encoder(Capabilities.AUDIO_ENCODERS, "mp2")
+
+    @staticmethod
+    def summary() -> dict:
+        """
+        Returns the known capabilities of every binary, keyed by binary name (None if not installed).
+        """
+        return {binary: Capabilities.get(binary) for binary in Capabilities.BINARIES}
@@ -0,0 +1,180 @@
+# HLS output for the TooManyStreams slate.
+# The slate MPEG-TS is split once per fingerprint into short segments at video keyframes and stored in the
+# SlateStore next to it. Segment URLs contain the fingerprint, so they never change and any HTTP cache in
+# front of the server can keep them. The live playlist is computed from the clock: every client polling it
+# sees the same window of segments, looping over the slate, and the server keeps no per-client state.
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+from .SlateStore import SlateStore
+from .MpegTs import MpegTs, PTS_HZ
+
+
+logger = logging.getLogger('plugins.too_many_streams.HlsSlate')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class HlsSlate:
+
+    # Epochs of the live playlist per rendition: which slate the segment sequence numbers map to from which
+    # point on. A new epoch starts after the segment that is live when the slate changes, so segments
+    # clients have already seen in a playlist never change.
+    _epochs: dict = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def split(ts_bytes: bytes, target_sec: float, fallback_sec: float) -> list[tuple[float, bytes]]:
+        """
+        Splits an MPEG-TS stream into segments of about `target_sec` that each start at a video keyframe,
+        with the PAT/PMT repeated at the start of each so every segment can be decoded on its own.
+        Streams without a recognisable video PID or keyframes become one segment of `fallback_sec`.
+        Returns: [(duration seconds, segment bytes)]
+        """
+        parsed = MpegTs.split_at_keyframes(ts_bytes, target_sec)
+        if parsed is None:
+            logger.debug("TooManyStreams: No keyframes found in slate; serving it as a single HLS segment.")
+            return [(fallback_sec, ts_bytes)]
+        chunks = parsed["chunks"]
+        segments = []
+        for n, (pts, data) in enumerate(chunks):
+            next_pts = chunks[n + 1][0] if n + 1 < len(chunks) else parsed["end_pts"]
+            segments.append((round((next_pts - pts) / PTS_HZ, 3), data if n == 0 else parsed["psi"] + data))
+        return segments
+
+    @staticmethod
+    def store(fingerprint: str, ts_bytes: bytes, fallback_sec: float) -> list[float]:
+        """
+        Splits the slate into segments and stores them, and their index, in the SlateStore under its fingerprint.
+        Returns the segment durations.
+        """
+        return [duration for duration, _ in HlsSlate._store(fingerprint, ts_bytes, fallback_sec)]
+
+    @staticmethod
+    def _store(fingerprint: str, ts_bytes: bytes, fallback_sec: float) -> list[tuple[float, bytes]]:
+        segments = HlsSlate.split(ts_bytes, TooManyStreamsConfig.get_hls_segment_sec(), fallback_sec)
+        for n, (_, data) in enumerate(segments):
+            SlateStore.put(fingerprint, f"seg{n}", data)
+        durations = [duration for duration, _ in segments]
+        # The index last, so a stored index means all its segments are stored. It expires halfway through their
+        # TTL, so the segments of any playlist built from it outlive that playlist; the next playlist request
+        # then stores them again, which renews them.
+        SlateStore.put(fingerprint, "hls", json.dumps(durations).encode("utf-8"), ttl=HlsSlate.index_ttl())
+        logger.debug(f"TooManyStreams: Stored slate {fingerprint[:12]} as {len(segments)} HLS segments")
+        return segments
+
+    @staticmethod
+    def index_ttl() -> int:
+        """
+        Returns how long (seconds) a segment index is kept: half the slate cache TTL.
+        """
+        return max(1, TooManyStreamsConfig.get_slate_cache_ttl() // 2)
+
+    @staticmethod
+    def get_index(fingerprint: str) -> list[float]|None:
+        """
+        Returns the segment durations of a stored slate, or None if it hasn't been segmented (or expired).
+        """
+        if data := SlateStore.get(fingerprint, "hls"):
+            try:
+                return json.loads(data)
+            except ValueError:
+                return None
+        return None
+
+    @staticmethod
+    def get_segment(fingerprint: str, index: int, fallback_sec: float) -> bytes|None:
+        """
+        Returns a stored segment. A missing one is cut again from the slate if that is still stored, so a playlist
+        that outlived its segments (e.g. held by a cache) doesn't list URLs that 404.
+        Returns None if neither is stored, or the slate has no such segment.
+        """
+        if data := SlateStore.get(fingerprint, f"seg{index}"):
+            return data
+        if not (ts_bytes := SlateStore.get(fingerprint, "ts")):
+            return None
+        logger.debug(f"TooManyStreams: HLS segment {index} of slate {fingerprint[:12]} expired; segmenting the slate again")
+        segments = HlsSlate._store(fingerprint, ts_bytes, fallback_sec)
+        return segments[index][1] if index < len(segments) else None
+
+    @staticmethod
+    def playlist(fingerprint: str, durations: list[float], rendition: str, url_prefix: str = "/hls",
+                 now: float|None = None) -> str:
+        """
+        Returns the live playlist for the current slate: the last TMS_HLS_WINDOW segments of a sequence that
+        loops over the slate's segments in real time. Each loop, and each switch to a new slate, is marked as
+        a discontinuity.
+        """
+        now = time.time() if now is None else now
+        window = TooManyStreamsConfig.get_hls_window()
+
+        with HlsSlate._lock:
+            epochs = HlsSlate._epochs.get(rendition)
+            if not epochs:
+                # Sequence numbers follow the clock, so they keep increasing across restarts
+                epochs = HlsSlate._epochs[rendition] = [HlsSlate._epoch(
+                    fingerprint, durations, int(now // TooManyStreamsConfig.get_hls_segment_sec()), now, window)]
+            last = epochs[-1]
+            if last["fingerprint"] != fingerprint:
+                # The new slate starts after the segment that is live now, which clients may already have
+                head_seq, head_end = HlsSlate._head(last, now)
+                epochs.append(HlsSlate._epoch(fingerprint, durations, head_seq + 1, head_end, HlsSlate._disc(last, head_seq) + 1))
+                # Every epoch has at least one segment, so a window never needs more than this
+                del epochs[:-(window + 1)]
+            head_seq, _ = HlsSlate._head(next(e for e in reversed(epochs) if e["start_time"] <= now), now)
+            epochs = list(epochs)
+
+        entries = []
+        for seq in range(head_seq - window + 1, head_seq + 1):
+            epoch = next((e for e in reversed(epochs) if e["start_seq"] <= seq), epochs[0])
+            entries.append((seq, epoch, (seq - epoch["start_seq"]) % len(epoch["durations"])))
+
+        target = max(1, math.ceil(max(max(e["durations"]) for _, e, _ in entries)))
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target}",
+            f"#EXT-X-MEDIA-SEQUENCE:{entries[0][0]}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{HlsSlate._disc(entries[0][1], entries[0][0])}",
+        ]
+        for n, (seq, epoch, index) in enumerate(entries):
+            if n and (index == 0 or seq == epoch["start_seq"]):
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{epoch['durations'][index]:.3f},")
+            lines.append(f"{url_prefix}/{epoch['fingerprint']}/{index}.ts")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _epoch(fingerprint: str, durations: list[float], start_seq: int, start_time: float, disc_base: int) -> dict:
+        """
+        Returns a playlist epoch: the slate `fingerprint` looping from sequence number `start_seq` at `start_time`.
+        """
+        starts = [0.0]
+        for duration in durations[:-1]:
+            starts.append(starts[-1] + duration)
+        return {"fingerprint": fingerprint, "durations": durations, "starts": starts, "loop_sec": sum(durations),
+                "start_seq": start_seq, "start_time": start_time, "disc_base": disc_base}
+
+    @staticmethod
+    def _head(epoch: dict, now: float) -> tuple[int, float]:
+        """
+        Returns (sequence number, end time) of the segment of `epoch` that is live at `now`.
+        """
+        loops, offset = divmod(max(0.0, now - epoch["start_time"]), epoch["loop_sec"])
+        index = bisect.bisect_right(epoch["starts"], offset) - 1
+        seq = epoch["start_seq"] + int(loops) * len(epoch["durations"]) + index
+        end = epoch["start_time"] + loops * epoch["loop_sec"] + epoch["starts"][index] + epoch["durations"][index]
+        return seq, end
+
+    @staticmethod
+    def _disc(epoch: dict, seq: int) -> int:
+        """
+        Returns the discontinuity sequence number of segment `seq` in `epoch`.
+        Segments listed before the first epoch started count from `disc_base`, which is set high enough to stay positive.
+        """
+        return epoch["disc_base"] + (seq - epoch["start_seq"]) // len(epoch["durations"])
@@ -0,0 +1,217 @@
+# Sampling profiler for the patched Channel.get_stream hot path.
+# A sampled call records how long it spent in DB queries, Redis round trips, maxed-state lookups and
+# side effects (adding/removing the TMS stream). Samples are collected in memory and pushed to short Redis
+# lists by a background thread, so calls made in any Dispatcharr worker process can be summarised from one
+# place without a Redis round trip in the call itself.
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from core.utils import RedisClient
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.HotPathProfiler')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class _TimedRedis:
+    """
+    Thin proxy around a Redis client that adds the time of every command to the "redis" section.
+    """
+
+    def __init__(self, client, call: dict):
+        self._client = client
+        self._call = call
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def _timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                HotPathProfiler._add(self._call, "redis", time.perf_counter() - start)
+        return _timed
+
+
+class HotPathProfiler:
+
+    KEY_PREFIX = "tms:profile:get_stream"
+    SECTIONS = ("total", "db", "redis", "maxed", "side_effects")
+    # Samples kept per section (most recent first)
+    MAX_SAMPLES = 2000
+    # How often collected samples are written to Redis (seconds)
+    FLUSH_SEC = 5
+
+    _local = threading.local()
+    _NOOP = nullcontext()
+    _lock = threading.Lock()
+    _pending: list = []   # sampled calls not written to Redis yet, oldest first
+    _flusher_pid = None
+
+    @staticmethod
+    def _current() -> dict|None:
+        return getattr(HotPathProfiler._local, "call", None)
+
+    @staticmethod
+    def _add(call: dict, section: str, seconds: float) -> None:
+        call[section] = call.get(section, 0.0) + seconds
+
+    @staticmethod
+    @contextmanager
+    def _sampled_call():
+        call = {}
+        HotPathProfiler._local.call = call
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            call["total"] = time.perf_counter() - start
+            HotPathProfiler._local.call = None
+            HotPathProfiler._publish(call)
+
+    @staticmethod
+    def call():
+        """
+        Context manager around one get_stream call. Only a TMS_PROFILE_SAMPLE_RATE fraction of calls is
+        recorded; for the others (and when profiling is off) this is a shared no-op context.
+        """
+        rate = TooManyStreamsConfig.get_profile_sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate) or HotPathProfiler._current() is not None:
+            return HotPathProfiler._NOOP
+        return HotPathProfiler._sampled_call()
+
+    @staticmethod
+    def section(name: str):
+        """
+        Context manager that adds the time of the wrapped block to `name` in the current sampled call.
+        Sections are inclusive: a side effect that runs inside a maxed-state check counts towards both.
+        """
+        call = HotPathProfiler._current()
+        if call is None:
+            return HotPathProfiler._NOOP
+        return HotPathProfiler._timed_section(call, name)
+
+    @staticmethod
+    @contextmanager
+    def _timed_section(call: dict, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            HotPathProfiler._add(call, name, time.perf_counter() - start)
+
+    @staticmethod
+    def redis(client):
+        """
+        Returns `client`, wrapped so its commands are timed if the current call is sampled.
+        """
+        call = HotPathProfiler._current()
+        if call is None:
+            return client
+        return _TimedRedis(client, call)
+
+    @staticmethod
+    def _ensure_flusher() -> None:
+        """
+        Starts the flush thread of this process. Dispatcharr forks workers, so this is checked per pid.
+        """
+        if HotPathProfiler._flusher_pid == os.getpid():
+            return
+        with HotPathProfiler._lock:
+            if HotPathProfiler._flusher_pid == os.getpid():
+                return
+            HotPathProfiler._flusher_pid = os.getpid()
+            # Samples taken by the parent before the fork are the parent's to flush
+            HotPathProfiler._pending = []
+        threading.Thread(target=HotPathProfiler._flush_thread, name="TMSProfileFlush", daemon=True).start()
+
+    @staticmethod
+    def _flush_thread() -> None:
+        while True:
+            time.sleep(HotPathProfiler.FLUSH_SEC)
+            HotPathProfiler.flush()
+
+    @staticmethod
+    def _publish(call: dict) -> None:
+        HotPathProfiler._ensure_flusher()
+        with HotPathProfiler._lock:
+            HotPathProfiler._pending.append(call)
+            if len(HotPathProfiler._pending) > HotPathProfiler.MAX_SAMPLES:
+                del HotPathProfiler._pending[:-HotPathProfiler.MAX_SAMPLES]
+
+    @staticmethod
+    def flush() -> None:
+        """
+        Writes the samples collected in this process to Redis, in one pipelined round trip.
+        Samples are kept for the next flush if Redis is unavailable.
+        """
+        with HotPathProfiler._lock:
+            calls, HotPathProfiler._pending = HotPathProfiler._pending, []
+        if not calls:
+            return
+        try:
+            pipe = RedisClient.get_client().pipeline(transaction=False)
+            for section in HotPathProfiler.SECTIONS:
+                key = f"{HotPathProfiler.KEY_PREFIX}:{section}"
+                # LPUSH adds its values in order, so the most recent ends up first
+                pipe.lpush(key, *(f"{call.get(section, 0.0) * 1000:.3f}" for call in calls))
+                pipe.ltrim(key, 0, HotPathProfiler.MAX_SAMPLES - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"TooManyStreams: Failed to publish get_stream profile samples: {e}")
+            with HotPathProfiler._lock:
+                HotPathProfiler._pending[:0] = calls[-HotPathProfiler.MAX_SAMPLES:]
+                del HotPathProfiler._pending[:-HotPathProfiler.MAX_SAMPLES]
+
+    @staticmethod
+    def _percentile(sorted_values: list[float], pct: float) -> float:
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+        return sorted_values[index]
+
+    @staticmethod
+    def summary() -> dict:
+        """
+        Returns per-section percentiles (milliseconds) over the most recent samples from all workers.
+        Other workers' samples show up once their flush thread has written them.
+        """
+        HotPathProfiler.flush()
+        redis_client = RedisClient.get_client()
+        result = {"sample_rate": TooManyStreamsConfig.get_profile_sample_rate(), "sections": {}}
+        for section in HotPathProfiler.SECTIONS:
+            values = sorted(float(v) for v in redis_client.lrange(f"{HotPathProfiler.KEY_PREFIX}:{section}", 0, -1))
+            result["sections"][section] = {
+                "samples": len(values),
+                "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+                "p50_ms": HotPathProfiler._percentile(values, 50),
+                "p90_ms": HotPathProfiler._percentile(values, 90),
+                "p99_ms": HotPathProfiler._percentile(values, 99),
+                "max_ms": values[-1] if values else 0.0,
+            }
+        return result
+
+    @staticmethod
+    def dump() -> str:
+        """
+        Logs and returns the summary as JSON.
+        """
+        text = json.dumps(HotPathProfiler.summary(), indent=2)
+        logger.info(f"TooManyStreams: get_stream profile:\n{text}")
+        return text
+
+    @staticmethod
+    def reset() -> None:
+        with HotPathProfiler._lock:
+            HotPathProfiler._pending = []
+        RedisClient.get_client().delete(*(f"{HotPathProfiler.KEY_PREFIX}:{section}" for section in HotPathProfiler.SECTIONS))
@@ -0,0 +1,77 @@
+# Stale-while-revalidate for the slate.
+# The last slate of each rendition that was known to be current is kept in memory. When the current slate isn't
+# rendered yet, viewers get that one straight away while the fresh one renders in the background (live viewers
+# switch to it at a keyframe once it is published, see LiveSlate). If rendering fails, the last good slate keeps
+# being served, for at most TMS_MAX_STALE_SEC after it was last current. So a slow or failing wkhtmltoimage or
+# ffmpeg no longer delays viewers or hands them an error.
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.LastGoodSlate')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class LastGoodSlate:
+
+    # How long (seconds) a slate whose background render failed is not retried
+    RETRY_SEC = 10
+
+    _lock = threading.Lock()
+    # rendition -> (fingerprint, TS bytes, time.monotonic() when it was last known to be current)
+    _slates: dict = {}
+    # Fingerprints being rendered in the background, and when renders that failed did so
+    _rendering: set = set()
+    _failed: dict = {}
+
+    @staticmethod
+    def confirm(rendition: str, fingerprint: str, ts_bytes: bytes) -> None:
+        """
+        Records `fingerprint` as the current slate of `rendition`.
+        """
+        LastGoodSlate._slates[rendition] = (fingerprint, ts_bytes, time.monotonic())
+
+    @staticmethod
+    def get(rendition: str) -> tuple[str, bytes]|None:
+        """
+        Returns (fingerprint, TS bytes) of the last good slate of `rendition`, or None if there is none or it stopped
+        being current more than TMS_MAX_STALE_SEC ago.
+        """
+        slate = LastGoodSlate._slates.get(rendition)
+        if slate is None or time.monotonic() - slate[2] > TooManyStreamsConfig.get_max_stale_sec():
+            return None
+        return slate[0], slate[1]
+
+    @staticmethod
+    def revalidate(fingerprint: str, render: Callable[[], object]) -> None:
+        """
+        Runs `render()` in a background thread, unless `fingerprint` is already rendering or failed in the last
+        RETRY_SEC seconds. Failures are logged; the last good slate is served meanwhile.
+        """
+        now = time.monotonic()
+        with LastGoodSlate._lock:
+            if fingerprint in LastGoodSlate._rendering or now - LastGoodSlate._failed.get(fingerprint, -LastGoodSlate.RETRY_SEC) < LastGoodSlate.RETRY_SEC:
+                return
+            LastGoodSlate._failed = {fp: at for fp, at in LastGoodSlate._failed.items() if now - at < LastGoodSlate.RETRY_SEC}
+            LastGoodSlate._rendering.add(fingerprint)
+
+        def _render():
+            try:
+                render()
+                with LastGoodSlate._lock:
+                    LastGoodSlate._failed.pop(fingerprint, None)
+            except Exception as e:
+                logger.warning(f"TooManyStreams: Background render of slate {fingerprint[:12]} failed; serving the last good slate: {e}")
+                # revalidate() replaces the dict under the lock, so writes outside it could be lost
+                with LastGoodSlate._lock:
+                    LastGoodSlate._failed[fingerprint] = time.monotonic()
+            finally:
+                with LastGoodSlate._lock:
+                    LastGoodSlate._rendering.discard(fingerprint)
+
+        threading.Thread(target=_render, name="TMSRevalidate", daemon=True).start()
@@ -0,0 +1,161 @@
+# Live slate stream for connected viewers.
+# Instead of sending the slate in one burst, it is sent keyframe by keyframe in real time (a few seconds
+# ahead). Before each keyframe the stream checks for a newer slate of its rendition, and switches to it
+# there: timestamps and continuity counters are rewritten so the output stays one continuous stream, so a
+# viewer sees the current list of active channels without reconnecting.
+# Slates are usually rendered by the process running the slate server, while direct deliveries (see ProxyFeed)
+# stream from any Dispatcharr worker, so the current fingerprint of each rendition is also kept in Redis and
+# checked by every process at most once per SYNC_SEC.
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+from .MpegTs import MpegTs, PTS_HZ
+from .SlateStore import SlateStore
+
+
+logger = logging.getLogger('plugins.too_many_streams.LiveSlate')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class LiveSlate:
+
+    # Longest a stream sleeps before checking again whether its client is still there (seconds)
+    POLL_SEC = 1.0
+    # How often a process checks Redis for a slate published by another process (seconds)
+    SYNC_SEC = 1.0
+
+    _lock = threading.Lock()
+    # rendition -> newest slate built or fetched by this process: {"fingerprint", "ts", "parsed"}
+    _latest: dict = {}
+    # rendition -> number of live streams
+    _viewers: dict = {}
+    # rendition -> time.monotonic() of the last check in Redis
+    _synced_at: dict = {}
+
+    @staticmethod
+    def publish(rendition: str, fingerprint: str, ts_bytes: bytes) -> None:
+        """
+        Makes this slate the one live streams of `rendition` switch to at their next keyframe, in this process
+        and, through Redis, in every other one.
+        """
+        with LiveSlate._lock:
+            current = LiveSlate._latest.get(rendition)
+            changed = current is None or current["fingerprint"] != fingerprint
+            if changed:
+                LiveSlate._latest[rendition] = {"fingerprint": fingerprint, "ts": ts_bytes, "parsed": None}
+        if changed:
+            SlateStore.set_latest(rendition, fingerprint)
+
+    @staticmethod
+    def _sync(rendition: str) -> None:
+        """
+        Picks up a slate of `rendition` published by another process, checking Redis at most once per SYNC_SEC.
+        """
+        now = time.monotonic()
+        with LiveSlate._lock:
+            if now - LiveSlate._synced_at.get(rendition, -LiveSlate.SYNC_SEC) < LiveSlate.SYNC_SEC:
+                return
+            LiveSlate._synced_at[rendition] = now
+            known = LiveSlate.latest_fingerprint(rendition)
+        fingerprint = SlateStore.get_latest(rendition)
+        if fingerprint is None or fingerprint == known:
+            return
+        if not (ts_bytes := SlateStore.get(fingerprint, "ts")):
+            return
+        with LiveSlate._lock:
+            # Unless this process published another slate meanwhile, which is at least as new
+            if LiveSlate.latest_fingerprint(rendition) == known:
+                LiveSlate._latest[rendition] = {"fingerprint": fingerprint, "ts": ts_bytes, "parsed": None}
+                logger.debug(f"TooManyStreams: Picked up slate {fingerprint[:12]} ({rendition}) from another process")
+
+    @staticmethod
+    def latest_fingerprint(rendition: str) -> str|None:
+        current = LiveSlate._latest.get(rendition)
+        return current["fingerprint"] if current else None
+
+    @staticmethod
+    def has_viewers(rendition: str) -> bool:
+        return LiveSlate._viewers.get(rendition, 0) > 0
+
+    @staticmethod
+    def _parse(slate: dict, fallback_sec: float) -> dict:
+        """
+        Returns the slate cut at every keyframe, parsed once per slate:
+        {"chunks": [(pts, bytes, duration)], "end_pts", "pmt"}. A slate without keyframes is one chunk
+        without timestamps, which can't be retimed.
+        """
+        if slate["parsed"] is None:
+            parsed = MpegTs.split_at_keyframes(slate["ts"], 0)
+            if parsed is None:
+                slate["parsed"] = {"chunks": [(None, slate["ts"], fallback_sec)], "end_pts": None, "pmt": None}
+            else:
+                chunks = parsed["chunks"]
+                slate["parsed"] = {
+                    "chunks": [
+                        (pts, data, ((chunks[n + 1][0] if n + 1 < len(chunks) else parsed["end_pts"]) - pts) / PTS_HZ)
+                        for n, (pts, data) in enumerate(chunks)
+                    ],
+                    "end_pts": parsed["end_pts"],
+                    "pmt": MpegTs.section(parsed["psi"][188:]),
+                }
+        return slate["parsed"]
+
+    @staticmethod
+    def stream(rendition: str, ts_bytes: bytes, fingerprint: str, duration_sec: float,
+               write: Callable[[bytes], None], client_gone: Callable[[], bool]) -> None:
+        """
+        Streams the latest published slate of `rendition` for `duration_sec` seconds of playback, paced to real
+        time plus TMS_LIVE_LEAD_SEC, switching to newer published slates at keyframes. `ts_bytes` (the slate
+        `fingerprint`) is only published if there is none yet: it may be the last good slate handed out while a
+        newer one renders, and must not switch the other viewers back to it.
+        Returns when the duration is reached or the client left; write errors are raised.
+        """
+        lead = TooManyStreamsConfig.get_live_lead_sec()
+        with LiveSlate._lock:
+            LiveSlate._viewers[rendition] = LiveSlate._viewers.get(rendition, 0) + 1
+            slate = LiveSlate._latest.setdefault(rendition, {"fingerprint": fingerprint, "ts": ts_bytes, "parsed": None})
+        try:
+            parsed = LiveSlate._parse(slate, duration_sec)
+            index = 0
+            pts_offset = 0
+            cc, cc_delta = {}, {}
+            # None until the first switch or loop: the first pass is sent as encoded
+            discontinuity = None
+            sent_sec = 0.0
+            start = time.monotonic()
+            while sent_sec < duration_sec:
+                LiveSlate._sync(rendition)
+                latest = LiveSlate._latest.get(rendition, slate)
+                looped = index == len(parsed["chunks"])
+                if latest["fingerprint"] != slate["fingerprint"] or looped:
+                    # Continue the timestamps from where the previous slate (or pass) stopped
+                    next_pts = parsed["end_pts"] if looped else parsed["chunks"][index][0]
+                    new_parsed = LiveSlate._parse(latest, duration_sec)
+                    if next_pts is not None and new_parsed["chunks"][0][0] is not None:
+                        pts_offset = (pts_offset + next_pts - new_parsed["chunks"][0][0])
+                    if latest is not slate:
+                        logger.debug(f"TooManyStreams: Live slate switching to {latest['fingerprint'][:12]} ({rendition})")
+                    # Same PIDs and codecs: the join is seamless. Otherwise decoders are told to reset.
+                    discontinuity = MpegTs.pids(new_parsed["chunks"][0][1]) if new_parsed["pmt"] != parsed["pmt"] else set()
+                    slate, parsed, index = latest, new_parsed, 0
+                    cc_delta = {}
+
+                pts, data, chunk_sec = parsed["chunks"][index]
+                if pts is not None:
+                    data = MpegTs.retime(data, pts_offset, cc, cc_delta, discontinuity)
+                write(data)
+                index += 1
+                sent_sec += chunk_sec
+
+                # Stay at most `lead` seconds ahead of real time
+                while (ahead := sent_sec - (time.monotonic() - start) - lead) > 0:
+                    time.sleep(min(ahead, LiveSlate.POLL_SEC))
+                    if client_gone():
+                        return
+        finally:
+            with LiveSlate._lock:
+                LiveSlate._viewers[rendition] -= 1
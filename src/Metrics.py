@@ -0,0 +1,167 @@
+# In-process metrics for the TooManyStreams slate path, exposed in Prometheus text format on /metrics.
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('plugins.too_many_streams.Metrics')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+# Latency buckets (seconds), from a Redis round trip up to a slow multi-page render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _fmt_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """
+        Observes how long the wrapped block took, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+    """
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}"]
+        if not values:
+            lines.append(f"{self.name} 0")
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_fmt_labels(dict(key))} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, optionally split by labels.
+    """
+
+    TYPE = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Metrics:
+
+    DISCOVERY = Histogram("tms_discovery_seconds", "Time to look up the active channels for a slate.")
+    RENDER = Histogram("tms_render_seconds", "Time to render one slate page with wkhtmltoimage.")
+    ENCODE = Histogram("tms_encode_seconds", "Time to encode a slate to MPEG-TS with ffmpeg.")
+    TTFB = Histogram("tms_ttfb_seconds", "Time from a slate request to its first byte being sent.")
+    CACHE = Counter("tms_cache_requests_total", "Slate cache lookups by stage (render = page image, encode = TS, hls = segment index) and result (hit/miss).")
+    CLIENTS_ACTIVE = Gauge("tms_clients_active", "Clients currently streaming the slate.")
+    CLIENTS_TOTAL = Counter("tms_clients_total", "Slate stream requests served.")
+    HLS_REQUESTS = Counter("tms_hls_requests_total", "HLS requests served, by kind (playlist/segment).")
+    BYTES_SERVED = Counter("tms_bytes_served_total", "Slate bytes written to clients.")
+    STALE_SERVED = Counter("tms_stale_served_total", "Slates served from the last good one, by reason (rendering = the current one is rendering, error = looking it up failed).")
+    PROCESSES = Gauge("tms_processes_running", "Helper processes currently running, by binary.")
+    PROCESS_KILLS = Counter("tms_process_kills_total", "Helper processes killed or refused by the supervisor, by binary and reason (timeout/cancelled/queue_timeout).")
+    MAXED_CHANNELS = Gauge("tms_maxed_channels", "Channels currently carrying a maxed-out flag.")
+
+    @staticmethod
+    def cache_result(stage: str, hit: bool) -> None:
+        Metrics.CACHE.inc(stage=stage, result="hit" if hit else "miss")
+
+    @staticmethod
+    @contextmanager
+    def track_process(binary: str):
+        """
+        Counts a helper process (ffmpeg, wkhtmltoimage) as running for the duration of the wrapped block.
+        """
+        Metrics.PROCESSES.inc(binary=binary)
+        try:
+            yield
+        finally:
+            Metrics.PROCESSES.dec(binary=binary)
+
+    @staticmethod
+    def render(collectors: list = None) -> str:
+        """
+        Returns all metrics in Prometheus text exposition format.
+        `collectors` are called first, to refresh gauges that are computed at scrape time.
+        """
+        for collect in collectors or []:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning(f"TooManyStreams: Metrics collector failed: {e}")
+        lines = []
+        for metric in (
+            Metrics.DISCOVERY, Metrics.RENDER, Metrics.ENCODE, Metrics.TTFB, Metrics.CACHE,
+            Metrics.CLIENTS_ACTIVE, Metrics.CLIENTS_TOTAL, Metrics.HLS_REQUESTS, Metrics.BYTES_SERVED, Metrics.STALE_SERVED, Metrics.PROCESSES,
+            Metrics.PROCESS_KILLS, Metrics.MAXED_CHANNELS,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
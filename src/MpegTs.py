@@ -0,0 +1,195 @@
+# Minimal MPEG-TS helpers for the slate: finding keyframes to cut at, and rewriting timestamps and
+# continuity counters so slates can be joined into one continuous stream.
+# Only what the slate encodes (one program, PES video and audio, PCR on the video PID) is handled.
+import logging
+import os
+
+
+logger = logging.getLogger('plugins.too_many_streams.MpegTs')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+TS_PACKET = 188
+PTS_HZ = 90000
+# Timestamps are 33 bits and wrap around
+PTS_WRAP = 1 << 33
+NULL_PID = 0x1FFF
+# PMT stream types that carry video (MPEG-1/2, MPEG-4 part 2, H.264, HEVC)
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1B, 0x24}
+
+
+class MpegTs:
+
+    @staticmethod
+    def pid(pkt) -> int:
+        return ((pkt[1] & 0x1F) << 8) | pkt[2]
+
+    @staticmethod
+    def pids(data: bytes) -> set[int]:
+        """
+        Returns the PIDs of all packets in `data`.
+        """
+        return {MpegTs.pid(data[off:off + TS_PACKET]) for off in range(0, len(data) - TS_PACKET + 1, TS_PACKET)}
+
+    @staticmethod
+    def _has_pes_header(stream_id: int) -> bool:
+        # Audio/video streams and private stream 1 carry the optional PES header with PTS/DTS
+        return stream_id == 0xBD or 0xC0 <= stream_id <= 0xEF
+
+    @staticmethod
+    def payload_offset(pkt) -> int:
+        """
+        Returns where the payload of a TS packet starts, after the header and adaptation field.
+        """
+        if (pkt[3] >> 4) & 0x3 in (2, 3):
+            return 5 + pkt[4]
+        return 4
+
+    @staticmethod
+    def section(pkt) -> bytes:
+        """
+        Returns the PSI section (PAT/PMT) starting in a packet with payload_unit_start set.
+        """
+        off = MpegTs.payload_offset(pkt)
+        off += 1 + pkt[off]  # pointer field
+        length = ((pkt[off + 1] & 0x0F) << 8) | pkt[off + 2]
+        return bytes(pkt[off:off + 3 + length])
+
+    @staticmethod
+    def _read_ts(data, off: int) -> int:
+        return (((data[off] >> 1) & 0x07) << 30) | (data[off + 1] << 22) | ((data[off + 2] >> 1) << 15) | (data[off + 3] << 7) | (data[off + 4] >> 1)
+
+    @staticmethod
+    def _write_ts(data: bytearray, off: int, value: int) -> None:
+        # Keeps the 4-bit prefix of the field, only the 33-bit value and its marker bits are written
+        data[off] = (data[off] & 0xF0) | ((value >> 29) & 0x0E) | 0x01
+        data[off + 1] = (value >> 22) & 0xFF
+        data[off + 2] = ((value >> 14) & 0xFE) | 0x01
+        data[off + 3] = (value >> 7) & 0xFF
+        data[off + 4] = ((value << 1) & 0xFE) | 0x01
+
+    @staticmethod
+    def pts(pkt) -> int|None:
+        """
+        Returns the PTS of the PES packet starting in this TS packet, or None.
+        """
+        off = MpegTs.payload_offset(pkt)
+        pes = pkt[off:off + 14]
+        if len(pes) < 14 or pes[:3] != b"\x00\x00\x01" or not pes[7] & 0x80:
+            return None
+        return MpegTs._read_ts(pes, 9)
+
+    @staticmethod
+    def split_at_keyframes(ts_bytes: bytes, target_sec: float) -> dict|None:
+        """
+        Cuts an MPEG-TS stream into chunks of at least `target_sec` (0 = every keyframe) that each start at
+        a video keyframe. The chunks are consecutive slices of the input.
+        Returns: {"chunks": [(start pts, bytes)], "end_pts": pts after the last frame, "psi": PAT+PMT packets},
+        or None if the stream has no recognisable video PID or keyframes.
+        """
+        pat = pmt = None
+        pmt_pid = video_pid = None
+        keyframes = []  # (packet offset, pts)
+        last_pts = None
+        for offset in range(0, len(ts_bytes) - TS_PACKET + 1, TS_PACKET):
+            pkt = ts_bytes[offset:offset + TS_PACKET]
+            if pkt[0] != 0x47 or not pkt[1] & 0x40:
+                continue  # not synced, or not the start of a PES packet / section
+            pid = MpegTs.pid(pkt)
+            try:
+                if pid == 0 and pat is None:
+                    programs = MpegTs.section(pkt)[8:-4]
+                    for i in range(0, len(programs) - 3, 4):
+                        if (programs[i] << 8) | programs[i + 1]:
+                            pmt_pid = ((programs[i + 2] & 0x1F) << 8) | programs[i + 3]
+                            pat = pkt
+                            break
+                elif pid == pmt_pid and pmt is None:
+                    section = MpegTs.section(pkt)
+                    i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+                    while i + 5 <= len(section) - 4:
+                        if section[i] in VIDEO_STREAM_TYPES:
+                            video_pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+                            break
+                        i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+                    pmt = pkt
+                elif pid == video_pid:
+                    pts = MpegTs.pts(pkt)
+                    if pts is None:
+                        continue
+                    last_pts = pts
+                    random_access = (pkt[3] >> 4) & 0x2 and pkt[4] and pkt[5] & 0x40
+                    if random_access:
+                        keyframes.append((offset, pts))
+            except IndexError:
+                continue
+
+        if not keyframes or pat is None or pmt is None:
+            return None
+
+        # Chunk boundaries: the first keyframe at least target_sec after the previous boundary
+        bounds = [(0, keyframes[0][1])]
+        for offset, pts in keyframes[1:]:
+            if (pts - bounds[-1][1]) / PTS_HZ >= target_sec:
+                bounds.append((offset, pts))
+        frame_pts = (last_pts - keyframes[0][1]) / max(1, len(keyframes) - 1) if len(keyframes) > 1 else target_sec * PTS_HZ
+        chunks = []
+        for n, (offset, pts) in enumerate(bounds):
+            next_offset = bounds[n + 1][0] if n + 1 < len(bounds) else len(ts_bytes)
+            chunks.append((pts, ts_bytes[offset:next_offset]))
+        return {"chunks": chunks, "end_pts": int(last_pts + frame_pts), "psi": pat + pmt}
+
+    @staticmethod
+    def retime(data: bytes, pts_offset: int, cc: dict, cc_delta: dict, discontinuity: set|None = None) -> bytes:
+        """
+        Returns a copy of `data` with every PTS/DTS and PCR moved by `pts_offset` (90 kHz) and the
+        continuity counter of each PID moved by `cc_delta[pid]`. A PID missing from `cc_delta` gets the
+        delta that continues from `cc[pid]`, the last counter sent on it; `cc` is updated as packets pass.
+        With `discontinuity` None, discontinuity indicators are left as they are. Otherwise PIDs in the set
+        get the indicator on their next packet that has an adaptation field, and are removed from it, and
+        all other indicators (e.g. from ffmpeg's initial_discontinuity) are cleared, because the output
+        continues seamlessly.
+        """
+        out = bytearray(data)
+        pcr_offset = pts_offset * 300
+        for off in range(0, len(out) - TS_PACKET + 1, TS_PACKET):
+            if out[off] != 0x47:
+                continue
+            pid = ((out[off + 1] & 0x1F) << 8) | out[off + 2]
+            if pid == NULL_PID:
+                continue
+            flags = out[off + 3]
+            has_payload = flags & 0x10
+            if pid not in cc_delta:
+                # The counter only advances on packets with payload; others repeat the previous one
+                step = 1 if has_payload else 0
+                cc_delta[pid] = (cc[pid] + step - (flags & 0x0F)) & 0x0F if pid in cc else 0
+            out[off + 3] = (flags & 0xF0) | ((flags + cc_delta[pid]) & 0x0F)
+            cc[pid] = out[off + 3] & 0x0F
+
+            payload = off + 5 + out[off + 4] if flags & 0x20 else off + 4
+            if flags & 0x20 and out[off + 4] > 0:
+                af_flags = off + 5
+                if discontinuity is not None:
+                    if pid in discontinuity:
+                        out[af_flags] |= 0x80
+                        discontinuity.discard(pid)
+                    else:
+                        out[af_flags] &= 0x7F
+                if out[af_flags] & 0x10:  # PCR
+                    p = off + 6
+                    base = (out[p] << 25) | (out[p + 1] << 17) | (out[p + 2] << 9) | (out[p + 3] << 1) | (out[p + 4] >> 7)
+                    pcr = (base * 300 + (((out[p + 4] & 0x01) << 8) | out[p + 5]) + pcr_offset) % (PTS_WRAP * 300)
+                    base, ext = divmod(pcr, 300)
+                    out[p:p + 4] = ((base >> 1) & 0xFFFFFFFF).to_bytes(4, "big")
+                    out[p + 4] = ((base & 0x01) << 7) | 0x7E | ((ext >> 8) & 0x01)
+                    out[p + 5] = ext & 0xFF
+
+            # PES header with PTS (and DTS), only in the packet that starts the PES packet
+            if pts_offset and out[off + 1] & 0x40 and has_payload and payload + 19 <= off + TS_PACKET \
+                    and out[payload:payload + 3] == b"\x00\x00\x01" and MpegTs._has_pes_header(out[payload + 3]):
+                pts_dts = out[payload + 7] >> 6
+                if pts_dts & 0x2:
+                    MpegTs._write_ts(out, payload + 9, (MpegTs._read_ts(out, payload + 9) + pts_offset) % PTS_WRAP)
+                if pts_dts == 0x3:
+                    MpegTs._write_ts(out, payload + 14, (MpegTs._read_ts(out, payload + 14) + pts_offset) % PTS_WRAP)
+        return bytes(out)
@@ -0,0 +1,197 @@
+# Runs the helper processes of the slate path (wkhtmltoimage, ffmpeg) under supervision.
+# Every process gets a deadline and is killed and reaped when it runs over, when the client it works for
+# disconnects or when Dispatcharr exits. At most TMS_MAX_PROCESSES run at once, and they run with lowered
+# CPU/IO priority (and optionally pinned to some CPUs), so slate work can't starve real streams.
+import atexit
+import contextvars
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+from .exceptions import TMS_ProcessCancelled
+from .Metrics import Metrics
+
+
+logger = logging.getLogger('plugins.too_many_streams.ProcessSupervisor')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+# Callable returning True once the work the current thread does is no longer wanted (e.g. the client disconnected)
+_cancel_check = contextvars.ContextVar("tms_cancel_check", default=None)
+
+
+class ProcessSupervisor:
+
+    # How often a running process is checked for cancellation (seconds)
+    POLL_SEC = 0.25
+    # ionice classes by TMS_PROCESS_IONICE value
+    IONICE_ARGS = {"idle": ["-c", "3"], "best-effort": ["-c", "2", "-n", "7"]}
+
+    _lock = threading.Lock()
+    _wakeup = threading.Condition(_lock)
+    _slots: threading.BoundedSemaphore|None = None
+    # Running processes and their cancel checks (None if not cancellable), for the watchdog and kill_all()
+    _running: dict = {}
+
+    @staticmethod
+    def _get_slots() -> threading.BoundedSemaphore:
+        with ProcessSupervisor._lock:
+            if ProcessSupervisor._slots is None:
+                ProcessSupervisor._slots = threading.BoundedSemaphore(TooManyStreamsConfig.get_max_processes())
+                threading.Thread(target=ProcessSupervisor._watchdog, name="TMSProcessWatchdog", daemon=True).start()
+                atexit.register(ProcessSupervisor.kill_all)
+            return ProcessSupervisor._slots
+
+    @staticmethod
+    def _watchdog() -> None:
+        """
+        Kills running processes whose work was cancelled. The thread that started a process is blocked
+        in communicate() until the process ends, so cancellation is checked here for all of them.
+        """
+        while True:
+            with ProcessSupervisor._wakeup:
+                while not any(check for check in ProcessSupervisor._running.values()):
+                    ProcessSupervisor._wakeup.wait()
+                running = list(ProcessSupervisor._running.items())
+            for proc, check in running:
+                if check and proc.poll() is None and ProcessSupervisor._cancelled(check):
+                    proc.tms_cancelled = True
+                    ProcessSupervisor._kill(proc, reap=False)
+            time.sleep(ProcessSupervisor.POLL_SEC)
+
+    @staticmethod
+    @contextmanager
+    def cancel_when(check):
+        """
+        Processes started by the wrapped block (in this thread, or in pages rendered for it) are killed
+        as soon as `check()` returns True.
+        """
+        reset_token = _cancel_check.set(check)
+        try:
+            yield
+        finally:
+            _cancel_check.reset(reset_token)
+
+    @staticmethod
+    def _cancelled(check=None) -> bool:
+        check = check or _cancel_check.get()
+        try:
+            return bool(check and check())
+        except Exception:
+            return False
+
+    @staticmethod
+    def _wrap_cmd(cmd: list[str]) -> list[str]:
+        """
+        Prefixes `cmd` with ionice for the configured IO class, if ionice is installed.
+        """
+        io_class = TooManyStreamsConfig.get_process_ionice()
+        ionice = shutil.which("ionice") if io_class in ProcessSupervisor.IONICE_ARGS else None
+        if not ionice:
+            return list(cmd)
+        return [ionice, *ProcessSupervisor.IONICE_ARGS[io_class], *cmd]
+
+    @staticmethod
+    def _apply_limits(proc: subprocess.Popen) -> None:
+        """
+        Lowers the CPU priority of a started process and pins it to TMS_PROCESS_CPUS. Best-effort.
+        """
+        try:
+            nice = TooManyStreamsConfig.get_process_nice()
+            if nice:
+                os.setpriority(os.PRIO_PROCESS, proc.pid, min(19, os.getpriority(os.PRIO_PROCESS, 0) + nice))
+            if cpus := TooManyStreamsConfig.get_process_cpus():
+                os.sched_setaffinity(proc.pid, cpus)
+        except (OSError, AttributeError) as e:
+            logger.debug("TooManyStreams: Could not set priority/affinity of pid %s: %s", proc.pid, e)
+
+    @staticmethod
+    def _kill(proc: subprocess.Popen, reap: bool = True) -> None:
+        """
+        Kills the process and everything it started, then reaps it (unless the thread that started it will).
+        """
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        if not reap:
+            return
+        try:
+            proc.communicate(timeout=5)
+        except (subprocess.TimeoutExpired, ValueError, OSError):
+            pass
+
+    @staticmethod
+    def run(cmd: list[str], timeout: float, input: bytes|None = None) -> subprocess.CompletedProcess:
+        """
+        Runs `cmd` to completion like subprocess.run(capture_output=True), under the supervisor's limits.
+        Waits at most `timeout` seconds for a free process slot, then at most `timeout` seconds for the process.
+        Raises:
+            subprocess.TimeoutExpired: No slot became free, or the process ran over and was killed.
+            TMS_ProcessCancelled: The work was cancelled (see cancel_when) and the process was killed.
+        """
+        binary = os.path.basename(cmd[0])
+        slots = ProcessSupervisor._get_slots()
+        if not slots.acquire(timeout=timeout):
+            Metrics.PROCESS_KILLS.inc(binary=binary, reason="queue_timeout")
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        try:
+            if ProcessSupervisor._cancelled():
+                raise TMS_ProcessCancelled(f"{binary} cancelled before it started")
+            with Metrics.track_process(binary):
+                return ProcessSupervisor._run_started(cmd, timeout, input, binary)
+        finally:
+            slots.release()
+
+    @staticmethod
+    def _run_started(cmd: list[str], timeout: float, input: bytes|None, binary: str) -> subprocess.CompletedProcess:
+        proc = subprocess.Popen(
+            ProcessSupervisor._wrap_cmd(cmd),
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            # Own process group, so a kill also takes down anything the helper started
+            start_new_session=True,
+        )
+        ProcessSupervisor._apply_limits(proc)
+        proc.tms_cancelled = False
+        with ProcessSupervisor._wakeup:
+            ProcessSupervisor._running[proc] = _cancel_check.get()
+            ProcessSupervisor._wakeup.notify()
+        try:
+            # One call for the whole deadline: communicate() can't resume writing the input after a timeout
+            stdout, stderr = proc.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"TooManyStreams: {binary} (pid {proc.pid}) ran over {timeout}s; killing it.")
+            Metrics.PROCESS_KILLS.inc(binary=binary, reason="timeout")
+            ProcessSupervisor._kill(proc)
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        except BaseException:
+            ProcessSupervisor._kill(proc)
+            raise
+        finally:
+            with ProcessSupervisor._lock:
+                ProcessSupervisor._running.pop(proc, None)
+        if proc.tms_cancelled:
+            logger.debug("TooManyStreams: %s (pid %s) was no longer needed and was killed.", binary, proc.pid)
+            Metrics.PROCESS_KILLS.inc(binary=binary, reason="cancelled")
+            raise TMS_ProcessCancelled(f"{binary} cancelled")
+        return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+    @staticmethod
+    def kill_all() -> None:
+        """
+        Kills and reaps every helper process still running, e.g. when Dispatcharr exits.
+        """
+        with ProcessSupervisor._lock:
+            procs = list(ProcessSupervisor._running)
+        for proc in procs:
+            if proc.poll() is None:
+                ProcessSupervisor._kill(proc)
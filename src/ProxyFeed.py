@@ -0,0 +1,121 @@
+# Direct slate delivery into Dispatcharr's ts_proxy (TMS_DELIVERY=direct).
+# Over HTTP, the proxy's stream manager pulls /stream.ts from the slate server through a local socket and a
+# server thread, then buffers it again. Here the stream manager of a channel whose upstream is the slate URL
+# skips the fetch: the slate is handed to the channel's stream buffer (`add_chunk()`) in the manager's own
+# thread, so there is no loopback connection, no socket copy and no extra thread per viewer.
+import logging
+import os
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+from .TooManyStreamsConfig import RENDITIONS, TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.ProxyFeed')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class ProxyFeed:
+
+    # feed(buffer, rendition, stopped) delivers the slate until stopped() returns True, see install()
+    _feed: Callable[[object, str, Callable[[], bool]], None]|None = None
+
+    @staticmethod
+    def slate_rendition(url: str|None) -> str|None:
+        """
+        Returns the rendition requested by `url` if it is a /stream.ts URL of this slate server
+        (/stream.ts, /720/stream.ts or /stream.ts?r=720), otherwise None.
+        """
+        if not url:
+            return None
+        ours, theirs = urlparse(TooManyStreamsConfig.get_stream_url()), urlparse(url)
+        if (theirs.scheme, theirs.netloc) != (ours.scheme, ours.netloc):
+            return None
+        parts = [part for part in theirs.path.split("/") if part]
+        if not parts or parts[-1] != "stream.ts" or len(parts) > 2:
+            return None
+        rendition = parse_qs(theirs.query).get("r", [None])[0]
+        if len(parts) == 2:
+            if parts[0].rstrip("p") not in RENDITIONS:
+                return None
+            rendition = rendition or parts[0]
+        return TooManyStreamsConfig.get_rendition(rendition)[0]
+
+    @staticmethod
+    def run_manager(manager) -> bool:
+        """
+        Feeds the slate to `manager.buffer` if the stream manager's upstream is the slate URL and direct
+        delivery is on, until the manager is stopped (`manager.running` goes False) or its upstream is switched
+        to another URL. After the first chunk, the manager's own post-connect update (`_set_waiting_for_clients()`)
+        moves the channel on, as it does after connecting to an upstream.
+        Returns False if the manager should fetch its upstream as usual, including after such a switch.
+        """
+        rendition = ProxyFeed.slate_rendition(getattr(manager, "url", None))
+        if rendition is None or ProxyFeed._feed is None or TooManyStreamsConfig.get_delivery() != "direct":
+            return False
+        set_connected = getattr(manager, "_set_waiting_for_clients", None)
+        if set_connected is None:
+            logger.warning("TooManyStreams: ts_proxy stream manager has no post-connect state update, delivering the slate over HTTP")
+            return False
+        channel_id = getattr(manager, "channel_id", None)
+        logger.info(f"TooManyStreams: Delivering the slate ({rendition}) directly to channel {channel_id}'s stream buffer")
+
+        def stopped() -> bool:
+            return not getattr(manager, "running", True) or ProxyFeed.slate_rendition(getattr(manager, "url", None)) is None
+
+        try:
+            ProxyFeed._feed(_ConnectingBuffer(manager.buffer, set_connected), rendition, stopped)
+        except Exception as e:
+            logger.error(f"TooManyStreams: Direct slate delivery to channel {channel_id} failed: {e}")
+        if getattr(manager, "running", True) and ProxyFeed.slate_rendition(getattr(manager, "url", None)) is None:
+            logger.info(f"TooManyStreams: Channel {channel_id} switched away from the slate, fetching {manager.url}")
+            return False
+        logger.debug(f"TooManyStreams: Direct slate delivery to channel {channel_id} stopped")
+        return True
+
+    @staticmethod
+    def install(feed: Callable[[object, str, Callable[[], bool]], None], stream_manager=None) -> bool:
+        """
+        Patches the ts_proxy stream manager so that channels streaming the slate are fed by
+        `feed(buffer, rendition, stopped)` instead of fetching /stream.ts. `stream_manager` is the class to
+        patch, by default ts_proxy's StreamManager.
+        Returns False if the stream manager can't be patched; the slate is then delivered over HTTP.
+        """
+        if stream_manager is None:
+            try:
+                from apps.proxy.ts_proxy.stream_manager import StreamManager as stream_manager
+            except ImportError as e:
+                logger.warning(f"TooManyStreams: ts_proxy stream manager not found, delivering the slate over HTTP: {e}")
+                return False
+        ProxyFeed._feed = feed
+        if getattr(stream_manager, "_tms_original_run", None) is not None:
+            return True  # already patched
+
+        original_run = stream_manager.run
+
+        def _run(self, *args, **kwargs):
+            if ProxyFeed.run_manager(self):
+                return None
+            return original_run(self, *args, **kwargs)
+
+        stream_manager._tms_original_run = original_run
+        stream_manager.run = _run
+        logger.info("TooManyStreams: Installed direct slate delivery into ts_proxy.")
+        return True
+
+
+class _ConnectingBuffer:
+    """
+    Passes chunks on to a stream buffer and calls `on_connected()` once the first one is in it.
+    """
+
+    def __init__(self, buffer, on_connected: Callable[[], object]):
+        self._buffer = buffer
+        self._on_connected = on_connected
+
+    def add_chunk(self, chunk) -> bool:
+        added = self._buffer.add_chunk(chunk)
+        if self._on_connected is not None:
+            on_connected, self._on_connected = self._on_connected, None
+            on_connected()
+        return added
@@ -0,0 +1,269 @@
+# Saturation analytics for capacity planning.
+# Refusals per profile and channel, slate viewers, time spent at max and peak connection counts are kept in
+# time buckets (one Redis hash per TMS_STATS_BUCKET_SEC) that expire after TMS_STATS_RETENTION_SEC, so the
+# buckets form a ring buffer with no cleanup job. Events are counted in process memory and flushed in one
+# pipelined round trip every few seconds, so recording on the get_stream hot path is a dict update.
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from core.utils import RedisClient
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.SaturationStats')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class SaturationStats:
+
+    KEY_PREFIX = "tms:stats"
+    # How often recorded events are written to Redis (seconds)
+    FLUSH_SEC = 10
+    # Raises the peak fields of one bucket hash to the given values (ARGV: field, value, field, value, ...)
+    _MAX_LUA = """
+    for i = 1, #ARGV - 1, 2 do
+        if tonumber(ARGV[i + 1]) > tonumber(redis.call('hget', KEYS[1], ARGV[i]) or '0') then
+            redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 1])
+        end
+    end
+    return 0
+    """
+    # Duration suffixes accepted in query windows
+    UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+    _lock = threading.Lock()
+    _counts: dict = {}   # bucket start -> {field: count}
+    _peaks: dict = {}    # bucket start -> {field: highest value seen}
+    _flusher_pid = None
+
+    @staticmethod
+    def _bucket(now: float|None = None) -> int:
+        bucket_sec = TooManyStreamsConfig.get_stats_bucket_sec()
+        now = time.time() if now is None else now
+        return int(now // bucket_sec * bucket_sec)
+
+    @staticmethod
+    def _key(bucket: int) -> str:
+        return f"{SaturationStats.KEY_PREFIX}:{bucket}"
+
+    @staticmethod
+    def _ensure_flusher() -> None:
+        """
+        Starts the flush thread of this process. Dispatcharr forks workers, so this is checked per pid.
+        """
+        if SaturationStats._flusher_pid == os.getpid():
+            return
+        with SaturationStats._lock:
+            if SaturationStats._flusher_pid == os.getpid():
+                return
+            SaturationStats._flusher_pid = os.getpid()
+            # Events recorded by the parent before the fork are the parent's to flush
+            SaturationStats._counts, SaturationStats._peaks = {}, {}
+        threading.Thread(target=SaturationStats._flush_thread, name="TMSStatsFlush", daemon=True).start()
+
+    @staticmethod
+    def _flush_thread() -> None:
+        while True:
+            time.sleep(SaturationStats.FLUSH_SEC)
+            SaturationStats.flush()
+
+    @staticmethod
+    def count(field: str, amount: int = 1) -> None:
+        """
+        Adds `amount` to a counter field (e.g. "refusals:channel:12") of the current bucket.
+        """
+        if not TooManyStreamsConfig.get_stats_enabled():
+            return
+        SaturationStats._ensure_flusher()
+        bucket = SaturationStats._bucket()
+        with SaturationStats._lock:
+            fields = SaturationStats._counts.setdefault(bucket, {})
+            fields[field] = fields.get(field, 0) + amount
+
+    @staticmethod
+    def peak(field: str, value: int) -> None:
+        """
+        Records `value` for a peak field (e.g. "peak:profile:3"); the bucket keeps the highest value seen.
+        """
+        if not TooManyStreamsConfig.get_stats_enabled():
+            return
+        SaturationStats._ensure_flusher()
+        bucket = SaturationStats._bucket()
+        with SaturationStats._lock:
+            fields = SaturationStats._peaks.setdefault(bucket, {})
+            if value > fields.get(field, 0):
+                fields[field] = value
+
+    @staticmethod
+    def record_refusal(channel_id: int, profile_ids: list[int], slate: bool) -> None:
+        """
+        Records a get_stream call that found every profile of the channel at its limit.
+        `slate` is True if the viewer was handed the TooManyStreams slate instead of an error.
+        """
+        SaturationStats.count(f"refusals:channel:{channel_id}")
+        for profile_id in set(profile_ids):
+            SaturationStats.count(f"refusals:profile:{profile_id}")
+        if slate:
+            SaturationStats.count(f"slate:channel:{channel_id}")
+
+    @staticmethod
+    def flush() -> None:
+        """
+        Writes the events recorded in this process to Redis, in one pipelined round trip.
+        Events are kept for the next flush if Redis is unavailable, until their bucket would have expired.
+        """
+        with SaturationStats._lock:
+            counts, peaks = SaturationStats._counts, SaturationStats._peaks
+            SaturationStats._counts, SaturationStats._peaks = {}, {}
+        if not counts and not peaks:
+            return
+        retention = TooManyStreamsConfig.get_stats_retention_sec()
+        bucket_sec = TooManyStreamsConfig.get_stats_bucket_sec()
+        try:
+            pipe = RedisClient.get_client().pipeline(transaction=False)
+            for bucket in set(counts) | set(peaks):
+                key = SaturationStats._key(bucket)
+                for field, amount in counts.get(bucket, {}).items():
+                    pipe.hincrby(key, field, amount)
+                if bucket_peaks := peaks.get(bucket):
+                    pipe.eval(SaturationStats._MAX_LUA, 1, key, *(x for item in bucket_peaks.items() for x in item))
+                pipe.expireat(key, bucket + bucket_sec + retention)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to write saturation stats to Redis; retrying later: {e}")
+            oldest = SaturationStats._bucket() - retention
+            with SaturationStats._lock:
+                for bucket, fields in counts.items():
+                    if bucket >= oldest:
+                        merged = SaturationStats._counts.setdefault(bucket, {})
+                        for field, amount in fields.items():
+                            merged[field] = merged.get(field, 0) + amount
+                for bucket, fields in peaks.items():
+                    if bucket >= oldest:
+                        merged = SaturationStats._peaks.setdefault(bucket, {})
+                        for field, value in fields.items():
+                            merged[field] = max(value, merged.get(field, 0))
+
+    @staticmethod
+    def sample(profile_usage: dict, maxed_channels: list, slate_viewers: int, interval: float) -> None:
+        """
+        Records one sample of the current state, taken every `interval` seconds:
+        profile_usage is {profile_id: (connections, max_streams)}, maxed_channels the channels with a maxed-out flag.
+        """
+        total = 0
+        for profile_id, (current, limit) in profile_usage.items():
+            total += current
+            SaturationStats.peak(f"peak:profile:{profile_id}", current)
+            SaturationStats.peak(f"limit:profile:{profile_id}", limit)
+            if current >= limit:
+                SaturationStats.count(f"sec_at_max:profile:{profile_id}", int(interval))
+        SaturationStats.peak("peak:connections", total)
+        for channel_id in maxed_channels:
+            SaturationStats.count(f"sec_maxed:channel:{channel_id}", int(interval))
+        SaturationStats.peak("peak:slate_viewers", slate_viewers)
+
+    @staticmethod
+    def _sample_thread(sample_state: Callable[[], tuple[dict, list, int]]) -> None:
+        interval = TooManyStreamsConfig.get_stats_sample_sec()
+        while True:
+            time.sleep(interval)
+            try:
+                # One node samples per interval, so time at max isn't counted once per node
+                tick = int(time.time() // interval)
+                if not RedisClient.get_client().set(f"{SaturationStats.KEY_PREFIX}:sample:{tick}", os.getpid(), nx=True, ex=interval * 2):
+                    continue
+                SaturationStats.sample(*sample_state(), interval=interval)
+            except Exception as e:
+                logger.error(f"TooManyStreams: Saturation stats sampler error: {e}")
+
+    @staticmethod
+    def start_sampler(sample_state: Callable[[], tuple[dict, list, int]]) -> None:
+        """
+        Starts the thread that samples time at max and peak usage every TMS_STATS_SAMPLE_SEC.
+        `sample_state()` returns (profile usage, maxed channel ids, slate viewers), see sample().
+        """
+        if not TooManyStreamsConfig.get_stats_enabled():
+            return
+        threading.Thread(target=SaturationStats._sample_thread, args=(sample_state,), name="TMSStatsSampler", daemon=True).start()
+        logger.info("TooManyStreams: Started saturation stats sampler.")
+
+    @staticmethod
+    def parse_window(window: str) -> int:
+        """
+        Returns the length in seconds of a query window such as "3600", "90m", "24h" or "7d".
+        """
+        window = window.strip().lower()
+        if window[-1:] in SaturationStats.UNITS:
+            return int(float(window[:-1]) * SaturationStats.UNITS[window[-1]])
+        return int(window)
+
+    @staticmethod
+    def summary(window_sec: int, now: float|None = None) -> dict:
+        """
+        Returns the stats of the last `window_sec` seconds (rounded out to whole buckets), summed per
+        profile and channel; peaks are the highest value in any bucket. Profiles and channels are listed
+        by refusals, most first.
+        """
+        SaturationStats.flush()
+        bucket_sec = TooManyStreamsConfig.get_stats_bucket_sec()
+        window_sec = min(window_sec, TooManyStreamsConfig.get_stats_retention_sec())
+        last = SaturationStats._bucket(now)
+        buckets = list(range(last - (max(1, window_sec // bucket_sec) - 1) * bucket_sec, last + bucket_sec, bucket_sec))
+        pipe = RedisClient.get_client().pipeline(transaction=False)
+        for bucket in buckets:
+            pipe.hgetall(SaturationStats._key(bucket))
+
+        profiles, channels, totals = {}, {}, {"refusals": 0, "slate_viewers": 0, "peak_connections": 0, "peak_slate_viewers": 0}
+        for fields in pipe.execute():
+            for raw_field, raw_value in fields.items():
+                field = raw_field.decode() if isinstance(raw_field, bytes) else raw_field
+                value = int(raw_value)
+                stat, _, rest = field.partition(":")
+                kind, _, item_id = rest.partition(":")
+                if stat == "peak" and not item_id:
+                    name = f"peak_{kind}"
+                    totals[name] = max(totals[name], value)
+                    continue
+                target = (profiles if kind == "profile" else channels).setdefault(item_id, {})
+                if stat in ("peak", "limit"):
+                    name = "peak_connections" if stat == "peak" else "max_streams"
+                    target[name] = max(target.get(name, 0), value)
+                else:
+                    name = "slate_viewers" if stat == "slate" else stat
+                    target[name] = target.get(name, 0) + value
+                    if kind == "channel" and stat in ("refusals", "slate"):
+                        totals[name] += value
+
+        def _ranked(items: dict) -> dict:
+            return dict(sorted(items.items(), key=lambda item: item[1].get("refusals", 0), reverse=True))
+
+        return {
+            "window_sec": len(buckets) * bucket_sec,
+            "bucket_sec": bucket_sec,
+            "since": buckets[0],
+            **totals,
+            "profiles": _ranked(profiles),
+            "channels": _ranked(channels),
+        }
+
+    @staticmethod
+    def report(windows: list[str]|None = None) -> dict:
+        """
+        Returns a summary per window (default TMS_STATS_WINDOWS), e.g. {"1h": {...}, "24h": {...}}.
+        """
+        return {window: SaturationStats.summary(SaturationStats.parse_window(window))
+                for window in windows or TooManyStreamsConfig.get_stats_windows()}
+
+    @staticmethod
+    def dump() -> str:
+        """
+        Logs and returns the report as JSON.
+        """
+        text = json.dumps(SaturationStats.report(), indent=2)
+        logger.info(f"TooManyStreams: Saturation stats:\n{text}")
+        return text
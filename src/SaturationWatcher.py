@@ -0,0 +1,95 @@
+# Watches M3U profile connection counters in Redis and pre-warms the slate before a profile is saturated,
+# so the first refused viewer gets a ready slate instead of waiting for a render and encode.
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from core.utils import RedisClient
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+
+
+logger = logging.getLogger('plugins.too_many_streams.SaturationWatcher')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class SaturationWatcher:
+
+    # How often to reload the list of limited profiles from the DB (seconds)
+    PROFILE_REFRESH_SEC = 60
+
+    _profiles: dict = {}        # profile_id -> max_streams
+    _profiles_loaded_at = 0.0
+    _near_saturation: set = set()
+
+    @staticmethod
+    def _load_profiles() -> dict:
+        """
+        Returns {profile_id: max_streams} for all active profiles that have a connection limit.
+        """
+        from apps.m3u.models import M3UAccountProfile
+
+        now = time.time()
+        if now - SaturationWatcher._profiles_loaded_at > SaturationWatcher.PROFILE_REFRESH_SEC:
+            SaturationWatcher._profiles = dict(
+                M3UAccountProfile.objects.filter(is_active=True, max_streams__gt=0).values_list("id", "max_streams")
+            )
+            SaturationWatcher._profiles_loaded_at = now
+        return SaturationWatcher._profiles
+
+    @staticmethod
+    def get_profile_usage(redis_client=None) -> dict[int, tuple[int, int]]:
+        """
+        Returns {profile_id: (current connections, max_streams)} for all active profiles that have a connection limit.
+        """
+        profiles = SaturationWatcher._load_profiles()
+        if not profiles:
+            return {}
+        redis_client = redis_client or RedisClient.get_client()
+        profile_ids = list(profiles.keys())
+        # One round trip for all counters
+        counters = redis_client.mget([f"profile_connections:{profile_id}" for profile_id in profile_ids])
+        return {profile_id: (int(current or 0), profiles[profile_id]) for profile_id, current in zip(profile_ids, counters)}
+
+    @staticmethod
+    def get_near_saturated_profiles(redis_client=None) -> set[int]:
+        """
+        Returns the ids of profiles whose current connections are within TMS_PREWARM_HEADROOM of their limit.
+        """
+        headroom = TooManyStreamsConfig.get_prewarm_headroom()
+        return {
+            profile_id for profile_id, (current, limit) in SaturationWatcher.get_profile_usage(redis_client).items()
+            if current >= limit - headroom
+        }
+
+    @staticmethod
+    def _watch_thread(on_near_saturation: Callable[[], None], refresh_while_saturated: Callable[[], bool]) -> None:
+        interval = TooManyStreamsConfig.get_prewarm_interval()
+        while True:
+            try:
+                near = SaturationWatcher.get_near_saturated_profiles()
+                newly_near = near - SaturationWatcher._near_saturation
+                SaturationWatcher._near_saturation = near
+                if newly_near:
+                    logger.info(f"TooManyStreams: Profiles {sorted(newly_near)} are close to their limit; pre-warming slate.")
+                # Asked on every saturated poll, also when pre-warming anyway, so it can track what it compares
+                refresh = bool(near) and refresh_while_saturated()
+                if newly_near or refresh:
+                    on_near_saturation()
+            except Exception as e:
+                logger.error(f"TooManyStreams: Saturation watcher error: {e}")
+            time.sleep(interval)
+
+    @staticmethod
+    def start(on_near_saturation: Callable[[], None], refresh_while_saturated: Callable[[], bool] = lambda: False) -> None:
+        """
+        Starts the watcher thread. `on_near_saturation` is called when a profile first gets within the
+        configured headroom of its limit, and on every poll while a profile is near its limit and
+        `refresh_while_saturated()` returns True.
+        """
+        threading.Thread(
+            target=SaturationWatcher._watch_thread, args=(on_near_saturation, refresh_while_saturated), daemon=True
+        ).start()
+        logger.info("TooManyStreams: Started saturation watcher.")
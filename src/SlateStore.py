@@ -0,0 +1,180 @@
+# Shared slate artifact store for the TooManyStreams plugin.
+# Finished slate artifacts (JPG/TS) are stored in Redis keyed by the slate fingerprint,
+# so in a multi-node Dispatcharr setup only one node renders a given slate and the others stream its bytes.
+# Slates and rendered pages are also kept on disk (see ArtifactCache), so they survive Redis expiry and restarts.
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+from core.utils import RedisClient
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+from .ArtifactCache import ArtifactCache
+
+
+logger = logging.getLogger('plugins.too_many_streams.SlateStore')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class SlateStore:
+
+    KEY_PREFIX = "tms:slate"
+    # How often to poll Redis while another node holds the render lock (seconds)
+    LOCK_POLL_SEC = 0.25
+    # Only delete the lock if we still own it, so a slow render can't release another node's lock
+    _RELEASE_LOCK_LUA = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    @staticmethod
+    def _artifact_key(fingerprint: str, kind: str) -> str:
+        return f"{SlateStore.KEY_PREFIX}:{fingerprint}:{kind}"
+
+    @staticmethod
+    def _lock_key(fingerprint: str) -> str:
+        return f"{SlateStore.KEY_PREFIX}:{fingerprint}:lock"
+
+    @staticmethod
+    def fingerprint_file(path: str) -> str:
+        """
+        Returns a fingerprint for a static image, based on its path, size and mtime.
+        """
+        st = os.stat(path)
+        payload = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def derive(fingerprint: str, *parts) -> str:
+        """
+        Returns a fingerprint for a variant of a slate, e.g. the same channels encoded with other settings.
+        """
+        payload = ":".join([fingerprint, *(str(part) for part in parts)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get(fingerprint: str, kind: str) -> bytes|None:
+        """
+        Returns the stored artifact bytes (kind is e.g. "jpg" or "ts"), or None if missing.
+        Artifacts found only in the on-disk cache are put back into Redis for the other nodes.
+        """
+        try:
+            data = RedisClient.get_client().get(SlateStore._artifact_key(fingerprint, kind))
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to read slate {kind} {fingerprint[:12]} from Redis: {e}")
+            return ArtifactCache.get(fingerprint, kind)
+        if data:
+            logger.debug(f"TooManyStreams: Slate {kind} {fingerprint[:12]} served from Redis ({len(data)} bytes)")
+            return data
+        if data := ArtifactCache.get(fingerprint, kind):
+            SlateStore._put_redis(fingerprint, kind, data)
+        return data
+
+    @staticmethod
+    def exists(fingerprint: str, kind: str) -> bool:
+        """
+        Returns True if the artifact is stored in Redis or on disk, without transferring its bytes.
+        """
+        try:
+            if RedisClient.get_client().exists(SlateStore._artifact_key(fingerprint, kind)):
+                return True
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to check slate {kind} {fingerprint[:12]} in Redis: {e}")
+        return ArtifactCache.exists(fingerprint, kind)
+
+    @staticmethod
+    def put(fingerprint: str, kind: str, data: bytes, ttl: int|None = None) -> None:
+        """
+        Stores the artifact bytes in Redis for `ttl` seconds (default: TMS_SLATE_CACHE_TTL_SEC), and on disk if it
+        is a kind the ArtifactCache keeps.
+        """
+        SlateStore._put_redis(fingerprint, kind, data, ttl)
+        ArtifactCache.put(fingerprint, kind, data)
+
+    @staticmethod
+    def _put_redis(fingerprint: str, kind: str, data: bytes, ttl: int|None = None) -> None:
+        try:
+            RedisClient.get_client().set(
+                SlateStore._artifact_key(fingerprint, kind), data, ex=ttl or TooManyStreamsConfig.get_slate_cache_ttl()
+            )
+            logger.debug(f"TooManyStreams: Stored slate {kind} {fingerprint[:12]} in Redis ({len(data)} bytes)")
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to store slate {kind} {fingerprint[:12]} in Redis: {e}")
+
+    @staticmethod
+    def acquire_render_lock(fingerprint: str) -> str|None:
+        """
+        Tries to take the short-lived render lock for this fingerprint.
+        Returns:
+            str: A token to pass to release_render_lock() if this node should render.
+            None: Another node is already rendering this fingerprint.
+        If Redis is unavailable, a token is returned so this node renders locally.
+        """
+        token = uuid.uuid4().hex
+        try:
+            acquired = RedisClient.get_client().set(
+                SlateStore._lock_key(fingerprint), token, nx=True, ex=TooManyStreamsConfig.get_slate_lock_ttl()
+            )
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to take render lock for {fingerprint[:12]}; rendering locally: {e}")
+            return token
+        return token if acquired else None
+
+    @staticmethod
+    def release_render_lock(fingerprint: str, token: str) -> None:
+        """
+        Releases the render lock, if it is still held with the given token.
+        """
+        try:
+            RedisClient.get_client().eval(SlateStore._RELEASE_LOCK_LUA, 1, SlateStore._lock_key(fingerprint), token)
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to release render lock for {fingerprint[:12]}: {e}")
+
+    @staticmethod
+    def wait_for(fingerprint: str, kind: str) -> bytes|None:
+        """
+        Waits for another node to publish the artifact while it holds the render lock.
+        Returns the artifact bytes, or None if the lock was released or expired without an artifact.
+        """
+        deadline = time.time() + TooManyStreamsConfig.get_slate_lock_ttl()
+        while time.time() < deadline:
+            if data := SlateStore.get(fingerprint, kind):
+                return data
+            try:
+                if not RedisClient.get_client().exists(SlateStore._lock_key(fingerprint)):
+                    # Lock holder finished or died; one last look before giving up
+                    return SlateStore.get(fingerprint, kind)
+            except Exception:
+                return None
+            time.sleep(SlateStore.LOCK_POLL_SEC)
+        return None
+
+    @staticmethod
+    def _latest_key(rendition: str) -> str:
+        return f"{SlateStore.KEY_PREFIX}:latest:{rendition}"
+
+    @staticmethod
+    def set_latest(rendition: str, fingerprint: str) -> None:
+        """
+        Records `fingerprint` as the current slate of `rendition` for every worker and node (see LiveSlate).
+        """
+        try:
+            RedisClient.get_client().set(SlateStore._latest_key(rendition), fingerprint, ex=TooManyStreamsConfig.get_slate_cache_ttl())
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Failed to record current slate {fingerprint[:12]} ({rendition}) in Redis: {e}")
+
+    @staticmethod
+    def get_latest(rendition: str) -> str|None:
+        """
+        Returns the fingerprint of the current slate of `rendition` as last recorded by any worker, or None.
+        """
+        try:
+            fingerprint = RedisClient.get_client().get(SlateStore._latest_key(rendition))
+        except Exception as e:
+            logger.debug(f"TooManyStreams: Failed to read current slate ({rendition}) from Redis: {e}")
+            return None
+        return fingerprint.decode("utf-8") if isinstance(fingerprint, bytes) else fingerprint
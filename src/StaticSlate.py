@@ -0,0 +1,131 @@
+# Precompiled slate for a static image (TMS_IMAGE_PATH).
+# The image is encoded once in every rendition when the plugin starts and the TS bytes are kept in memory,
+# so a viewer costs a dict lookup instead of a Redis fetch or an ffmpeg run. A cheap stat() poll watches the
+# file; it is only read and hashed when its size, mtime or inode change, and only re-encoded when its
+# content actually changed.
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from .TooManyStreamsConfig import TooManyStreamsConfig
+from .SlateStore import SlateStore
+
+
+logger = logging.getLogger('plugins.too_many_streams.StaticSlate')
+logger.setLevel(os.environ.get("TMS_LOG_LEVEL", os.environ.get("DISPATCHARR_LOG_LEVEL", "INFO")).upper())
+
+
+class StaticSlate:
+
+    _path: str|None = None
+    # build(fingerprint, rendition) -> TS bytes, see start()
+    _build: Callable[[str, str], bytes]|None = None
+    # Held while encoding, so the watcher and a first viewer never encode the same image twice
+    _build_lock = threading.Lock()
+    _stat: tuple|None = None        # (size, mtime_ns, inode) of the file the current slate was built from
+    _fingerprint: str|None = None   # content hash of that file
+    _ts: dict = {}                  # rendition -> TS bytes
+
+    @staticmethod
+    def _stat_of(path: str) -> tuple:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """
+        Returns a fingerprint of the image content, so touching or copying the file doesn't change it.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def refresh() -> bool:
+        """
+        Re-encodes the slate if the image changed since it was last encoded. The previous slate is served
+        until the new one is ready, and kept if encoding fails.
+        Returns True if a new slate was built.
+        """
+        path = StaticSlate._path
+        with StaticSlate._build_lock:
+            stat = StaticSlate._stat_of(path)
+            if stat == StaticSlate._stat and StaticSlate._ts:
+                return False
+            fingerprint = StaticSlate.hash_file(path)
+            if fingerprint == StaticSlate._fingerprint and StaticSlate._ts:
+                logger.debug(f"TooManyStreams: {path} was touched but its content is unchanged; keeping the slate.")
+                StaticSlate._stat = stat
+                return False
+            start = time.perf_counter()
+            ts = {
+                rendition: StaticSlate._build(SlateStore.derive(fingerprint, rendition), rendition)
+                for rendition in TooManyStreamsConfig.get_renditions()
+            }
+            # Swapped in one assignment, so readers see either the old or the new set of renditions
+            StaticSlate._ts, StaticSlate._fingerprint, StaticSlate._stat = ts, fingerprint, stat
+        logger.info(f"TooManyStreams: Precompiled static slate {fingerprint[:12]} from {path} "
+                    f"({', '.join(ts)}) in {time.perf_counter() - start:.1f}s")
+        return True
+
+    @staticmethod
+    def serves(image_path: str|None) -> bool:
+        """
+        Returns True if static mode is running for `image_path`.
+        """
+        return image_path is not None and image_path == StaticSlate._path
+
+    @staticmethod
+    def get(image_path: str|None, rendition: str) -> tuple[str, bytes]|None:
+        """
+        Returns (fingerprint, TS bytes) of the precompiled slate of `image_path` in the given rendition,
+        or None if static mode isn't running for that image (yet).
+        """
+        if not StaticSlate.serves(image_path):
+            return None
+        ts_by_rendition, fingerprint = StaticSlate._ts, StaticSlate._fingerprint
+        if ts_bytes := ts_by_rendition.get(rendition):
+            return SlateStore.derive(fingerprint, rendition), ts_bytes
+        # The startup encode hasn't finished: wait for it, or do it if it failed
+        try:
+            StaticSlate.refresh()
+        except Exception as e:
+            logger.warning(f"TooManyStreams: Static slate not available: {e}")
+            return None
+        if ts_bytes := StaticSlate._ts.get(rendition):
+            return SlateStore.derive(StaticSlate._fingerprint, rendition), ts_bytes
+        return None
+
+    @staticmethod
+    def _watch_thread() -> None:
+        interval = TooManyStreamsConfig.get_static_poll_sec()
+        last_seen = None
+        while True:
+            try:
+                stat = StaticSlate._stat_of(StaticSlate._path)
+                # Only rebuild once the file has stopped changing for a poll, so a half-copied image isn't encoded
+                if stat == last_seen or not StaticSlate._ts:
+                    StaticSlate.refresh()
+                last_seen = stat
+            except FileNotFoundError:
+                if last_seen is not None:
+                    logger.warning(f"TooManyStreams: {StaticSlate._path} is gone; serving the last precompiled slate.")
+                last_seen = None
+            except Exception as e:
+                logger.error(f"TooManyStreams: Failed to precompile static slate from {StaticSlate._path}: {e}")
+            time.sleep(interval)
+
+    @staticmethod
+    def start(image_path: str, build: Callable[[str, str], bytes]) -> None:
+        """
+        Encodes `image_path` in every configured rendition and re-encodes it whenever its content changes,
+        checked every TMS_STATIC_POLL_SEC. `build(fingerprint, rendition)` returns the encoded TS bytes.
+        """
+        StaticSlate._path, StaticSlate._build = image_path, build
+        threading.Thread(target=StaticSlate._watch_thread, name="TMSStaticSlate", daemon=True).start()
+        logger.info(f"TooManyStreams: Started static slate watcher for {image_path}.")
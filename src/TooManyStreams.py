@@ -1,20 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import json
 import logging
 import os
 import time
 import pickle
-import os, shutil, subprocess, sys, threading
+import struct
+import contextvars
+import zlib
+import os, select, shutil, socket, subprocess, sys, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
 from apps.channels.models import Channel, ChannelStream, Stream
 from apps.proxy.ts_proxy.server import ProxyServer
 from apps.proxy.ts_proxy.services.channel_service import ChannelService
 from core.utils import RedisClient
 
-from .TooManyStreamsConfig import TooManyStreamsConfig
-from .exceptions import TMS_CustomStreamNotFound
+from .TooManyStreamsConfig import RENDITIONS, TooManyStreamsConfig
+from .exceptions import TMS_CustomStreamNotFound, TMS_ProcessCancelled, TMS_SlateBuildError
 from .ActiveStreamImgGen import ActiveStreamImgGen
+from .SlateStore import SlateStore
+from .HlsSlate import HlsSlate
+from .StaticSlate import StaticSlate
+from .LiveSlate import LiveSlate
+from .LastGoodSlate import LastGoodSlate
+from .ProxyFeed import ProxyFeed
+from .Capabilities import Capabilities
+from .ProcessSupervisor import ProcessSupervisor
+from .ActiveChannelWatcher import ActiveChannelWatcher
+from .SaturationWatcher import SaturationWatcher
+from .SaturationStats import SaturationStats
+from .Metrics import Metrics
+from .HotPathProfiler import HotPathProfiler
 
 
 logger = logging.getLogger('plugins.too_many_streams.TooManyStreams')
@@ -32,6 +51,14 @@ class TooManyStreams:
     TMS_MAXED_PKL = "/dev/shm/TMS/mark_maxed.pkl"
     # TS chunk size to read/send
     CHUNK = 188 * 7  # 1316 is fine; larger also OK
+    # Encoding defaults tuned for compatibility + quick startup for a still image
+    # Video size and bitrates come from the rendition, see RENDITIONS in TooManyStreamsConfig
+    FPS = 1               # 1 fps. Is still image
+    A_BITRATE = "96k"
+    # Id of the TooManyStreams stream, see get_stream_id()
+    _stream_id: int|None = None
+    # (image path, rendition) -> slate of the last HLS playlist: {"fingerprint", "at", "generation"}, see build_hls()
+    _hls_latest: dict = {}
 
 
     @staticmethod
@@ -43,12 +70,10 @@ class TooManyStreams:
         Returns:
             bool: True if requirements are met, False otherwise.
         """
-        try:
-           ActiveStreamImgGen()._find_wkhtmltoimage()
-           return True
-        except ImportError:
+        if Capabilities.get("wkhtmltoimage") is None:
             logger.error("TooManyStreams: Missing required packages.")
             return False
+        return True
 
     @staticmethod
     def install_requirements() -> None:
@@ -128,6 +153,7 @@ class TooManyStreams:
         """
         Deletes the custom TooManyStreams stream if it exists.
         """
+        TooManyStreams._stream_id = None
         try:
             custom_stream = TooManyStreams.get_stream()
             custom_stream.delete()
@@ -145,12 +171,22 @@ class TooManyStreams:
         except TMS_CustomStreamNotFound:
             return TooManyStreams.create_stream()
 
+    @staticmethod
+    def get_stream_id() -> int:
+        """
+        Returns the id of the custom TooManyStreams stream, creating the stream if needed. Cached after the first lookup.
+        """
+        if TooManyStreams._stream_id is None:
+            TooManyStreams._stream_id = TooManyStreams.get_or_create_stream().id
+        return TooManyStreams._stream_id
+
     @staticmethod
     def add_stream_to_channel(channel_id:int) -> None:
         """
         Adds the custom TooManyStreams stream to the specified channel.
         """
         custom_stream = TooManyStreams.get_or_create_stream()
+        TooManyStreams._stream_id = custom_stream.id
         channel = None
         try:
             channel = Channel.objects.get(id=channel_id)
@@ -172,6 +208,48 @@ class TooManyStreams:
                     )
         logger.info(f"TooManyStreams: Added stream {custom_stream.id} to channel {channel_id}.")
 
+    @staticmethod
+    def install_auto_attach() -> None:
+        """
+        Attaches the TooManyStreams stream to channels as they are created (e.g. by M3U/EPG refreshes),
+        instead of rescanning every channel. Enabled with TMS_AUTO_ATTACH. Safe to call more than once.
+        """
+        if not TooManyStreamsConfig.get_auto_attach_enabled():
+            return
+        from django.db.models.signals import post_save
+
+        post_save.connect(TooManyStreams._on_channel_saved, sender=Channel, dispatch_uid="too_many_streams_auto_attach")
+        logger.info("TooManyStreams: Auto-attaching the stream to new channels.")
+
+    @staticmethod
+    def _on_channel_saved(sender, instance, created: bool = False, raw: bool = False, **kwargs) -> None:
+        """
+        post_save handler for Channel. Only new channels are handled, once their transaction has committed.
+        """
+        if not created or raw:
+            return
+        from django.db import transaction
+
+        transaction.on_commit(lambda: TooManyStreams.attach_stream_to_new_channel(instance.id))
+
+    @staticmethod
+    def attach_stream_to_new_channel(channel_id: int) -> None:
+        """
+        Adds the TooManyStreams stream to the bottom of a newly created channel. Unlike add_stream_to_channel()
+        the channel and its streams aren't loaded: a new channel can't have the stream yet, and get_or_create
+        covers a signal fired twice. Never raises, so it can't break whatever created the channel.
+        """
+        try:
+            _, added = ChannelStream.objects.get_or_create(
+                channel_id=channel_id, stream_id=TooManyStreams.get_stream_id(), defaults={"order": 9999}
+            )
+            if added:
+                logger.info(f"TooManyStreams: Added stream {TooManyStreams._stream_id} to new channel {channel_id}.")
+        except Exception as e:
+            # The cached stream may have been deleted; look it up again next time
+            TooManyStreams._stream_id = None
+            logger.error(f"TooManyStreams: Failed to add stream to new channel {channel_id}: {e}")
+
     @staticmethod   
     def remove_stream_from_channel(channel_id:int) -> None:
         """
@@ -206,13 +284,15 @@ class TooManyStreams:
                 proxy_server.stop_channel(channel.uuid)
                 
                 logger.debug(f"TooManyStreams: ProxyServer stopped channel {channel_id}.")
-                time.sleep(1)
 
                 if result.get("status") == "error":
                     logger.warning(f"TooManyStreams: Failed to stop channel {channel_id}: {result.get('message')}")
+                    time.sleep(1)
                     continue
                 else:
                     logger.info(f"TooManyStreams: Stopped channel {channel_id} successfully.")
+                    # Every further stop would kick the viewers that reconnected in the meantime
+                    break
             except Exception as e:
                 logger.error(f"TooManyStreams: Failed to stop stream for channel {channel_id}: {e}")
                 time.sleep(1)
@@ -237,6 +317,24 @@ class TooManyStreams:
                 pass
         return _tms_last_maxed
 
+    @staticmethod
+    def get_maxed_channel_ids() -> list[str]:
+        """
+        Returns the ids of channels whose maxed-out flag hasn't expired. Expired flags stay in the file until the
+        next cleanup pass or check of the channel.
+        """
+        now = time.time()
+        return [channel_id for channel_id, info in TooManyStreams.get_maxed_data().items() if (info.get("exp_time") or 0) > now]
+
+    @staticmethod
+    def get_maxed_ttl(streak: int) -> float:
+        """
+        Returns how long (seconds) a maxed-out flag lasts after the channel was found saturated `streak` times in a row.
+        Doubles from TMS_MAXED_TTL_SEC with every re-check that finds it still saturated, up to TMS_MAXED_BACKOFF_MAX_SEC.
+        """
+        cap = max(TooManyStreams.TMS_MAXED_TTL_SEC, TooManyStreamsConfig.get_maxed_backoff_max())
+        return min(TooManyStreams.TMS_MAXED_TTL_SEC * 2 ** min(streak, 16), cap)
+
     @staticmethod
     def mark_streams_maxed(channel_id) -> None:
         """
@@ -245,12 +343,12 @@ class TooManyStreams:
         channel_id = str(channel_id)
         logger.info(f"TooManyStreams: Marking channel {channel_id} as maxed")
         # Set a short-lived flag that this channel recently hit maxed-out streams
-        _exp_time = time.time() + TooManyStreams.TMS_MAXED_TTL_SEC
         _tms_last_maxed:dict = TooManyStreams.get_maxed_data()
         if channel_id not in _tms_last_maxed:
-            _tms_last_maxed[channel_id] = {"exp_time": _exp_time, "failed_counter": 1}
+            _tms_last_maxed[channel_id] = {"exp_time": time.time() + TooManyStreams.get_maxed_ttl(0), "failed_counter": 1, "streak": 0}
         else:
-            _tms_last_maxed[channel_id].update({"exp_time": _exp_time, "failed_counter": _tms_last_maxed[channel_id]["failed_counter"] + 1})
+            _streak = _tms_last_maxed[channel_id].get("streak", 0)
+            _tms_last_maxed[channel_id].update({"exp_time": time.time() + TooManyStreams.get_maxed_ttl(_streak), "failed_counter": _tms_last_maxed[channel_id]["failed_counter"] + 1})
         _pkl_path = os.path.dirname(TooManyStreams.TMS_MAXED_PKL)
         if not os.path.exists(_pkl_path):
             os.makedirs(_pkl_path, exist_ok=True)
@@ -261,10 +359,37 @@ class TooManyStreams:
         logger.debug(f"TooManyStreams: Marked channel {channel_id} as maxed until {_tms_last_maxed[channel_id]}")
 
     @staticmethod
-    def is_streams_maxed(channel_id) -> bool:
+    def is_channel_saturated(channel_id) -> bool:
+        """
+        Returns True if every active M3U profile of the channel's streams is at its connection limit,
+        i.e. get_stream could not start a real stream for it right now.
+        """
+        redis_client = RedisClient.get_client()
+        try:
+            channel = Channel.objects.get(id=int(channel_id))
+        except (Channel.DoesNotExist, ValueError):
+            return False
+        has_active_profiles = False
+        for stream in channel.streams.all():
+            m3u_account = stream.m3u_account
+            if not m3u_account:
+                continue
+            for profile in m3u_account.profiles.all():
+                if not profile.is_active:
+                    continue
+                has_active_profiles = True
+                if profile.max_streams == 0 or int(redis_client.get(f"profile_connections:{profile.id}") or 0) < profile.max_streams:
+                    return False
+        return has_active_profiles
+
+    @staticmethod
+    def is_streams_maxed(channel_id, saturated: bool|None = None) -> bool:
         """
         Checks if the specified channel is currently marked as having maxed-out streams.
         Adds the TooManyStreams stream to the channel if maxed, removes it if not.
+        An expired flag on a channel that is still saturated is renewed for longer (see get_maxed_ttl()) instead of
+        being removed, so slate viewers aren't kicked and sent through a reconnect cycle while nothing has changed.
+        `saturated` is whether the caller already knows the channel is saturated; None checks the profiles.
         Returns:
             bool: True if the channel is marked as maxed, False otherwise.
         """
@@ -281,10 +406,20 @@ class TooManyStreams:
                 logger.debug(f"TooManyStreams: Channel {channel_id},_exp_time: {_exp_time}, _failed_counter: {_failed_counter} invalid.")
                 is_maxed = False
             elif _exp_time < time.time():
-                logger.info(f"TooManyStreams: Channel {channel_id} maxed flag expired at {_exp_time}; removing.")
-                _tms_last_maxed.pop(channel_id, None)
-                pickle.dump(_tms_last_maxed, open(TooManyStreams.TMS_MAXED_PKL, "wb"))
-                is_maxed = False
+                if saturated is None and _failed_counter >= TooManyStreams.TMS_MAXED_COUNTER:
+                    saturated = TooManyStreams.is_channel_saturated(channel_id)
+                if saturated and _failed_counter >= TooManyStreams.TMS_MAXED_COUNTER:
+                    _streak = maxed.get("streak", 0) + 1
+                    _ttl = TooManyStreams.get_maxed_ttl(_streak)
+                    logger.info(f"TooManyStreams: Channel {channel_id} still saturated; keeping it maxed for {_ttl:.0f}s.")
+                    maxed.update({"exp_time": time.time() + _ttl, "streak": _streak})
+                    pickle.dump(_tms_last_maxed, open(TooManyStreams.TMS_MAXED_PKL, "wb"))
+                    is_maxed = True
+                else:
+                    logger.info(f"TooManyStreams: Channel {channel_id} maxed flag expired at {_exp_time}; removing.")
+                    _tms_last_maxed.pop(channel_id, None)
+                    pickle.dump(_tms_last_maxed, open(TooManyStreams.TMS_MAXED_PKL, "wb"))
+                    is_maxed = False
             elif _failed_counter < TooManyStreams.TMS_MAXED_COUNTER:
                 logger.debug(f"TooManyStreams: Channel {channel_id} has only {_failed_counter} failed attempts; below threshold of {TooManyStreams.TMS_MAXED_COUNTER}. Not marking as maxed.")
                 is_maxed = False
@@ -297,13 +432,37 @@ class TooManyStreams:
         
         if is_maxed:
             logger.debug(f"TooManyStreams: Channel {channel_id} is currently marked as maxed")
-            TooManyStreams.add_stream_to_channel(channel_id)
+            with HotPathProfiler.section("side_effects"):
+                TooManyStreams.add_stream_to_channel(channel_id)
         else:
             logger.debug(f"TooManyStreams: Channel {channel_id} is NOT marked as maxed")
-            TooManyStreams.remove_stream_from_channel(channel_id)
+            with HotPathProfiler.section("side_effects"):
+                TooManyStreams.remove_stream_from_channel(channel_id)
 
         return is_maxed
     
+    @staticmethod
+    def cleanup_maxed_channels() -> None:
+        """
+        One pass of the cleanup thread: re-checks every channel with a maxed-out flag, which removes expired flags.
+        A renewed flag (streak > 0) can last up to TMS_MAXED_BACKOFF_MAX_SEC, so its channel is checked for free
+        capacity before it expires too, and released as soon as a profile has room again.
+        """
+        logger.debug("TooManyStreams: Cleanup thread running.")
+        _tms_last_maxed:dict = TooManyStreams.get_maxed_data()
+        logger.debug(f"TooManyStreams: Cleanup loaded maxed data: {_tms_last_maxed}")
+        for channel_id in list(_tms_last_maxed.keys()):
+            maxed = _tms_last_maxed[channel_id]
+            if (isinstance(maxed, dict) and maxed.get("streak", 0) > 0 and (maxed.get("exp_time") or 0) >= time.time()
+                    and not TooManyStreams.is_channel_saturated(channel_id)):
+                logger.info(f"TooManyStreams: Channel {channel_id} has free capacity again; removing maxed flag.")
+                _tms_last_maxed.pop(channel_id, None)
+                pickle.dump(_tms_last_maxed, open(TooManyStreams.TMS_MAXED_PKL, "wb"))
+                TooManyStreams.remove_stream_from_channel(channel_id)
+            else:
+                TooManyStreams.is_streams_maxed(channel_id)  # This will remove expired entries
+            logger.debug(f"TooManyStreams: Cleanup checked channel {channel_id}")
+
     @staticmethod
     def start_maxed_channel_cleanup_thread():
         """
@@ -312,18 +471,129 @@ class TooManyStreams:
         logger.info("TooManyStreams: Starting maxed channel cleanup thread.")
         def _cleanup_thread():
             while True:
-                logger.debug("TooManyStreams: Cleanup thread running.")
-                _tms_last_maxed:dict = TooManyStreams.get_maxed_data()
-                logger.debug(f"TooManyStreams: Cleanup loaded maxed data: {_tms_last_maxed}")
-                for channel_id in list(_tms_last_maxed.keys()):
-                    TooManyStreams.is_streams_maxed(channel_id)  # This will remove expired entries
-                    logger.debug(f"TooManyStreams: Cleanup checked channel {channel_id}")
+                TooManyStreams.cleanup_maxed_channels()
                 # !!WARNING: if the stream length is shorter then the cleanup interval, Dispatcharr can go into an infinite loop of reconnects / channel switches.
                 time.sleep(TooManyStreams.TMS_MAXED_TTL_SEC)
         threading.Thread(target=_cleanup_thread, daemon=True).start()
         logger.info("TooManyStreams: Started maxed channel cleanup thread.")
 
 
+    @staticmethod
+    def start_active_channel_watcher(image_path: str|None = None) -> None:
+        """
+        Tracks active channels through Redis keyspace notifications and re-renders the slate
+        as soon as the set of active channels changes, so it is ready before a viewer asks for it.
+        Not used for a static image, which doesn't depend on active channels.
+        """
+        if image_path and os.path.exists(image_path):
+            return
+        if not TooManyStreamsConfig.get_channel_events_enabled():
+            logger.info("TooManyStreams: Channel events disabled; active channels are scanned per request.")
+            return
+        if not ActiveChannelWatcher.start(on_change=lambda: TooManyStreams.prewarm_slate(image_path)):
+            logger.warning("TooManyStreams: Keyspace notifications unavailable; active channels are scanned per request.")
+
+    @staticmethod
+    def start_static_slate(image_path: str|None = None) -> None:
+        """
+        Precompiles the slate of a static image (TMS_IMAGE_PATH) and keeps it in memory, re-encoding it only
+        when the image changes, so serving it costs next to nothing per viewer. Not used for the dynamic slate.
+        """
+        if not image_path or not os.path.exists(image_path):
+            return
+
+        def _build(fingerprint: str, rendition: str) -> bytes:
+            # Another node may have encoded the same image already
+            if ts_bytes := SlateStore.get(fingerprint, "ts"):
+                LiveSlate.publish(rendition, fingerprint, ts_bytes)
+                return ts_bytes
+            return TooManyStreams._build_slate_locked(None, image_path, fingerprint, rendition)
+
+        StaticSlate.start(image_path, _build)
+
+    @staticmethod
+    def start_slate_warmup(image_path: str|None = None) -> None:
+        """
+        Warms the slate cache in the background at startup, so the first saturation after a restart doesn't wait
+        for a render: the slate for the current active channels and the one for an empty channel list, in every
+        rendition. Slates rendered before the restart are loaded from the on-disk ArtifactCache instead of being
+        rendered again. A static image is warmed by StaticSlate instead.
+        """
+        if StaticSlate.serves(image_path):
+            return
+
+        def _warmup():
+            start = time.perf_counter()
+            rendered = 0
+            # A static image has no channel list; if it is missing, the dynamic slate is served instead
+            static = bool(image_path and os.path.exists(image_path))
+            for empty in (False,) if static else (False, True):
+                try:
+                    asig, source_image, base_fingerprint = TooManyStreams._slate_source(image_path, empty=empty)
+                    for rendition in TooManyStreamsConfig.get_renditions():
+                        fingerprint = SlateStore.derive(base_fingerprint, rendition)
+                        # From Redis, else from disk (which also puts it back into Redis)
+                        ts_bytes = SlateStore.get(fingerprint, "ts")
+                        Metrics.cache_result("encode", hit=ts_bytes is not None)
+                        if ts_bytes and not empty:
+                            LastGoodSlate.confirm(rendition, fingerprint, ts_bytes)
+                        elif not ts_bytes:
+                            TooManyStreams._build_slate_locked(asig, source_image, fingerprint, rendition, publish=not empty)
+                            rendered += 1
+                except Exception as e:
+                    logger.warning(f"TooManyStreams: Slate warm-up failed ({'empty' if empty else 'current'} channel list): {e}")
+            logger.info(f"TooManyStreams: Warmed slate cache in {time.perf_counter() - start:.1f}s ({rendered} rendered)")
+
+        threading.Thread(target=_warmup, name="TMSSlateWarmup", daemon=True).start()
+
+    @staticmethod
+    def start_saturation_watcher(image_path: str|None = None) -> None:
+        """
+        Pre-warms the slate once any M3U profile gets within TMS_PREWARM_HEADROOM connections of its limit,
+        so the first refused viewer is served from cache instead of a cold render.
+        """
+        if not TooManyStreamsConfig.get_prewarm_enabled():
+            return
+        # Active channels seen by the last pass without the channel watcher
+        last_scan: dict = {"channel_ids": None}
+
+        def _channels_changed() -> bool:
+            # Without the channel watcher nothing else keeps the slate current while profiles stay saturated.
+            # A SCAN is much cheaper than the discovery of a re-render, so only re-render when the channels changed.
+            if ActiveChannelWatcher.is_running():
+                last_scan["channel_ids"] = None
+                return False
+            channel_ids = ActiveChannelWatcher.scan_active_channel_ids()
+            changed = channel_ids != last_scan["channel_ids"]
+            last_scan["channel_ids"] = channel_ids
+            return changed
+
+        SaturationWatcher.start(
+            on_near_saturation=lambda: TooManyStreams.prewarm_slate(image_path),
+            refresh_while_saturated=_channels_changed,
+        )
+
+    @staticmethod
+    def start_saturation_stats_sampler() -> None:
+        """
+        Samples profile usage, maxed-out channels and slate viewers for the saturation stats (see SaturationStats).
+        """
+        def _sample_state() -> tuple[dict, list, int]:
+            maxed = TooManyStreams.get_maxed_channel_ids()
+            # Only counts this process's viewers: direct deliveries (TMS_DELIVERY=direct) in other workers are missing
+            return SaturationWatcher.get_profile_usage(), maxed, int(Metrics.CLIENTS_ACTIVE.value())
+        SaturationStats.start_sampler(_sample_state)
+
+    @staticmethod
+    def install_proxy_feed(image_path: str|None = None) -> None:
+        """
+        With TMS_DELIVERY=direct, channels on the slate get it straight into their ts_proxy stream buffer
+        instead of pulling /stream.ts over HTTP, see ProxyFeed.
+        """
+        if TooManyStreamsConfig.get_delivery() != "direct":
+            return
+        ProxyFeed.install(lambda buffer, rendition, stopped: TooManyStreams.feed_proxy_buffer(buffer, image_path, rendition, stopped))
+
     @staticmethod
     def install_get_stream_override():
         # Import the class that owns get_stream
@@ -335,16 +605,22 @@ class TooManyStreams:
             def _wrapped_get_stream(self, *args, **kwargs):
                 """
                 Finds an available stream for the requested channel and returns the selected stream and profile.
+                A sample of calls is profiled, see HotPathProfiler / TMS_PROFILE_SAMPLE_RATE.
 
                 Returns:
                     Tuple[Optional[int], Optional[int], Optional[str]]: (stream_id, profile_id, error_reason)
                 """
+                with HotPathProfiler.call():
+                    return _get_stream(self, *args, **kwargs)
 
-                redis_client = RedisClient.get_client()
+            def _get_stream(self, *args, **kwargs):
+                redis_client = HotPathProfiler.redis(RedisClient.get_client())
                 error_reason = None
 
                 # Check if this channel has any streams
-                if not self.streams.exists():
+                with HotPathProfiler.section("db"):
+                    has_streams = self.streams.exists()
+                if not has_streams:
                     error_reason = "No streams assigned to channel"
                     return None, None, error_reason
 
@@ -370,19 +646,24 @@ class TooManyStreams:
                 # No existing active stream, attempt to assign a new one
                 has_streams_but_maxed_out = False
                 has_active_profiles = False
+                maxed_profile_ids = []
 
                 # Iterate through channel streams and their profiles
-                for stream in self.streams.all().order_by("channelstream__order"):
+                with HotPathProfiler.section("db"):
+                    streams = list(self.streams.all().order_by("channelstream__order"))
+                for stream in streams:
                     # ### TooManyStreams logic here ###
                     # TooManyStreams.is_streams_maxed(self.id)
                     # ### TooManyStreams END logic here ###
                     # Retrieve the M3U account associated with the stream.
-                    m3u_account = stream.m3u_account
+                    with HotPathProfiler.section("db"):
+                        m3u_account = stream.m3u_account
                     if not m3u_account:
                         logger.debug(f"Stream {stream.id} has no M3U account")
                         continue
 
-                    m3u_profiles = m3u_account.profiles.all()
+                    with HotPathProfiler.section("db"):
+                        m3u_profiles = list(m3u_account.profiles.all())
                     default_profile = next(
                         (obj for obj in m3u_profiles if obj.is_default), None
                     )
@@ -429,6 +710,7 @@ class TooManyStreams:
                         else:
                             # This profile is at max connections
                             has_streams_but_maxed_out = True
+                            maxed_profile_ids.append(profile.id)
                             logger.debug(
                                 f"Profile {profile.id} at max connections: {current_connections}/{profile.max_streams}"
                             )
@@ -436,12 +718,19 @@ class TooManyStreams:
                 # No available streams - determine specific reason
                 if has_streams_but_maxed_out:
                     #### TooManyStreams logic here ####
-                    if not TooManyStreams.is_streams_maxed(self.id):
+                    with HotPathProfiler.section("maxed"):
+                        is_maxed = TooManyStreams.is_streams_maxed(self.id, saturated=True)
+                    # Counted in memory and flushed in the background, see SaturationStats
+                    SaturationStats.record_refusal(self.id, maxed_profile_ids, slate=is_maxed)
+                    if not is_maxed:
                         error_reason = "All M3U profiles have reached maximum connection limits" 
-                        TooManyStreams.mark_streams_maxed(self.id)
+                        with HotPathProfiler.section("maxed"):
+                            TooManyStreams.mark_streams_maxed(self.id)
                         return None, None, error_reason
                     
-                    return stream.id, profile.id, None
+                    # `streams` was listed before the TooManyStreams stream may have been added, so don't rely on it being last
+                    with HotPathProfiler.section("db"):
+                        return TooManyStreams.get_stream_id(), profile.id, None
                     #### TooManyStreams END logic here ####
                 elif has_active_profiles:
                     error_reason = "No compatible profile found for any assigned stream"
@@ -474,6 +763,431 @@ class TooManyStreams:
             logger.info(f"TooManyStreams: Removed from channel {channel.id}")
 
 
+    @staticmethod
+    def ffmpeg_or_die() -> str:
+        exe = shutil.which("ffmpeg")
+        if not exe:
+            sys.exit("ERROR: ffmpeg not found in PATH. Install ffmpeg and try again.")
+        return exe
+
+    @staticmethod
+    def encoder_available(name: str) -> bool:
+        """
+        Best-effort check whether ffmpeg provides the given encoder. See Capabilities, which caches the probe on disk.
+        """
+        return Capabilities.has_encoder(name)
+
+    @staticmethod
+    def get_stream_length_secs() -> int:
+        """
+        Returns the length of the slate stream in seconds.
+        """
+        # !!WARNING: if the stream length is shorter then the cleanup interval, Dispatcharr can go into an infinite loop of reconnects / channel switches.
+        return TooManyStreams.TMS_MAXED_TTL_SEC * 2
+
+    @staticmethod
+    def make_ffmpeg_cmd(img: str, stream_ts: str, concat: bool = False, rendition: str|None = None,
+                        raw: tuple[int, int, str]|None = None) -> list[str]:
+        """
+        Builds the ffmpeg command that encodes a still image into an MPEG-TS file.
+        With `concat`, `img` is an ffmpeg concat list and the pages in it are encoded as a slideshow.
+        With `raw` (width, height, input frame rate), `img` is read as raw bgr24 frames, e.g. "pipe:0" for stdin.
+        The output size and bitrates come from `rendition` (default rendition if None).
+        """
+        stream_length_secs = TooManyStreams.get_stream_length_secs()
+        fps = TooManyStreams.FPS
+        _, r = TooManyStreamsConfig.get_rendition(rendition)
+        v_bitrate = r["v_bitrate"]
+        # Fit any input (e.g. a static image) into the rendition size, keeping its aspect ratio
+        scale = (f"scale={r['width']}:{r['height']}:force_original_aspect_ratio=decrease,"
+                 f"pad={r['width']}:{r['height']}:(ow-iw)/2:(oh-ih)/2,format=yuv420p")
+        if raw:
+            video_in = ["-f","rawvideo","-pix_fmt","bgr24","-s",f"{raw[0]}x{raw[1]}","-framerate",raw[2],"-i",img]
+        elif concat:
+            video_in = ["-f","concat","-safe","0","-i",img]
+        else:
+            video_in = ["-loop","1","-framerate",str(fps),"-i",img]
+        # Encoders come from the capability registry: the best one the installed ffmpeg provides
+        v_codec = Capabilities.video_encoder()
+        v_codec_args = ["-c:v",v_codec]
+        if v_codec == "libx264":
+            v_codec_args += ["-preset","ultrafast","-tune","stillimage"]
+        in_args = [
+            *video_in,
+            "-f","lavfi","-i","anullsrc=r=48000:cl=stereo",
+            "-vf",scale,
+            *v_codec_args,"-r",str(fps),"-g",str(fps),"-keyint_min",str(fps),
+            "-b:v",v_bitrate,"-maxrate",v_bitrate,"-minrate",v_bitrate,"-bufsize",r["bufsize"],
+            "-c:a",Capabilities.audio_encoder(),"-b:a",TooManyStreams.A_BITRATE,
+            "-muxrate",r["muxrate"],"-fflags","+genpts", "-mpegts_flags", "+resend_headers+initial_discontinuity", "-t", f"{stream_length_secs}", "-f","mpegts", stream_ts
+        ]
+
+        # Return the full command
+        return [TooManyStreams.ffmpeg_or_die(), *in_args]
+
+    @staticmethod
+    def _write_slideshow_list(imgs: list[str], list_path: str) -> None:
+        """
+        Writes an ffmpeg concat list that cycles through the page images, each shown for
+        TMS_SLATE_PAGE_DWELL_SEC, for the whole stream length.
+        """
+        dwell = TooManyStreamsConfig.get_slate_page_dwell()
+        entries = []
+        shown = 0
+        while shown < TooManyStreams.get_stream_length_secs():
+            for img in imgs:
+                entries.append(f"file '{img}'\nduration {dwell}")
+                shown += dwell
+        # The concat demuxer ignores the duration of the last entry unless the file is repeated
+        entries.append(f"file '{imgs[-1]}'")
+        with open(list_path, "w") as f:
+            f.write("\n".join(entries) + "\n")
+
+    @staticmethod
+    def _map_pages(asig: ActiveStreamImgGen, rendition: str|None, render_page) -> list:
+        """
+        Splits the slate into pages sized for the rendition and calls `render_page(index, page)` for each, in parallel.
+        Returns the results in page order.
+        """
+        _, r = TooManyStreamsConfig.get_rendition(rendition)
+        pages = asig.paginate(TooManyStreamsConfig.get_slate_page_size())
+        for page in pages:
+            page.width, page.height, page.quality = r["width"], r["height"], r["jpg_quality"]
+
+        if len(pages) == 1:
+            return [render_page(0, pages[0])]
+        # wkhtmltoimage runs as a subprocess, so threads are enough to render pages in parallel.
+        # Each page runs in a copy of the caller's context, so it is cancelled along with the caller (see ProcessSupervisor)
+        with ThreadPoolExecutor(max_workers=min(len(pages), TooManyStreamsConfig.get_render_workers())) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, render_page, index, page) for index, page in enumerate(pages)]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def _render_pages(asig: ActiveStreamImgGen, out_dir: str, rendition: str|None = None) -> list[str]:
+        """
+        Renders each slate page to a JPG of the rendition's size in `out_dir`, in parallel.
+        Pages are cached in the SlateStore by their own fingerprint, so only pages whose channels changed are rendered.
+        Returns the page image paths in order.
+        """
+        def _render_page(index: int, page: ActiveStreamImgGen) -> str:
+            page.out_path = os.path.join(out_dir, f"page_{index}.jpg")
+            page_fingerprint = page.fingerprint()
+            jpg_bytes = SlateStore.get(page_fingerprint, "jpg")
+            Metrics.cache_result("render", hit=jpg_bytes is not None)
+            if jpg_bytes is None:
+                # Rendered in memory over pipes; the only file written is ffmpeg's input in our private temp dir
+                with Metrics.RENDER.time():
+                    jpg_bytes = page.rasterize(page.html_doc())
+                SlateStore.put(page_fingerprint, "jpg", jpg_bytes)
+            with open(page.out_path, "wb") as f:
+                f.write(jpg_bytes)
+            return page.out_path
+
+        return TooManyStreams._map_pages(asig, rendition, _render_page)
+
+    @staticmethod
+    def _render_frames(asig: ActiveStreamImgGen, rendition: str|None = None) -> list[tuple[int, int, bytes]]:
+        """
+        Renders each slate page to a raw bgr24 frame of the rendition's size, in parallel.
+        Frames are cached in the SlateStore zlib-compressed (flat slate graphics compress well), so a cache
+        hit is already in ffmpeg's input format.
+        Returns (width, height, frame bytes) per page, in order.
+        """
+        def _render_page(index: int, page: ActiveStreamImgGen) -> tuple[int, int, bytes]:
+            page_fingerprint = page.fingerprint()
+            cached = SlateStore.get(page_fingerprint, "bgr24")
+            Metrics.cache_result("render", hit=cached is not None)
+            if cached is not None:
+                width, height = struct.unpack_from("<II", cached)
+                return width, height, zlib.decompress(cached[8:])
+            with Metrics.RENDER.time():
+                width, height, frame = page.render_frame(page.html_doc())
+            SlateStore.put(page_fingerprint, "bgr24", struct.pack("<II", width, height) + zlib.compress(frame, 1))
+            return width, height, frame
+
+        return TooManyStreams._map_pages(asig, rendition, _render_page)
+
+    @staticmethod
+    def _raw_slideshow(frames: list[tuple[int, int, bytes]]) -> tuple[bytes, tuple[int, int, str]]:
+        """
+        Lays out the page frames as raw ffmpeg input: each page shown for TMS_SLATE_PAGE_DWELL_SEC, cycling for
+        the whole stream length. ffmpeg duplicates frames up to the output frame rate, so one input frame per dwell is enough.
+        Returns: (stdin bytes, (width, height, input frame rate)) for make_ffmpeg_cmd(raw=...)
+        """
+        width, height, _ = frames[0]
+        if any((w, h) != (width, height) for w, h, _ in frames):
+            raise TMS_SlateBuildError(f"Slate pages rendered at different sizes: {[(w, h) for w, h, _ in frames]}")
+        length = TooManyStreams.get_stream_length_secs()
+        # A single page is one frame for the whole stream
+        dwell = length if len(frames) == 1 else TooManyStreamsConfig.get_slate_page_dwell()
+        # One extra frame so the last dwell isn't cut short
+        count = -(-length // dwell) + 1
+        sequence = [frames[i % len(frames)][2] for i in range(count)]
+        return b"".join(sequence), (width, height, f"1/{dwell}")
+
+    @staticmethod
+    def _render_and_encode(asig: ActiveStreamImgGen|None, image_path: str|None, rendition: str|None = None) -> bytes:
+        """
+        Renders the slate pages (unless a static image is used) and encodes them to MPEG-TS in the given rendition.
+        Rendered pages are handed to ffmpeg as raw frames over stdin, or as JPG files (see TMS_FRAME_HANDOFF).
+        Returns:
+            bytes: The MPEG-TS stream.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            stream_ts = os.path.join(td, "no_streams.ts")
+            stdin_bytes = None
+            if asig is None:
+                cmd = TooManyStreams.make_ffmpeg_cmd(image_path, stream_ts, rendition=rendition)
+            elif TooManyStreamsConfig.get_frame_handoff() == "raw":
+                frames = TooManyStreams._render_frames(asig, rendition)
+                stdin_bytes, raw = TooManyStreams._raw_slideshow(frames)
+                cmd = TooManyStreams.make_ffmpeg_cmd("pipe:0", stream_ts, rendition=rendition, raw=raw)
+            else:
+                imgs = TooManyStreams._render_pages(asig, td, rendition)
+                if len(imgs) == 1:
+                    cmd = TooManyStreams.make_ffmpeg_cmd(imgs[0], stream_ts, rendition=rendition)
+                else:
+                    list_path = os.path.join(td, "pages.txt")
+                    TooManyStreams._write_slideshow_list(imgs, list_path)
+                    cmd = TooManyStreams.make_ffmpeg_cmd(list_path, stream_ts, concat=True, rendition=rendition)
+
+            logger.debug(f"Running ffmpeg command: {' '.join(cmd)}")
+            timeout = TooManyStreamsConfig.get_encode_timeout()
+            try:
+                with Metrics.ENCODE.time():
+                    gen_ts = ProcessSupervisor.run(cmd, timeout, input=stdin_bytes)
+            except subprocess.TimeoutExpired:
+                raise TMS_SlateBuildError(f"ffmpeg did not finish within {timeout}s and was killed")
+            if gen_ts.returncode != 0 or not os.path.exists(stream_ts):
+                raise TMS_SlateBuildError(f"ffmpeg failed with code {gen_ts.returncode}: {gen_ts.stderr[-500:]!r}")
+
+            with open(stream_ts, "rb") as f:
+                return f.read()
+
+    @staticmethod
+    def build_slate(image_path: str|None = None, rendition: str|None = None) -> tuple[str, bytes]:
+        """
+        Returns (fingerprint, MPEG-TS bytes) of the slate for the current set of active channels, in the given rendition.
+        Artifacts are shared via SlateStore: if another node already rendered the same fingerprint the bytes
+        are reused, and a short render lock makes sure only one node renders a given fingerprint.
+        While a new slate renders, or if looking up the channels fails, the last good slate is returned (see LastGoodSlate).
+        """
+        rendition, _ = TooManyStreamsConfig.get_rendition(rendition)
+        if static := StaticSlate.get(image_path, rendition):
+            Metrics.cache_result("encode", hit=True)
+            return static
+        try:
+            asig, image_path, fingerprint = TooManyStreams._slate_source(image_path)
+        except Exception as e:
+            if stale := TooManyStreams._stale_on_error(rendition, e):
+                return stale
+            raise
+        fingerprint = SlateStore.derive(fingerprint, rendition)
+
+        ts_bytes = SlateStore.get(fingerprint, "ts")
+        Metrics.cache_result("encode", hit=ts_bytes is not None)
+        if ts_bytes:
+            LastGoodSlate.confirm(rendition, fingerprint, ts_bytes)
+            # Rendered elsewhere or earlier; live viewers switch to it if they are on an older one
+            LiveSlate.publish(rendition, fingerprint, ts_bytes)
+            return fingerprint, ts_bytes
+        return TooManyStreams._render_or_stale(asig, image_path, fingerprint, rendition)
+
+    @staticmethod
+    def build_hls(image_path: str|None = None, rendition: str|None = None) -> tuple[str, list[float]]:
+        """
+        Returns (fingerprint, segment durations) of the HLS version of the current slate in the given rendition.
+        The slate is segmented once per fingerprint; later calls only read the small segment index.
+        Players poll the playlist every few seconds, so the slate found is reused for one segment duration (or
+        until the active channels change, if the channel watcher runs) instead of discovering it for every poll.
+        """
+        rendition, _ = TooManyStreamsConfig.get_rendition(rendition)
+        if static := StaticSlate.get(image_path, rendition):
+            fingerprint, ts_bytes = static
+            durations = HlsSlate.get_index(fingerprint)
+            Metrics.cache_result("hls", hit=durations is not None)
+            if durations is None:
+                durations = HlsSlate.store(fingerprint, ts_bytes, TooManyStreams.get_stream_length_secs())
+            return fingerprint, durations
+        cache_key = (image_path, rendition)
+        if (latest := TooManyStreams._hls_latest.get(cache_key)) is not None \
+                and time.monotonic() - latest["at"] < TooManyStreamsConfig.get_hls_segment_sec() \
+                and not (ActiveChannelWatcher.is_running() and ActiveChannelWatcher.generation() != latest["generation"]) \
+                and (durations := HlsSlate.get_index(latest["fingerprint"])) is not None:
+            Metrics.cache_result("hls", hit=True)
+            return latest["fingerprint"], durations
+        # Taken before the discovery, so a change while it runs isn't missed
+        latest = {"at": time.monotonic(), "generation": ActiveChannelWatcher.generation()}
+        fingerprint, durations = TooManyStreams._build_hls_dynamic(image_path, rendition)
+        TooManyStreams._hls_latest[cache_key] = {"fingerprint": fingerprint, **latest}
+        return fingerprint, durations
+
+    @staticmethod
+    def _build_hls_dynamic(image_path: str|None, rendition: str) -> tuple[str, list[float]]:
+        """
+        build_hls() for the dynamic slate: discovers the current slate, then segments it unless that's done.
+        """
+        try:
+            asig, image_path, fingerprint = TooManyStreams._slate_source(image_path)
+            fingerprint = SlateStore.derive(fingerprint, rendition)
+        except Exception as e:
+            if not (stale := TooManyStreams._stale_on_error(rendition, e)):
+                raise
+            asig, (fingerprint, ts_bytes) = None, stale
+        else:
+            ts_bytes = None
+
+        durations = HlsSlate.get_index(fingerprint)
+        Metrics.cache_result("hls", hit=durations is not None)
+        if durations is not None:
+            return fingerprint, durations
+        if ts_bytes is None:
+            ts_bytes = SlateStore.get(fingerprint, "ts")
+            Metrics.cache_result("encode", hit=ts_bytes is not None)
+            if ts_bytes:
+                LastGoodSlate.confirm(rendition, fingerprint, ts_bytes)
+            else:
+                fingerprint, ts_bytes = TooManyStreams._render_or_stale(asig, image_path, fingerprint, rendition)
+                if (durations := HlsSlate.get_index(fingerprint)) is not None:
+                    return fingerprint, durations
+        return fingerprint, HlsSlate.store(fingerprint, ts_bytes, TooManyStreams.get_stream_length_secs())
+
+    @staticmethod
+    def _render_or_stale(asig: ActiveStreamImgGen|None, image_path: str|None, fingerprint: str, rendition: str) -> tuple[str, bytes]:
+        """
+        Returns (fingerprint, TS bytes) of the slate rendered now, or of the last good slate while this one
+        renders in the background, if the last good one is recent enough (TMS_MAX_STALE_SEC).
+        """
+        if stale := LastGoodSlate.get(rendition):
+            logger.debug(f"TooManyStreams: Serving slate {stale[0][:12]} while {fingerprint[:12]} ({rendition}) renders")
+            Metrics.STALE_SERVED.inc(reason="rendering")
+            LastGoodSlate.revalidate(
+                fingerprint, lambda: TooManyStreams._build_slate_locked(asig, image_path, fingerprint, rendition)
+            )
+            return stale
+        return fingerprint, TooManyStreams._build_slate_locked(asig, image_path, fingerprint, rendition)
+
+    @staticmethod
+    def _stale_on_error(rendition: str, error: Exception) -> tuple[str, bytes]|None:
+        """
+        Returns the last good slate to serve instead of failing with `error`, or None if there is none.
+        """
+        if stale := LastGoodSlate.get(rendition):
+            logger.warning(f"TooManyStreams: Failed to look up the current slate; serving the last good one: {error}")
+            Metrics.STALE_SERVED.inc(reason="error")
+        return stale
+
+    @staticmethod
+    def prewarm_slate(image_path: str|None = None) -> None:
+        """
+        Makes sure the slate for the current set of active channels is in the SlateStore in every configured
+        rendition, rendering what is missing. Unlike build_slate(), a cached slate's bytes are not fetched.
+        """
+        if StaticSlate.serves(image_path):
+            return  # Precompiled and kept current by StaticSlate
+        asig, image_path, base_fingerprint = TooManyStreams._slate_source(image_path)
+        for rendition in TooManyStreamsConfig.get_renditions():
+            fingerprint = SlateStore.derive(base_fingerprint, rendition)
+            if SlateStore.exists(fingerprint, "ts"):
+                logger.debug(f"TooManyStreams: Slate {fingerprint[:12]} ({rendition}) already warm.")
+                Metrics.cache_result("encode", hit=True)
+                # Rendered elsewhere; viewers connected here still need it to switch over
+                if LiveSlate.has_viewers(rendition) and LiveSlate.latest_fingerprint(rendition) != fingerprint:
+                    if ts_bytes := SlateStore.get(fingerprint, "ts"):
+                        LiveSlate.publish(rendition, fingerprint, ts_bytes)
+                continue
+            Metrics.cache_result("encode", hit=False)
+            TooManyStreams._build_slate_locked(asig, image_path, fingerprint, rendition)
+
+    @staticmethod
+    def _slate_source(image_path: str|None, empty: bool = False) -> tuple[ActiveStreamImgGen|None, str|None, str]:
+        """
+        Resolves what the slate is built from. With `empty`, it is the dynamic slate for an empty channel list,
+        without looking up active channels.
+        Returns:
+            tuple: (image generator loaded with the active channels or None, static image path or None, fingerprint)
+        """
+        if image_path and os.path.exists(image_path) and not empty:
+            return None, image_path, SlateStore.fingerprint_file(image_path)
+        asig = ActiveStreamImgGen()
+        if not empty:
+            with Metrics.DISCOVERY.time():
+                asig.get_active_streams()
+        fingerprint = SlateStore.derive(
+            asig.fingerprint(), TooManyStreamsConfig.get_slate_page_size(), TooManyStreamsConfig.get_slate_page_dwell()
+        )
+        return asig, None, fingerprint
+
+    @staticmethod
+    def _build_slate_locked(asig: ActiveStreamImgGen|None, image_path: str|None, fingerprint: str, rendition: str,
+                            publish: bool = True) -> bytes:
+        """
+        Renders and stores the slate under the shared render lock, or waits for the node holding it.
+        With `publish`, live viewers switch to it (see LiveSlate); slates built ahead of need aren't published.
+        """
+        token = SlateStore.acquire_render_lock(fingerprint)
+        if token is None:
+            logger.debug(f"TooManyStreams: Slate {fingerprint[:12]} is being rendered by another node; waiting.")
+            if ts_bytes := SlateStore.wait_for(fingerprint, "ts"):
+                if publish:
+                    LastGoodSlate.confirm(rendition, fingerprint, ts_bytes)
+                    LiveSlate.publish(rendition, fingerprint, ts_bytes)
+                return ts_bytes
+            # Lock holder was too slow or died; render locally rather than fail the viewer
+            logger.warning(f"TooManyStreams: Timed out waiting for slate {fingerprint[:12]}; rendering locally.")
+
+        try:
+            ts_bytes = TooManyStreams._render_and_encode(asig, image_path, rendition)
+            SlateStore.put(fingerprint, "ts", ts_bytes)
+        finally:
+            if token is not None:
+                SlateStore.release_render_lock(fingerprint, token)
+        # Viewers already watching switch to it at their next keyframe
+        if publish:
+            LastGoodSlate.confirm(rendition, fingerprint, ts_bytes)
+            LiveSlate.publish(rendition, fingerprint, ts_bytes)
+        logger.info(f"TooManyStreams: Rendered slate {fingerprint[:12]} ({rendition}, {len(ts_bytes)} bytes)")
+        return ts_bytes
+
+    @staticmethod
+    def feed_proxy_buffer(buffer, image_path: str|None, rendition: str|None, stopped) -> None:
+        """
+        Adds the slate to a ts_proxy stream buffer (anything with `add_chunk(bytes)`) in the calling thread,
+        paced like a live /stream.ts, until `stopped()` returns True. Each slate length the current slate is
+        picked up again, as a viewer reconnecting over HTTP would; a failed build is retried.
+        There is no socket to hold the data back, so the feed is always paced, even with TMS_LIVE_UPDATES off.
+        Runs in the worker that runs the channel, so its clients only show in that process's metrics.
+        """
+        rendition, _ = TooManyStreamsConfig.get_rendition(rendition)
+        while not stopped():
+            request_start = time.perf_counter()
+            try:
+                with ProcessSupervisor.cancel_when(stopped):
+                    fingerprint, ts_bytes = TooManyStreams.build_slate(image_path, rendition)
+            except TMS_ProcessCancelled:
+                return
+            except Exception as e:
+                logger.error(f"TMS ERROR: [direct] Slate generation error: {e}")
+                time.sleep(LiveSlate.POLL_SEC)
+                continue
+
+            first_write = True
+
+            def _write(data: bytes):
+                nonlocal first_write
+                buffer.add_chunk(data)
+                if first_write:
+                    Metrics.TTFB.observe(time.perf_counter() - request_start)
+                    first_write = False
+                Metrics.BYTES_SERVED.inc(len(data))
+
+            Metrics.CLIENTS_TOTAL.inc()
+            Metrics.CLIENTS_ACTIVE.inc()
+            try:
+                LiveSlate.stream(rendition, ts_bytes, fingerprint, TooManyStreams.get_stream_length_secs(), _write, stopped)
+            finally:
+                Metrics.CLIENTS_ACTIVE.dec()
+
     @staticmethod
     def stream_still_mpegts_http_thread(
         image_path: str|None = None,
@@ -481,140 +1195,218 @@ class TooManyStreams:
         port: int = 8081,
     ) -> None:
         """
-        Serve an infinite MPEG-TS stream over HTTP. For each client connection, an optional
-        callback `on_client_start()` is invoked BEFORE ffmpeg starts. If the callback returns
-        a string path, that image is used for this client; if it returns None, `image_path`
-        is used.
+        Serve an infinite MPEG-TS stream over HTTP. For each client connection, the slate for the
+        current active channels is fetched from the shared SlateStore, or rendered if missing.
+        If `image_path` is set and exists, that static image is used instead.
 
         Open in VLC: Media -> Open Network Stream -> http://<host>:<port>/stream.ts
         (Default: http://127.0.0.1:8081/stream.ts)
         """
 
-        def ffmpeg_or_die():
-            exe = shutil.which("ffmpeg")
-            if not exe:
-                sys.exit("ERROR: ffmpeg not found in PATH. Install ffmpeg and try again.")
-            return exe
-
         if image_path and not os.path.exists(image_path):
             logger.error(f"TooManyStreams: Image path {image_path} does not exist.")
 
-        ffmpeg_bin = ffmpeg_or_die()
-
-        # Encoding defaults tuned for compatibility + quick startup for a still image
-        fps = 1               # 1 fps. Is still image
-        v_bitrate = "800k"
-        a_bitrate = "96k"
-        muxrate   = "900k"
-        bufsize   = "1600k"
+        TooManyStreams.ffmpeg_or_die()
+        # Detect encoders up front; reuses the on-disk probe from earlier runs unless ffmpeg changed
+        Capabilities.get("ffmpeg")
 
-        # Pre-detect encoders once (best-effort)
-        def encoder_available(name: str) -> bool:
-            try:
-                out = subprocess.check_output([ffmpeg_bin, "-v", "0", "-hide_banner", "-encoders"], text=True)
-                return f" {name} " in out
-            except Exception:
-                return False
-
-        use_aac  = encoder_available("aac")
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_GET(self):
+                if self.path == "/metrics":
+                    self._send_metrics()
+                    return
+                # Only served while profiling is on; it is otherwise reachable by anyone who can reach the slate server
+                if self.path == "/debug/get_stream" and TooManyStreamsConfig.get_profile_sample_rate() > 0:
+                    self._send_json(HotPathProfiler.summary())
+                    return
+                if self.path.split("?")[0] == "/stats/saturation":
+                    self._send_saturation_stats()
+                    return
 
-        # Build the command for a given image
-        def make_ffmpeg_cmd(img: str, stream_ts:str):
+                # Rendition is picked by path (/720/stream.ts) or query (/stream.ts?r=720)
+                url = urlparse(self.path)
+                parts = [part for part in url.path.split("/") if part]
+                rendition = parse_qs(url.query).get("r", [None])[0]
+                # HLS segments: /hls/<fingerprint>/<n>.ts
+                if len(parts) == 3 and parts[0] == "hls" and parts[2].endswith(".ts") and parts[2][:-3].isdigit():
+                    self._send_hls_segment(parts[1], int(parts[2][:-3]))
+                    return
+                hls = bool(parts) and parts[-1] == "stream.m3u8"
+                if parts and parts[-1] in ("stream.ts", "stream.m3u8"):
+                    parts.pop()
+                if len(parts) == 1 and parts[0].rstrip("p") in RENDITIONS:
+                    rendition = rendition or parts[0]
+                    parts.pop()
+                if parts:
+                    self._send_not_found()
+                    return
+                if hls:
+                    self._send_hls_playlist(rendition)
+                    return
 
-            # !!WARNING: if the stream length is shorter then the cleanup interval, Dispatcharr can go into an infinite loop of reconnects / channel switches.
-            stream_length_secs = TooManyStreams.TMS_MAXED_TTL_SEC * 2
-            in_args = [
-                "-loop","1","-framerate",str(fps),"-i",img,
-                "-f","lavfi","-i","anullsrc=r=48000:cl=stereo",
-                "-c:v","libx264","-preset","ultrafast","-tune","stillimage","-r",str(fps),"-g",str(fps),"-keyint_min",str(fps),
-                "-b:v",v_bitrate,"-maxrate",v_bitrate,"-minrate",v_bitrate,"-bufsize",bufsize,
-                "-c:a","aac" if use_aac else "mp2","-b:a",a_bitrate,
-                "-muxrate",muxrate,"-fflags","+genpts", "-mpegts_flags", "+resend_headers+initial_discontinuity", "-t", f"{stream_length_secs}", "-f","mpegts", stream_ts
-            ]
+                request_start = time.perf_counter()
+                Metrics.CLIENTS_TOTAL.inc()
+                Metrics.CLIENTS_ACTIVE.inc()
+                try:
+                    self._stream_slate(rendition, request_start)
+                finally:
+                    Metrics.CLIENTS_ACTIVE.dec()
+
+            def _send_metrics(self):
+                body = Metrics.render(collectors=[
+                    lambda: Metrics.MAXED_CHANNELS.set(len(TooManyStreams.get_maxed_channel_ids())),
+                ]).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
 
-            # Return the full command
-            return [ffmpeg_bin, *in_args]
+            def _send_saturation_stats(self):
+                # Windows by query, e.g. /stats/saturation?window=1h&window=7d (default TMS_STATS_WINDOWS)
+                windows = parse_qs(urlparse(self.path).query).get("window")
+                try:
+                    stats = SaturationStats.report(windows)
+                except ValueError:
+                    self.send_response(400)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                except Exception as e:
+                    logger.error(f"TMS ERROR: [HTTP] Client {self.client_address} saturation stats error: {e}")
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self._send_json(stats)
 
+            def _send_not_found(self):
+                body = b"Not found"
+                self.send_response(404)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
 
-        class Handler(BaseHTTPRequestHandler):
-            protocol_version = "HTTP/1.1"
-            def do_GET(self):
-                if self.path not in ("/", "/stream.ts"):
-                    self.send_response(404)
+            def _send_hls_playlist(self, rendition: str|None):
+                try:
+                    rendition, _ = TooManyStreamsConfig.get_rendition(rendition)
+                    fingerprint, durations = TooManyStreams.build_hls(image_path, rendition)
+                except Exception as e:
+                    logger.error(f"TMS ERROR: [HTTP] Client {self.client_address} HLS playlist error: {e}")
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
                     self.end_headers()
-                    self.wfile.write(b"Not found")
                     return
+                Metrics.HLS_REQUESTS.inc(kind="playlist")
+                body = HlsSlate.playlist(fingerprint, durations, rendition).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+                # Changes every segment; shared caches may hold it for a fraction of that
+                self.send_header("Cache-Control", f"public, max-age={max(1, TooManyStreamsConfig.get_hls_segment_sec() // 2)}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
 
-
-                # Send headers first so VLC starts reading
+            def _send_hls_segment(self, fingerprint: str, index: int):
+                data = HlsSlate.get_segment(fingerprint, index, TooManyStreams.get_stream_length_secs())
+                if data is None:
+                    self._send_not_found()
+                    return
+                Metrics.HLS_REQUESTS.inc(kind="segment")
                 self.send_response(200)
                 self.send_header("Content-Type", "video/mp2t")
-                self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
-                self.send_header("Pragma", "no-cache")
-                # keep-alive fine; the stream is indefinite
-                self.send_header("Connection", "keep-alive")
+                # The URL contains the slate fingerprint, so its content never changes
+                self.send_header("Cache-Control", f"public, max-age={TooManyStreamsConfig.get_slate_cache_ttl()}, immutable")
+                self.send_header("ETag", f'"{fingerprint[:16]}-{index}"')
+                self.send_header("Content-Length", str(len(data)))
                 self.end_headers()
-                # Start ffmpeg for this client
-                stream_ts = os.path.join(os.path.dirname(__file__), "no_streams.ts")
-                if os.path.exists(stream_ts):
-                    os.remove(stream_ts)
-
-                chosen_img = image_path
-                # Generate the image from 
-                if not image_path or not os.path.exists(image_path):
-                    chosen_img = os.path.join(os.path.dirname(__file__), "too_many_streams2.jpg")
-                
-                    try:
-                        asig = ActiveStreamImgGen(out_path=chosen_img)
-                        asig.get_active_streams()
-                        asig.generate()
-                    except Exception as e:
-                        logger.error(f"TMS ERROR: [HTTP] Client {self.client_address} image generation error: {e}", file=sys.stderr)
-                        self.send_response(500)
-                        self.end_headers()
-                        self.wfile.write(b"Failed to generate image")
-                        return
-
-
-                cmd = make_ffmpeg_cmd(chosen_img, stream_ts)
-                logger.debug(f"Running ffmpeg command: {' '.join(cmd)}")
-                # # Generate the stream
-                gen_ts = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                gen_ts.wait()  # wait for process to complete
-                if gen_ts.returncode != 0:
-                    self.send_response(500)
-                    self.end_headers()
-                    self.wfile.write(b"Failed to generate stream")
+                try:
+                    self.wfile.write(data)
+                    Metrics.BYTES_SERVED.inc(len(data))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _send_json(self, data: dict):
+                body = json.dumps(data, indent=2).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream_slate(self, rendition: str|None, request_start: float):
+                # Resolve the slate before any headers, so a failure can still be answered with a real 500.
+                # Usually quick: a cached slate, or the last good one while a new one renders.
+                try:
+                    rendition, _ = TooManyStreamsConfig.get_rendition(rendition)
+                    # Renders and encodes for this viewer are killed if they disconnect while waiting
+                    with ProcessSupervisor.cancel_when(self._client_gone):
+                        fingerprint, ts_bytes = TooManyStreams.build_slate(image_path, rendition)
+                except TMS_ProcessCancelled:
+                    logger.debug(f"TooManyStreams: [HTTP] Client {self.client_address} left before its slate was ready")
                     return
-                else:
-                    gen_ts.terminate()
-                if not os.path.exists(stream_ts):
+                except Exception as e:
+                    logger.error(f"TMS ERROR: [HTTP] Client {self.client_address} slate generation error: {e}")
+                    body = b"Failed to generate stream"
                     self.send_response(500)
+                    self.send_header("Content-Length", str(len(body)))
                     self.end_headers()
-                    self.wfile.write(b"Failed to generate stream")
+                    self.wfile.write(body)
                     return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp2t")
+                self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
+                self.send_header("Pragma", "no-cache")
+                # The body has no length, so the end of the slate is signalled by closing the connection
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                CHUNK = 1316 * 32  # bigger writes help downstream
+                first_write = True
+
+                def _write(data: bytes):
+                    nonlocal first_write
+                    for offset in range(0, len(data), CHUNK):
+                        buf = data[offset:offset + CHUNK]
+                        self.wfile.write(buf)
+                        self.wfile.flush()
+                        if first_write:
+                            Metrics.TTFB.observe(time.perf_counter() - request_start)
+                            first_write = False
+                        Metrics.BYTES_SERVED.inc(len(buf))
+
                 try:
-                    with open(stream_ts, 'rb') as f:
-                        while True:
-                            CHUNK = 1316 * 32  # bigger writes help downstream
-                            buf = f.read(CHUNK)
-                            if not buf:
-                                break
-                            try:
-                                self.wfile.write(buf)
-                                self.wfile.flush()
-                            except (BrokenPipeError, ConnectionResetError):
-                                break
+                    if TooManyStreamsConfig.get_live_updates_enabled():
+                        # Paced in real time, switching to newer slates as they are rendered
+                        LiveSlate.stream(rendition, ts_bytes, fingerprint, TooManyStreams.get_stream_length_secs(),
+                                         _write, self._client_gone)
+                    else:
+                        _write(ts_bytes)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
                 except Exception as e:
-                    logger.error(f"TMS ERROR: [HTTP] Client {self.client_address} stream error: {e}", file=sys.stderr)
+                    logger.error(f"TMS ERROR: [HTTP] Client {self.client_address} stream error: {e}")
                 logger.debug(f"TMS ERROR: [HTTP] Client {self.client_address} disconnected")
 
+            def _client_gone(self) -> bool:
+                """
+                Returns True if the client closed its connection. Clients send nothing after the request,
+                so a readable socket with no data left means it was closed.
+                """
+                try:
+                    readable, _, _ = select.select([self.connection], [], [], 0)
+                    return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+                except (OSError, ValueError):
+                    return True
+
             def log_message(self, fmt, *args):
-                # Quieter server logs
-                return
+                # Quieter server logs; access logs only at debug level. Use /metrics for numbers.
+                logger.debug(f"[HTTP] {self.address_string()} {fmt % args}")
 
         httpd = ThreadingHTTPServer((host, port), Handler)
-        logger.info(f"HTTP MPEG-TS server listening on http://{host}:{port}/stream.ts")
+        logger.info(f"HTTP MPEG-TS server listening on http://{host}:{port}/stream.ts (HLS: /stream.m3u8)")
 
         try:
             httpd.serve_forever()
@@ -622,6 +1414,3 @@ class TooManyStreams:
             logger.info("\nStopping server…")
             httpd.shutdown()
             httpd.server_close()
-
-
-        
\ No newline at end of file
@@ -115,10 +115,19 @@ DEFAULT_CSS = """
     }
 """
 
+# Output renditions of the slate, selectable per client. The page layout is always 1920x1080 and is scaled to the rendition size.
+RENDITIONS = {
+    "1080": {"width": 1920, "height": 1080, "jpg_quality": 92, "v_bitrate": "800k", "muxrate": "900k", "bufsize": "1600k"},
+    "720":  {"width": 1280, "height": 720,  "jpg_quality": 90, "v_bitrate": "500k", "muxrate": "600k", "bufsize": "1000k"},
+    "480":  {"width": 854,  "height": 480,  "jpg_quality": 85, "v_bitrate": "250k", "muxrate": "350k", "bufsize": "500k"},
+}
+
 class TooManyStreamsConfig:
     _STREAM_URL = 'http://{host}:{port}/stream.ts'
     PLUGIN_KEY = 'too_many_streams'
     PERSISTENT_CONFIG_FOLDER = "persistent_config"
+    # (raw TMS_PROFILE_SAMPLE_RATE, parsed rate): read on every get_stream call, so only parsed when it changes
+    _profile_sample_rate: tuple[str|None, float] = (None, 0.0)
 
     @staticmethod
     def get_host_and_port() -> tuple[str, int]:
@@ -134,6 +143,382 @@ class TooManyStreamsConfig:
 
         return (_host, _port)
     
+    @staticmethod
+    def _get_env_int(name: str, default: int) -> int:
+        """
+        Returns the integer value of the environment variable `name`, or `default` if unset or invalid.
+        """
+        try:
+            return int(os.environ.get(name, default))
+        except ValueError:
+            print(f"TooManyStreamsConfig: {name} must be an integer, using {default}")
+            return default
+
+    @staticmethod
+    def _get_env_float(name: str, default: float) -> float:
+        """
+        Returns the float value of the environment variable `name`, or `default` if unset or invalid.
+        """
+        try:
+            return float(os.environ.get(name, default))
+        except ValueError:
+            print(f"TooManyStreamsConfig: {name} must be a number, using {default}")
+            return default
+
+    @staticmethod
+    def get_profile_sample_rate() -> float:
+        """
+        Returns the fraction (0-1) of get_stream calls that are profiled. 0 disables profiling.
+        Uses the TMS_PROFILE_SAMPLE_RATE environment variable if set, otherwise defaults to 0.
+        Parsed (and an invalid value warned about) only when the variable changes, since it is read in the hot path.
+        """
+        raw = os.environ.get("TMS_PROFILE_SAMPLE_RATE")
+        cached_raw, rate = TooManyStreamsConfig._profile_sample_rate
+        if raw != cached_raw:
+            rate = TooManyStreamsConfig._get_env_float("TMS_PROFILE_SAMPLE_RATE", 0.0)
+            TooManyStreamsConfig._profile_sample_rate = (raw, rate)
+        return rate
+
+    @staticmethod
+    def _get_env_bool(name: str, default: bool) -> bool:
+        """
+        Returns the boolean value of the environment variable `name`, or `default` if unset.
+        """
+        _val = os.environ.get(name, None)
+        if _val is None:
+            return default
+        return _val.strip().lower() in ("1", "true", "yes", "on")
+
+    @staticmethod
+    def get_channel_events_enabled() -> bool:
+        """
+        Returns whether active channels are tracked via Redis keyspace notifications instead of a SCAN per request.
+        Uses the TMS_CHANNEL_EVENTS environment variable if set, otherwise defaults to True.
+        """
+        return TooManyStreamsConfig._get_env_bool("TMS_CHANNEL_EVENTS", True)
+
+    @staticmethod
+    def get_channel_events_configure() -> bool:
+        """
+        Returns whether the plugin may add missing keyspace flags to Redis' server-wide notify-keyspace-events setting
+        (CONFIG SET). Without it, the setting is only read, and active channels are scanned if the flags are missing.
+        Uses the TMS_CHANNEL_EVENTS_CONFIGURE environment variable if set, otherwise defaults to False.
+        """
+        return TooManyStreamsConfig._get_env_bool("TMS_CHANNEL_EVENTS_CONFIGURE", False)
+
+    @staticmethod
+    def get_auto_attach_enabled() -> bool:
+        """
+        Returns whether the TooManyStreams stream is attached to every newly created channel (via Django's post_save signal).
+        Uses the TMS_AUTO_ATTACH environment variable if set, otherwise defaults to False.
+        """
+        return TooManyStreamsConfig._get_env_bool("TMS_AUTO_ATTACH", False)
+
+    @staticmethod
+    def get_maxed_backoff_max() -> int:
+        """
+        Returns the longest (seconds) a maxed-out flag is renewed for while its channel stays saturated.
+        Uses the TMS_MAXED_BACKOFF_MAX_SEC environment variable if set, otherwise defaults to 480.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_MAXED_BACKOFF_MAX_SEC", 480)
+
+    @staticmethod
+    def get_prewarm_enabled() -> bool:
+        """
+        Returns whether the slate is pre-warmed when M3U profiles get close to their connection limit.
+        Uses the TMS_PREWARM environment variable if set, otherwise defaults to True.
+        """
+        return TooManyStreamsConfig._get_env_bool("TMS_PREWARM", True)
+
+    @staticmethod
+    def get_prewarm_headroom() -> int:
+        """
+        Returns how many free connections a profile may have left for the slate to be pre-warmed (1 = at max-1).
+        Uses the TMS_PREWARM_HEADROOM environment variable if set, otherwise defaults to 1.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_PREWARM_HEADROOM", 1)
+
+    @staticmethod
+    def get_prewarm_interval() -> int:
+        """
+        Returns how often (seconds) the profile connection counters are checked.
+        Uses the TMS_PREWARM_INTERVAL_SEC environment variable if set, otherwise defaults to 5.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_PREWARM_INTERVAL_SEC", 5)
+
+    @staticmethod
+    def get_stats_enabled() -> bool:
+        """
+        Returns whether saturation stats (refusals, time at max, peak usage) are collected.
+        Uses the TMS_STATS environment variable if set, otherwise defaults to True.
+        """
+        return TooManyStreamsConfig._get_env_bool("TMS_STATS", True)
+
+    @staticmethod
+    def get_stats_bucket_sec() -> int:
+        """
+        Returns the length (seconds) of one saturation stats bucket, the finest resolution of a query.
+        Uses the TMS_STATS_BUCKET_SEC environment variable if set, otherwise defaults to 300.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_STATS_BUCKET_SEC", 300))
+
+    @staticmethod
+    def get_stats_retention_sec() -> int:
+        """
+        Returns how long (seconds) saturation stats buckets are kept.
+        Uses the TMS_STATS_RETENTION_SEC environment variable if set, otherwise defaults to 1209600 (14 days).
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_STATS_RETENTION_SEC", 1209600)
+
+    @staticmethod
+    def get_stats_sample_sec() -> int:
+        """
+        Returns how often (seconds) profile usage is sampled for time at max and peak connections.
+        Uses the TMS_STATS_SAMPLE_SEC environment variable if set, otherwise defaults to 15.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_STATS_SAMPLE_SEC", 15))
+
+    @staticmethod
+    def get_stats_windows() -> list[str]:
+        """
+        Returns the windows the saturation stats report summarises by default.
+        Uses the TMS_STATS_WINDOWS environment variable (comma separated, e.g. "1h,24h,7d") if set, otherwise defaults to "1h,24h,7d".
+        """
+        return [window.strip() for window in os.environ.get("TMS_STATS_WINDOWS", "1h,24h,7d").split(",") if window.strip()]
+
+    @staticmethod
+    def get_static_poll_sec() -> int:
+        """
+        Returns how often (seconds) the static image (TMS_IMAGE_PATH) is checked for changes.
+        Uses the TMS_STATIC_POLL_SEC environment variable if set, otherwise defaults to 5.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_STATIC_POLL_SEC", 5))
+
+    @staticmethod
+    def get_slate_page_size() -> int:
+        """
+        Returns how many channels are shown per slate page. Extra channels rotate onto further pages.
+        Uses the TMS_SLATE_PAGE_SIZE environment variable if set, otherwise defaults to 12.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_SLATE_PAGE_SIZE", 12))
+
+    @staticmethod
+    def get_slate_page_dwell() -> int:
+        """
+        Returns how long (seconds) each slate page is shown before rotating to the next one.
+        Uses the TMS_SLATE_PAGE_DWELL_SEC environment variable if set, otherwise defaults to 10.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_SLATE_PAGE_DWELL_SEC", 10))
+
+    @staticmethod
+    def get_render_workers() -> int:
+        """
+        Returns how many slate pages may be rendered in parallel.
+        Uses the TMS_RENDER_WORKERS environment variable if set, otherwise defaults to 4.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_RENDER_WORKERS", 4))
+
+    @staticmethod
+    def get_render_timeout() -> int:
+        """
+        Returns how long (seconds) wkhtmltoimage may take to render one slate page before it is killed.
+        Uses the TMS_RENDER_TIMEOUT_SEC environment variable if set, otherwise defaults to 30.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_RENDER_TIMEOUT_SEC", 30))
+
+    @staticmethod
+    def get_encode_timeout() -> int:
+        """
+        Returns how long (seconds) ffmpeg may take to encode a slate before it is killed.
+        Uses the TMS_ENCODE_TIMEOUT_SEC environment variable if set, otherwise defaults to 60.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_ENCODE_TIMEOUT_SEC", 60))
+
+    @staticmethod
+    def get_max_processes() -> int:
+        """
+        Returns how many helper processes (wkhtmltoimage, ffmpeg) may run at once.
+        Uses the TMS_MAX_PROCESSES environment variable if set, otherwise defaults to 4.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_MAX_PROCESSES", 4))
+
+    @staticmethod
+    def get_process_nice() -> int:
+        """
+        Returns how much the CPU priority of helper processes is lowered (added to their nice value, 0-19).
+        Uses the TMS_PROCESS_NICE environment variable if set, otherwise defaults to 10.
+        """
+        return min(19, TooManyStreamsConfig._get_env_int("TMS_PROCESS_NICE", 10))
+
+    @staticmethod
+    def get_process_ionice() -> str:
+        """
+        Returns the IO scheduling class of helper processes: "idle", "best-effort" (lowest priority) or "off".
+        Uses the TMS_PROCESS_IONICE environment variable if set, otherwise defaults to "best-effort".
+        """
+        _val = os.environ.get("TMS_PROCESS_IONICE", "best-effort").strip().lower()
+        if _val not in ("idle", "best-effort", "off"):
+            print(f"TooManyStreamsConfig: TMS_PROCESS_IONICE must be idle, best-effort or off, using best-effort")
+            return "best-effort"
+        return _val
+
+    @staticmethod
+    def get_process_cpus() -> set[int]|None:
+        """
+        Returns the CPUs helper processes are pinned to, or None for no pinning.
+        Uses the TMS_PROCESS_CPUS environment variable (e.g. "2,3" or "4-7") if set, otherwise defaults to no pinning.
+        """
+        _val = os.environ.get("TMS_PROCESS_CPUS", "").strip()
+        if not _val:
+            return None
+        cpus = set()
+        try:
+            for part in _val.split(","):
+                first, _, last = part.strip().partition("-")
+                cpus.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            print(f"TooManyStreamsConfig: TMS_PROCESS_CPUS must be a CPU list like 2,3 or 4-7, not pinning")
+            return None
+        return cpus or None
+
+    @staticmethod
+    def get_frame_handoff() -> str:
+        """
+        Returns how rendered slate pages are passed to ffmpeg: "raw" (uncompressed frames over a pipe) or "jpg" (JPEG files).
+        Uses the TMS_FRAME_HANDOFF environment variable if set, otherwise defaults to "raw".
+        """
+        _val = os.environ.get("TMS_FRAME_HANDOFF", "raw").strip().lower()
+        if _val not in ("raw", "jpg"):
+            print(f"TooManyStreamsConfig: TMS_FRAME_HANDOFF must be raw or jpg, using raw")
+            return "raw"
+        return _val
+
+    @staticmethod
+    def get_renditions() -> list[str]:
+        """
+        Returns the names of the slate renditions to serve, the first one being the default.
+        Uses the TMS_RENDITIONS environment variable (comma separated, e.g. "1080,720,480") if set, otherwise defaults to "1080".
+        """
+        _names = [name.strip().lower().rstrip("p") for name in os.environ.get("TMS_RENDITIONS", "1080").split(",")]
+        renditions = []
+        for name in _names:
+            if name in RENDITIONS and name not in renditions:
+                renditions.append(name)
+            elif name:
+                print(f"TooManyStreamsConfig: Ignoring unknown rendition {name!r}, must be one of {list(RENDITIONS)}")
+        return renditions or ["1080"]
+
+    @staticmethod
+    def get_rendition(name: str|None = None) -> tuple[str, dict]:
+        """
+        Returns (name, settings) of the requested rendition, or of the default rendition
+        if `name` is None or not one of the configured renditions.
+        """
+        renditions = TooManyStreamsConfig.get_renditions()
+        name = (name or "").strip().lower().rstrip("p")
+        if name not in renditions:
+            name = renditions[0]
+        return name, RENDITIONS[name]
+
+    @staticmethod
+    def get_live_updates_enabled() -> bool:
+        """
+        Returns whether /stream.ts is sent in real time and switches to newer slates while the viewer watches,
+        instead of being sent in one burst.
+        Uses the TMS_LIVE_UPDATES environment variable if set, otherwise defaults to True.
+        """
+        return TooManyStreamsConfig._get_env_bool("TMS_LIVE_UPDATES", True)
+
+    @staticmethod
+    def get_live_lead_sec() -> int:
+        """
+        Returns how far (seconds) a live slate stream is sent ahead of real time.
+        Uses the TMS_LIVE_LEAD_SEC environment variable if set, otherwise defaults to 4.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_LIVE_LEAD_SEC", 4)
+
+    @staticmethod
+    def get_max_stale_sec() -> int:
+        """
+        Returns how long (seconds) after it stopped being current the last good slate may still be served, while
+        a newer one renders or if rendering fails. 0 disables serving stale slates.
+        Uses the TMS_MAX_STALE_SEC environment variable if set, otherwise defaults to 600.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_MAX_STALE_SEC", 600)
+
+    @staticmethod
+    def get_delivery() -> str:
+        """
+        Returns how the slate reaches Dispatcharr's ts_proxy: "http" (the proxy pulls /stream.ts from the slate
+        server) or "direct" (slate packets are added to the channel's stream buffer in process, see ProxyFeed).
+        Uses the TMS_DELIVERY environment variable if set, otherwise defaults to "http".
+        """
+        _val = os.environ.get("TMS_DELIVERY", "http").strip().lower()
+        if _val not in ("http", "direct"):
+            print(f"TooManyStreamsConfig: TMS_DELIVERY must be http or direct, using http")
+            return "http"
+        return _val
+
+    @staticmethod
+    def get_hls_segment_sec() -> int:
+        """
+        Returns the target length (seconds) of the slate's HLS segments.
+        Uses the TMS_HLS_SEGMENT_SEC environment variable if set, otherwise defaults to 4.
+        """
+        return max(1, TooManyStreamsConfig._get_env_int("TMS_HLS_SEGMENT_SEC", 4))
+
+    @staticmethod
+    def get_hls_window() -> int:
+        """
+        Returns how many segments the slate's live HLS playlist lists.
+        Uses the TMS_HLS_WINDOW environment variable if set, otherwise defaults to 5.
+        """
+        return max(3, TooManyStreamsConfig._get_env_int("TMS_HLS_WINDOW", 5))
+
+    @staticmethod
+    def get_slate_cache_ttl() -> int:
+        """
+        Returns how long (seconds) a rendered slate artifact is kept in the shared Redis store.
+        Uses the TMS_SLATE_CACHE_TTL_SEC environment variable if set, otherwise defaults to 300.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_SLATE_CACHE_TTL_SEC", 300)
+
+    @staticmethod
+    def get_slate_lock_ttl() -> int:
+        """
+        Returns how long (seconds) a node may hold the render lock for a slate fingerprint.
+        Other nodes wait at most this long for the artifact before rendering it themselves.
+        Uses the TMS_SLATE_LOCK_TTL_SEC environment variable if set, otherwise defaults to 30.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_SLATE_LOCK_TTL_SEC", 30)
+
+    @staticmethod
+    def get_artifact_dir() -> str:
+        """
+        Returns the directory of the on-disk slate artifact cache. It is kept outside the plugin folder, next to
+        the persistent config, so reinstalling or updating the plugin doesn't wipe it.
+        Uses the TMS_ARTIFACT_DIR environment variable if set, otherwise defaults to too_many_streams_artifacts
+        in the persistent config folder.
+        """
+        default = os.path.join(os.path.dirname(TooManyStreamsConfig.get_persistent_storage_path()), "too_many_streams_artifacts")
+        return os.environ.get("TMS_ARTIFACT_DIR", default)
+
+    @staticmethod
+    def get_artifact_cache_mb() -> int:
+        """
+        Returns the size cap (MB) of the on-disk slate artifact cache. 0 disables it.
+        Uses the TMS_ARTIFACT_CACHE_MB environment variable if set, otherwise defaults to 256.
+        """
+        return TooManyStreamsConfig._get_env_int("TMS_ARTIFACT_CACHE_MB", 256)
+
+    @staticmethod
+    def get_capability_cache_path() -> str:
+        """
+        Returns the path of the file that caches detected binaries, versions and encoders.
+        Uses the TMS_CAPABILITY_CACHE environment variable if set, otherwise defaults to /dev/shm/TMS/capabilities.json.
+        """
+        return os.environ.get("TMS_CAPABILITY_CACHE", "/dev/shm/TMS/capabilities.json")
+
     @staticmethod
     def get_stream_url() -> str:
         """
@@ -185,8 +570,6 @@ class TooManyStreamsConfig:
         # go up 2 directories
         plugin_dir = os.path.dirname(os.path.dirname(plugin_root_dir))
         config_file = os.path.join(plugin_dir, TooManyStreamsConfig.PERSISTENT_CONFIG_FOLDER, "too_many_streams_persistent_config.json")
-        if not os.path.exists(os.path.dirname(config_file)):
-            os.makedirs(os.path.dirname(config_file), exist_ok=True)
         return config_file
 
     @staticmethod
@@ -212,6 +595,7 @@ class TooManyStreamsConfig:
         """
         config_path = TooManyStreamsConfig.get_persistent_storage_path()
         try:
+            os.makedirs(os.path.dirname(config_path), exist_ok=True)
             with open(config_path, "w") as f:
                 json.dump(config, f, indent=4)
         except Exception as e:
@@ -6,4 +6,10 @@ class TooManyStreamsException(Exception):
 
 class TMS_CustomStreamNotFound(TooManyStreamsException):
     """Raised when a custom stream is not found"""
-    pass
\ No newline at end of file
+    pass
+class TMS_SlateBuildError(TooManyStreamsException):
+    """Raised when the slate image or MPEG-TS stream could not be built"""
+    pass
+class TMS_ProcessCancelled(TooManyStreamsException):
+    """Raised when a helper process was killed because its result is no longer needed"""
+    pass